@@ -6,8 +6,21 @@ import requests
 import os
 import json
 import time
+import hashlib
 from io import StringIO
-
+from scipy.optimize import minimize
+from scipy.stats import qmc
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import threading
+from functools import lru_cache
+import re
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Compile-time switch for the SOC sanity checks in hour_simulation. Numba freezes global values when a function is
+# compiled, so with the default (False) the checks are removed from the hourly loop entirely.
+DEBUG_SOC_CHECKS = False
 
 @numba.njit
 def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, battery_inv_eff, n_dis, n_chg, dod_max,
@@ -36,14 +49,124 @@ def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, b
                         annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max,
                         c_rate_chg=c_rate_chg, c_rate_dis=c_rate_dis)
 
+    lcoe, investment, fuel_cost, om_cost, npc, fuel_usage, annual_om = \
+        hybrid_configuration_costs(battery_life, unmet_demand_share, diesel_generation_share, annual_fuel_consumption,
+                                   pv, battery, diesel, annual_demand, load_curve, diesel_price, end_year, start_year,
+                                   pv_cost, charge_controller, pv_inverter, pv_om, diesel_cost, diesel_om,
+                                   battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                                   discount_rate, lpsp_max, diesel_limit, pv_inverter_life, charge_controller_life,
+                                   battery_om, battery_inverter_om)
+
+    return lcoe, unmet_demand_share, diesel_generation_share, investment, fuel_cost, om_cost, battery, \
+        battery_life, pv, diesel, npc, fuel_usage, annual_om, pv_gen, excess_gen_share, battery_soc_curve, net_load
+
+
+@numba.njit
+def find_least_cost_option_metrics(configuration, temp, ghi, hour_numbers, load_curve, battery_inv_eff, n_dis, n_chg,
+                                   dod_max, diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                   pv_inverter, pv_inv_eff, pv_om, diesel_cost, diesel_om, battery_inverter_life,
+                                   battery_inverter_cost, diesel_life, pv_life, battery_cost, discount_rate, lpsp_max,
+                                   diesel_limit, full_life_cycles, pv_inverter_life=25, charge_controller_life=25,
+                                   c_rate_chg=1, c_rate_dis=1, battery_om=0, battery_inverter_om=0, hour_weights=None):
+    """
+    Same as find_least_cost_option, but the year is simulated with the metrics-only kernel and no hourly curves are
+    returned. This is the version used by the optimizers. The first 13 returned values match find_least_cost_option,
+    followed by the excess generation share.
+
+    If hour_weights is given, each of the hour_numbers counts that many times in the annual totals (see
+    representative_hours).
+    """
+    pv = float(configuration[0])
+    battery = float(configuration[1])
+    usable_battery = battery * dod_max  # ensure the battery never goes below max depth of discharge
+    diesel = float(configuration[2])
+    if diesel < 0.5:
+        diesel = 0
+
+    annual_demand = load_curve.sum()
+
+    net_load, pv_gen = pv_generation(temp, ghi, pv, load_curve, pv_inv_eff)
+
+    if hour_weights is None:
+        diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share = \
+            year_simulation_metrics(usable_battery, diesel, net_load, hour_numbers, battery_inv_eff, n_dis, n_chg,
+                                    annual_demand, full_life_cycles, dod_max, c_rate_chg, c_rate_dis)
+    else:
+        # Without limits on the unmet demand and diesel generation, the whole set of hours is simulated
+        diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share, \
+            hours_simulated = year_simulation_bounded(usable_battery, diesel, net_load, hour_numbers, hour_weights,
+                                                      battery_inv_eff, n_dis, n_chg, annual_demand,
+                                                      full_life_cycles, dod_max, c_rate_chg, c_rate_dis, np.inf,
+                                                      np.inf)
+
+    lcoe, investment, fuel_cost, om_cost, npc, fuel_usage, annual_om = \
+        hybrid_configuration_costs(battery_life, unmet_demand_share, diesel_generation_share, annual_fuel_consumption,
+                                   pv, battery, diesel, annual_demand, load_curve, diesel_price, end_year, start_year,
+                                   pv_cost, charge_controller, pv_inverter, pv_om, diesel_cost, diesel_om,
+                                   battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                                   discount_rate, lpsp_max, diesel_limit, pv_inverter_life, charge_controller_life,
+                                   battery_om, battery_inverter_om)
+
+    return lcoe, unmet_demand_share, diesel_generation_share, investment, fuel_cost, om_cost, battery, \
+        battery_life, pv, diesel, npc, fuel_usage, annual_om, excess_gen_share
+
+
+@numba.njit
+def find_least_cost_option_bounded(configuration, temp, ghi, hour_numbers, hour_weights, load_curve, battery_inv_eff,
+                                   n_dis, n_chg, dod_max, diesel_price, end_year, start_year, pv_cost,
+                                   charge_controller, pv_inverter, pv_inv_eff, pv_om, diesel_cost, diesel_om,
+                                   battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                                   discount_rate, lpsp_max, diesel_limit, full_life_cycles, pv_inverter_life=25,
+                                   charge_controller_life=25, c_rate_chg=1, c_rate_dis=1, battery_om=0,
+                                   battery_inverter_om=0):
+    """
+    Returns only the LCOE of the configuration and the number of hours simulated. The year is simulated with
+    year_simulation_bounded, so infeasible configurations are stopped as soon as they exceed the unmet demand or diesel
+    generation budget. The LCOE is the same as from find_least_cost_option_metrics with the same hour_weights.
+    """
+    pv = float(configuration[0])
+    battery = float(configuration[1])
+    usable_battery = battery * dod_max  # ensure the battery never goes below max depth of discharge
+    diesel = float(configuration[2])
+    if diesel < 0.5:
+        diesel = 0
+
+    annual_demand = load_curve.sum()
+
+    net_load, pv_gen = pv_generation(temp, ghi, pv, load_curve, pv_inv_eff)
+
+    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share, \
+        hours_simulated = year_simulation_bounded(usable_battery, diesel, net_load, hour_numbers, hour_weights,
+                                                  battery_inv_eff, n_dis, n_chg, annual_demand, full_life_cycles,
+                                                  dod_max, c_rate_chg, c_rate_dis, lpsp_max, diesel_limit)
+
+    lcoe = hybrid_configuration_costs(battery_life, unmet_demand_share, diesel_generation_share,
+                                      annual_fuel_consumption, pv, battery, diesel, annual_demand, load_curve,
+                                      diesel_price, end_year, start_year, pv_cost, charge_controller, pv_inverter,
+                                      pv_om, diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
+                                      diesel_life, pv_life, battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                      pv_inverter_life, charge_controller_life, battery_om, battery_inverter_om)[0]
+
+    return lcoe, hours_simulated
+
+
+@numba.njit
+def hybrid_configuration_costs(battery_life, unmet_demand_share, diesel_generation_share, annual_fuel_consumption,
+                               pv, battery, diesel, annual_demand, load_curve, diesel_price, end_year, start_year,
+                               pv_cost, charge_controller, pv_inverter, pv_om, diesel_cost, diesel_om,
+                               battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                               discount_rate, lpsp_max, diesel_limit, pv_inverter_life, charge_controller_life,
+                               battery_om, battery_inverter_om):
     # If the system could meet the demand in a satisfactory manner (i.e. with high enough reliability and low enough
     # share of the generation coming from the diesel generator), then the LCOE is calculated. Else 99 is returned.
     if (battery_life == 0) or (unmet_demand_share > lpsp_max) or (diesel_generation_share > diesel_limit):
-        lcoe = 99
-        investment = 0
-        fuel_cost = 0
-        om_cost = 0
-        npc = 0
+        lcoe = 99.
+        investment = 0.
+        fuel_cost = 0.
+        om_cost = 0.
+        npc = 0.
+        fuel_usage = 0.
+        annual_om = 0.
     else:
         lcoe, investment, battery_investment, fuel_cost, \
             om_cost, npc, fuel_usage, annual_om = calculate_hybrid_lcoe(diesel_price=diesel_price,
@@ -73,8 +196,125 @@ def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, b
                                                   battery_om=battery_om,
                                                   battery_inverter_om=battery_inverter_om)
 
-    return lcoe, unmet_demand_share, diesel_generation_share, investment, fuel_cost, om_cost, battery, \
-        battery_life, pv, diesel, npc, fuel_usage, annual_om, pv_gen, excess_gen_share, battery_soc_curve, net_load
+    return lcoe, investment, fuel_cost, om_cost, npc, fuel_usage, annual_om
+
+
+@numba.njit(parallel=True)
+def find_least_cost_option_batch(configurations, temp, ghi, hour_numbers, hour_weights, load_curve, battery_inv_eff,
+                                 n_dis, n_chg, dod_max, diesel_price, end_year, start_year, pv_cost,
+                                 charge_controller, pv_inverter, pv_inv_eff, pv_om, diesel_cost, diesel_om,
+                                 battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                                 discount_rate, lpsp_max, diesel_limit, full_life_cycles):
+    """
+    Evaluates the LCOE of a whole population of PV-hybrid configurations in one call. The configurations are given as
+    an array of shape (3, N) (PV kW, battery kWh, diesel kW), matching what scipy's differential_evolution passes to
+    the objective function when vectorized=True. The candidates are simulated in parallel over all available threads.
+
+    Infeasible candidates are only simulated until they exceed the unmet demand or diesel generation budget (see
+    year_simulation_bounded). Returns the LCOE and the number of hours simulated for each candidate.
+    """
+    n = configurations.shape[1]
+    lcoe = np.empty(n)
+    hours_simulated = np.empty(n, dtype=np.int64)
+
+    for i in prange(n):
+        lcoe[i], hours_simulated[i] = \
+            find_least_cost_option_bounded(configurations[:, i], temp, ghi, hour_numbers, hour_weights, load_curve,
+                                           battery_inv_eff, n_dis, n_chg, dod_max, diesel_price, end_year,
+                                           start_year, pv_cost,
+                                           charge_controller, pv_inverter, pv_inv_eff, pv_om, diesel_cost,
+                                           diesel_om, battery_inverter_life, battery_inverter_cost, diesel_life,
+                                           pv_life, battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                           full_life_cycles)
+
+    return lcoe, hours_simulated
+
+
+@numba.njit
+def differential_evolution_nb(min_bounds, max_bounds, popsize, maxiter, tol, seed, temp, ghi, hour_numbers,
+                              hour_weights, load_curve, battery_inv_eff, n_dis, n_chg, dod_max, diesel_price,
+                              end_year, start_year, pv_cost, charge_controller, pv_inverter, pv_inv_eff, pv_om,
+                              diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost, diesel_life,
+                              pv_life, battery_cost, discount_rate, lpsp_max, diesel_limit, full_life_cycles):
+    """
+    Differential evolution of the PV-hybrid configuration (PV kW, battery kWh, diesel kW) that runs completely in
+    compiled code, with the same scheme as the scipy defaults: a Latin hypercube initial population of popsize times
+    the number of variables, best1bin with a mutation dithered in [0.5, 1) and a recombination of 0.7, and
+    convergence when the standard deviation of the population LCOE is at most tol times its mean. Each generation is
+    evaluated in parallel with find_least_cost_option_batch. Unlike scipy, the result is not polished.
+
+    A seed of -1 leaves the random generator unseeded. Returns the best configuration, its LCOE, the number of
+    configurations simulated and the total number of hours simulated.
+    """
+    if seed >= 0:
+        np.random.seed(seed)
+
+    recombination = 0.7
+    d = len(min_bounds)
+    n = popsize * d
+    width = max_bounds - min_bounds
+
+    # The population is kept scaled to the unit cube, with one column per member
+    population = np.empty((d, n))
+    for j in range(d):
+        segments = np.random.permutation(n)
+        for i in range(n):
+            population[j, i] = (segments[i] + np.random.random()) / n
+
+    energies, hours = find_least_cost_option_batch(min_bounds.reshape(d, 1) + population * width.reshape(d, 1),
+                                                   temp, ghi, hour_numbers, hour_weights, load_curve, battery_inv_eff,
+                                                   n_dis, n_chg, dod_max, diesel_price, end_year, start_year, pv_cost,
+                                                   charge_controller, pv_inverter, pv_inv_eff, pv_om, diesel_cost,
+                                                   diesel_om, battery_inverter_life, battery_inverter_cost,
+                                                   diesel_life, pv_life, battery_cost, discount_rate, lpsp_max,
+                                                   diesel_limit, full_life_cycles)
+    nfev = n
+    hours_simulated = hours.sum()
+
+    trial = np.empty((d, n))
+    for generation in range(maxiter):
+        best = np.argmin(energies)
+        mutation = 0.5 + 0.5 * np.random.random()
+
+        for i in range(n):
+            r1 = i
+            while r1 == i:
+                r1 = np.random.randint(n)
+            r2 = i
+            while r2 == i or r2 == r1:
+                r2 = np.random.randint(n)
+
+            fill = np.random.randint(d)
+            for j in range(d):
+                if j == fill or np.random.random() < recombination:
+                    value = population[j, best] + mutation * (population[j, r1] - population[j, r2])
+                    if value < 0 or value > 1:
+                        value = np.random.random()
+                    trial[j, i] = value
+                else:
+                    trial[j, i] = population[j, i]
+
+        trial_energies, hours = \
+            find_least_cost_option_batch(min_bounds.reshape(d, 1) + trial * width.reshape(d, 1), temp, ghi,
+                                         hour_numbers, hour_weights, load_curve, battery_inv_eff, n_dis, n_chg,
+                                         dod_max, diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                         pv_inverter, pv_inv_eff, pv_om, diesel_cost, diesel_om,
+                                         battery_inverter_life, battery_inverter_cost, diesel_life, pv_life,
+                                         battery_cost, discount_rate, lpsp_max, diesel_limit, full_life_cycles)
+        nfev += n
+        hours_simulated += hours.sum()
+
+        for i in range(n):
+            if trial_energies[i] <= energies[i]:
+                energies[i] = trial_energies[i]
+                population[:, i] = trial[:, i]
+
+        if np.std(energies) <= tol * np.abs(np.mean(energies)):
+            break
+
+    best = np.argmin(energies)
+    return min_bounds + population[:, best] * width, energies[best], nfev, hours_simulated
+
 
 @numba.njit
 def pv_generation(temp, ghi, pv_capacity, load, inv_eff):
@@ -90,18 +330,37 @@ def pv_generation(temp, ghi, pv_capacity, load, inv_eff):
 @numba.njit
 def year_simulation(battery_size, diesel_capacity, net_load, hour_numbers, battery_inv_eff, n_dis, n_chg,
                     annual_demand, full_life_cycles, dod_max, c_rate_chg, c_rate_dis):
+    """
+    Simulates the dispatch for each hour in hour_numbers and returns the performance metrics together with the hourly
+    battery SOC and diesel generation curves (for plotting purposes).
+    """
+    battery_soc_curve = np.empty(len(hour_numbers), dtype=np.float32)
+    diesel_gen_curve = np.empty(len(hour_numbers), dtype=np.float32)
+
+    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share = \
+        year_simulation_trace(battery_size, diesel_capacity, net_load, hour_numbers, battery_inv_eff, n_dis, n_chg,
+                              annual_demand, full_life_cycles, dod_max, c_rate_chg, c_rate_dis,
+                              battery_soc_curve, diesel_gen_curve)
+
+    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, \
+        excess_gen_share, battery_soc_curve, diesel_gen_curve
+
+
+@numba.njit
+def year_simulation_metrics(battery_size, diesel_capacity, net_load, hour_numbers, battery_inv_eff, n_dis, n_chg,
+                            annual_demand, full_life_cycles, dod_max, c_rate_chg, c_rate_dis):
+    """
+    Metrics-only version of year_simulation. Only the annual totals are tracked, so nothing is allocated while the
+    hours are simulated.
+    """
     soc = 0.5  # Initial SOC of battery
 
     # Variables for tracking annual performance information
-    annual_unmet_demand = 0
-    annual_excess_gen = 0
-    annual_diesel_gen = 0
-    annual_battery_use = 0
-    annual_fuel_consumption = 0
-
-    # Arrays for tracking hourly values throughout the year (for plotting purposes)
-    diesel_gen_curve = []
-    battery_soc_curve = []
+    annual_unmet_demand = 0.
+    annual_excess_gen = 0.
+    annual_diesel_gen = 0.
+    annual_battery_use = 0.
+    annual_fuel_consumption = 0.
 
     # Run the simulation for each hour during one year
     for hour in hour_numbers:
@@ -114,10 +373,102 @@ def year_simulation(battery_size, diesel_capacity, net_load, hour_numbers, batte
                                                 annual_unmet_demand,
                                                 annual_excess_gen, c_rate_chg, c_rate_dis)
 
+    return year_performance(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen,
+                            annual_diesel_gen, annual_fuel_consumption, annual_demand, full_life_cycles, dod_max)
+
+
+@numba.njit
+def year_simulation_bounded(battery_size, diesel_capacity, net_load, hour_numbers, hour_weights, battery_inv_eff, n_dis,
+                            n_chg, annual_demand, full_life_cycles, dod_max, c_rate_chg, c_rate_dis, lpsp_max,
+                            diesel_limit):
+    """
+    Same as year_simulation_metrics, but each simulated hour counts hour_weights times in the annual totals (all ones
+    for a full year, see representative_hours for a shorter, weighted set of days), and the simulation stops as soon
+    as the unmet demand or the diesel generation exceeds its share of the annual demand (lpsp_max and diesel_limit).
+    Both only grow during the year, so such a configuration is infeasible whatever happens in the remaining hours, and
+    the metrics returned from the hours simulated so far lead to the same infeasible result. The number of hours
+    simulated is returned as well.
+    """
+    soc = 0.5  # Initial SOC of battery
+
+    # Variables for tracking annual performance information
+    annual_unmet_demand = 0.
+    annual_excess_gen = 0.
+    annual_diesel_gen = 0.
+    annual_battery_use = 0.
+    annual_fuel_consumption = 0.
+
+    # Run the simulation for each hour, or until the configuration is known to be infeasible. The SOC is carried over
+    # from one simulated hour to the next, also between representative days.
+    hours_simulated = 0
+    for i in range(len(hour_numbers)):
+        hour = hour_numbers[i]
+        weight = hour_weights[i]
+        load = net_load[int(hour)]
+
+        # Called with zero totals, so the hourly values are returned and can be weighted
+        diesel_gen, fuel_consumption, diesel_generation, battery_use, soc, unmet_demand, excess_gen = \
+            hour_simulation(hour, soc, load, diesel_capacity, 0., 0., battery_inv_eff, n_dis, n_chg, battery_size, 0.,
+                            0., 0., c_rate_chg, c_rate_dis)
+        annual_fuel_consumption += weight * fuel_consumption
+        annual_diesel_gen += weight * diesel_generation
+        annual_battery_use += weight * battery_use
+        annual_unmet_demand += weight * unmet_demand
+        annual_excess_gen += weight * excess_gen
+        hours_simulated += 1
+
+        # Same comparisons as in the feasibility check of hybrid_configuration_costs
+        if (annual_unmet_demand / annual_demand > lpsp_max) or (annual_diesel_gen / annual_demand > diesel_limit):
+            break
+
+    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share = \
+        year_performance(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen,
+                         annual_diesel_gen, annual_fuel_consumption, annual_demand, full_life_cycles, dod_max)
+
+    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share, \
+        hours_simulated
+
+
+@numba.njit
+def year_simulation_trace(battery_size, diesel_capacity, net_load, hour_numbers, battery_inv_eff, n_dis, n_chg,
+                          annual_demand, full_life_cycles, dod_max, c_rate_chg, c_rate_dis,
+                          battery_soc_curve, diesel_gen_curve):
+    """
+    Same as year_simulation_metrics, but the battery SOC and diesel generation in each simulated hour are also written
+    to the preallocated arrays battery_soc_curve and diesel_gen_curve (float32, one value per entry in hour_numbers).
+    """
+    soc = 0.5  # Initial SOC of battery
+
+    # Variables for tracking annual performance information
+    annual_unmet_demand = 0.
+    annual_excess_gen = 0.
+    annual_diesel_gen = 0.
+    annual_battery_use = 0.
+    annual_fuel_consumption = 0.
+
+    # Run the simulation for each hour during one year
+    for i in range(len(hour_numbers)):
+        hour = hour_numbers[i]
+        load = net_load[int(hour)]
+
+        diesel_gen, annual_fuel_consumption, annual_diesel_gen, annual_battery_use, soc, annual_unmet_demand, \
+            annual_excess_gen = hour_simulation(hour, soc, load, diesel_capacity, annual_fuel_consumption,
+                                                annual_diesel_gen,
+                                                battery_inv_eff, n_dis, n_chg, battery_size, annual_battery_use,
+                                                annual_unmet_demand,
+                                                annual_excess_gen, c_rate_chg, c_rate_dis)
+
         # Update plotting arrays
-        diesel_gen_curve.append(diesel_gen)
-        battery_soc_curve.append(soc)
+        diesel_gen_curve[i] = diesel_gen
+        battery_soc_curve[i] = soc
+
+    return year_performance(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen,
+                            annual_diesel_gen, annual_fuel_consumption, annual_demand, full_life_cycles, dod_max)
 
+
+@numba.njit
+def year_performance(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen, annual_diesel_gen,
+                     annual_fuel_consumption, annual_demand, full_life_cycles, dod_max):
     # When a full year has been simulated, calculate battery life and performance metrics
     if (battery_size > 0) & (annual_battery_use > 0):
         battery_life = min(round(full_life_cycles * dod_max / (annual_battery_use)), 20)  # ToDo should dod_max be included here?
@@ -128,8 +479,7 @@ def year_simulation(battery_size, diesel_capacity, net_load, hour_numbers, batte
     excess_gen_share = annual_excess_gen / annual_demand
     diesel_generation_share = annual_diesel_gen / annual_demand
 
-    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, \
-        excess_gen_share, battery_soc_curve, diesel_gen_curve
+    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share
 
 
 @numba.njit
@@ -210,13 +560,15 @@ def hour_simulation(hour, soc, net_load, diesel_capacity, annual_fuel_consumptio
 
     if net_load >= 0:
         soc -= min(soc_usage, c_rate_dis, soc_prev)  # Update SOC based on the calculated SOC usage, ensuring battery is not over-used
-        if min(soc_usage, c_rate_dis, soc_prev) < 0: # ToDo debugging only, remove later
-            print('Error: negative SOC usage during discharge')
+        if DEBUG_SOC_CHECKS:
+            if min(soc_usage, c_rate_dis, soc_prev) < 0:
+                print('Error: negative SOC usage during discharge')
     else:
         soc -= soc_usage
 
-    if soc < 0:
-        print('Error: SOC below 0')
+    if DEBUG_SOC_CHECKS:
+        if soc < 0:
+            print('Error: SOC below 0')
 
     # Store how much battery energy (measured in SOC) was discharged (if used).
     # No more than the previous SOC can be used
@@ -366,18 +718,13 @@ def calc_load_curve(tier, annual_demand):
 
     return np.array(load_curve) * annual_demand / 365
 
-def get_pv_data(latitude, longitude, token, output_folder):
-    # This function can be used to retrieve solar resource data from https://renewables.ninja
-    api_base = 'https://www.renewables.ninja/api/'
-    s = requests.session()
-    # Send token header with each request
-    s.headers = {'Authorization': 'Token ' + token}
-
-    out_path = os.path.join(output_folder, 'pv_data_lat_{}_long_{}.csv'.format(latitude, longitude))
+def pv_data_path(output_folder, latitude, longitude):
+    return os.path.join(output_folder, 'pv_data_lat_{}_long_{}.csv'.format(latitude, longitude))
 
-    url = api_base + 'data/pv'
 
-    args = {
+def pv_data_request_args(latitude, longitude):
+    # The query of renewables.ninja used for the PV profiles
+    return {
         'lat': latitude,
         'lon': longitude,
         'date_from': '2020-01-01',
@@ -393,6 +740,38 @@ def get_pv_data(latitude, longitude, token, output_folder):
         'raw': True
     }
 
+
+def save_pv_data(response_text, out_path):
+    """Writes the GHI (W/m2) and temperature of a renewables.ninja PV response to a csv-file. The file is written under
+    a temporary name first, so that an interrupted download never leaves a partial file behind."""
+    # Parse JSON to get a pandas.DataFrame of data and dict of metadata
+    parsed_response = json.loads(response_text)
+
+    data = pd.read_json(StringIO(json.dumps(parsed_response['data'])), orient='index')
+
+    df_out = pd.DataFrame(columns=['time', 'ghi', 'temp'])
+    df_out['ghi'] = (data['irradiance_direct'] + data['irradiance_diffuse']) * 1000
+    df_out['temp'] = data['temperature']
+    df_out['time'] = data['local_time']
+
+    df_out.to_csv(out_path + '.part', index=False)
+    os.replace(out_path + '.part', out_path)
+
+
+def get_pv_data(latitude, longitude, token, output_folder):
+    # This function can be used to retrieve solar resource data from https://renewables.ninja
+    # To download many locations, see prefetch_pv_data
+    api_base = 'https://www.renewables.ninja/api/'
+    s = requests.session()
+    # Send token header with each request
+    s.headers = {'Authorization': 'Token ' + token}
+
+    out_path = pv_data_path(output_folder, latitude, longitude)
+
+    url = api_base + 'data/pv'
+
+    args = pv_data_request_args(latitude, longitude)
+
     if os.path.exists(out_path):
         print('Data already in the PV folder')
     else:
@@ -408,36 +787,869 @@ def get_pv_data(latitude, longitude, token, output_folder):
                 if r.status_code == 429:
                     print('API maximum hourly requests reached, waiting one hour before trying again', time.ctime())
                     time.sleep(3700)
-    
-                # Parse JSON to get a pandas.DataFrame of data and dict of metadata
-                parsed_response = json.loads(r.text)
-    
-                data = pd.read_json(StringIO(json.dumps(parsed_response['data'])), orient='index')
-        
-                df_out = pd.DataFrame(columns=['time', 'ghi', 'temp'])
-                df_out['ghi'] = (data['irradiance_direct'] + data['irradiance_diffuse']) * 1000
-                df_out['temp'] = data['temperature']
-                df_out['time'] = data['local_time']
-        
-                df_out.to_csv(out_path, index=False)
-            
+
+                save_pv_data(r.text, out_path)
+
         else:
             print('No token provided')
 
 
-def read_environmental_data(path, skiprows=341882, ghi_col=3, temp_col=2):
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: on average at most rate requests per second, with bursts of up to capacity
+    requests.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, and takes it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def prefetch_pv_data(coordinates, token, output_folder, workers=4, requests_per_hour=50, burst=1, max_retries=6,
+                     backoff=60, max_backoff=3700, api_base='https://www.renewables.ninja/api/', timeout=120,
+                     retry_failed=False):
+    """
+    Downloads the PV profiles of many locations from renewables.ninja, in the same csv format as get_pv_data.
+
+    The requests are made from a pool of threads sharing one session (connection pool), and limited to
+    requests_per_hour by a token bucket. Rate limited (HTTP 429), server errors and connection errors are retried
+    with exponential backoff (backoff, 2 * backoff, ... seconds, at most max_backoff, or the Retry-After of the
+    response), while the other threads carry on. An invalid token (HTTP 403) stops the prefetch.
+
+    Progress is stored in output_folder/pv_prefetch_progress.json, so an interrupted prefetch can simply be run again:
+    locations already downloaded are skipped, and so are locations outside the dataset (HTTP 400) unless
+    retry_failed is True.
+
+    Arguments
+    ---------
+    coordinates : list
+        (latitude, longitude) of each location
+    token : str
+        renewables.ninja API token
+    output_folder : str
+    workers : int
+        Number of download threads
+    requests_per_hour : float
+        Rate limit of the API for the token
+    burst : int
+        Number of requests that may be made at once, before the rate limit applies
+
+    Returns
+    -------
+    pandas.DataFrame
+        The latitude, longitude, status ('downloaded', 'cached' or 'failed'), path and message of each location
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    progress_path = os.path.join(output_folder, 'pv_prefetch_progress.json')
+    progress = {}
+    if os.path.exists(progress_path):
+        with open(progress_path) as f:
+            progress = json.load(f)
+
+    lock = threading.Lock()
+    stop = threading.Event()
+    bucket = TokenBucket(requests_per_hour / 3600, burst)
+
+    session = requests.Session()
+    session.headers.update({'Authorization': 'Token ' + token})
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    url = api_base + 'data/pv'
+
+    def record(latitude, longitude, status, message=''):
+        with lock:
+            progress['{},{}'.format(latitude, longitude)] = {'status': status, 'message': message}
+            with open(progress_path + '.part', 'w') as f:
+                json.dump(progress, f)
+            os.replace(progress_path + '.part', progress_path)
+
+    def fetch(latitude, longitude):
+        out_path = pv_data_path(output_folder, latitude, longitude)
+        previous = progress.get('{},{}'.format(latitude, longitude), {})
+        if os.path.exists(out_path):
+            return 'cached', out_path, ''
+        if previous.get('status') == 'failed' and not retry_failed:
+            return 'failed', out_path, previous.get('message', '')
+
+        for attempt in range(max_retries + 1):
+            if stop.is_set():
+                return 'failed', out_path, 'prefetch stopped'
+            bucket.acquire()
+            try:
+                r = session.get(url, params=pv_data_request_args(latitude, longitude), timeout=timeout)
+            except requests.RequestException as e:
+                status, message, retry_after = None, str(e), None
+            else:
+                status, message, retry_after = r.status_code, r.text[:200], r.headers.get('Retry-After')
+                if status == 200:
+                    save_pv_data(r.text, out_path)
+                    record(latitude, longitude, 'downloaded')
+                    return 'downloaded', out_path, ''
+                if status == 403:
+                    stop.set()
+                    return 'failed', out_path, 'invalid token'
+                if status == 400:
+                    record(latitude, longitude, 'failed', message)
+                    return 'failed', out_path, message
+
+            if attempt < max_retries:
+                wait = min(backoff * 2 ** attempt, max_backoff)
+                if retry_after is not None and retry_after.isdigit():
+                    wait = min(int(retry_after), max_backoff)
+                time.sleep(wait)
+
+        return 'failed', out_path, 'HTTP {}: {}'.format(status, message)
+
+    results = []
+    report_every = max(1, len(coordinates) // 10)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, latitude, longitude): (latitude, longitude)
+                   for latitude, longitude in coordinates}
+        for done, future in enumerate(as_completed(futures), 1):
+            latitude, longitude = futures[future]
+            status, path, message = future.result()
+            results.append({'latitude': latitude, 'longitude': longitude, 'status': status, 'path': path,
+                            'message': message})
+            if done % report_every == 0 or done == len(coordinates):
+                print(time.ctime(), 'PV data prefetch: {}/{} locations done'.format(done, len(coordinates)))
+
+    session.close()
+    if stop.is_set():
+        print('Unable to retrieve data, invalid token')
+
+    return pd.DataFrame(results, columns=['latitude', 'longitude', 'status', 'path', 'message'])
+
+
+def read_environmental_data(path, skiprows=341882, ghi_col=3, temp_col=2, cache_dir=None):
     """
     This method reads the solar resource GHI and temperature for each hour during one year from a csv-file.
-    The skiprows and skipcolumns define which rows and columns the data should be read from.
+    The skiprows and skipcolumns define which rows and columns the data should be read from. The csv-file is only
+    parsed the first time, see load_resource_profiles (and cache_dir there).
     """
     try:
-        #data = pd.read_csv(path, skiprows=skiprows)
-        ghi_curve = pd.read_csv(path, usecols=[ghi_col], skiprows=skiprows).values
-        temp = pd.read_csv(path, usecols=[temp_col], skiprows=skiprows).values
-
-        return ghi_curve, temp
-    except:
+        profiles = load_resource_profiles(path, [ghi_col, temp_col], skiprows, cache_dir=cache_dir)
+    except Exception:
         print('Could not read data, try changing which columns and rows ro read')
+        raise
+
+    return profiles[:, [0]], profiles[:, [1]]
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_resource_profiles(path, columns, skiprows, hours=8760, cache_dir=None):
+    """
+    Reads hourly resource profiles (e.g. GHI and temperature, or wind speed) from a csv-file, as an array with one
+    column per entry in columns (column numbers in the file, in the order given).
+
+    The csv-file is parsed only once. The profiles are then stored next to it in a .npy sidecar file, named after the
+    columns and rows read, together with the size, modification time and sha256 of the csv-file (in a .json file).
+    If cache_dir is given, the sidecar is stored there instead (named after the path of the csv-file as well), e.g.
+    when the csv-files are in a shared or read-only folder. Later calls load the sidecar instead, with no parsing. If the csv-file was modified, it is only parsed again if
+    its content changed. If the sidecar can not be written (e.g. a read-only folder), the profiles are just returned.
+    Profiles loaded from the sidecar are a read-only memory map.
+
+    Raises a ValueError if the file does not have the given number of hours. For a leap year of hourly values, 29
+    February is left out.
+    """
+    columns = [int(c) for c in columns]
+    name = {'columns': columns, 'skiprows': int(skiprows)}
+    if cache_dir is not None:
+        name['path'] = os.path.abspath(path)
+    name = hashlib.sha256(json.dumps(name).encode()).hexdigest()[:16]
+    sidecar_path = path if cache_dir is None else os.path.join(cache_dir, os.path.basename(path))
+    sidecar = '{}.{}.npy'.format(sidecar_path, name)
+    meta_path = '{}.{}.json'.format(sidecar_path, name)
+
+    stat = os.stat(path)
+    meta = None
+    if os.path.exists(sidecar) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+            return np.load(sidecar, mmap_mode='r')
+        if meta['size'] == stat.st_size and meta['sha256'] == _file_sha256(path):
+            # Same content, e.g. a copied or touched file
+            meta['mtime_ns'] = stat.st_mtime_ns
+            try:
+                with open(meta_path, 'w') as f:
+                    json.dump(meta, f)
+            except OSError:
+                pass
+            return np.load(sidecar, mmap_mode='r')
+
+    # usecols returns the columns in the order of the file
+    data = pd.read_csv(path, usecols=columns, skiprows=skiprows).values
+    profiles = np.ascontiguousarray(data[:, [sorted(columns).index(c) for c in columns]], dtype=np.float64)
+    if len(profiles) == hours + 24 == 8784:
+        # A leap year (e.g. from get_pv_data), 29 February is left out
+        profiles = np.delete(profiles, np.s_[59 * 24:60 * 24], axis=0)
+    if len(profiles) != hours:
+        raise ValueError('Expected {} hourly values in {}, found {}. Check skiprows={}'
+                         .format(hours, path, len(profiles), skiprows))
+
+    try:
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        np.save(sidecar, profiles)
+        with open(meta_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _file_sha256(path),
+                       'columns': columns, 'skiprows': int(skiprows)}, f)
+    except OSError:
+        pass
+
+    return profiles
+
+
+# File names of the profiles written by get_pv_data
+PV_PROFILE_PATTERN = r'pv_data_lat_(?P<latitude>-?\d+(?:\.\d+)?)_long_(?P<longitude>-?\d+(?:\.\d+)?)\.csv$'
+
+
+def resource_profile_index(folder, pattern=PV_PROFILE_PATTERN):
+    """
+    Lists the resource profiles in a folder, with the coordinates given in their file names (by default the files
+    written by get_pv_data). Returns a DataFrame with the path, latitude and longitude of each profile, sorted by file
+    name. The row number is used as the profile id.
+    """
+    rows = []
+    for name in sorted(os.listdir(folder)):
+        match = re.match(pattern, name)
+        if match is not None:
+            rows.append({'path': os.path.join(folder, name), 'latitude': float(match.group('latitude')),
+                         'longitude': float(match.group('longitude'))})
+    if len(rows) == 0:
+        raise ValueError('No resource profiles matching {} found in {}'.format(pattern, folder))
+
+    return pd.DataFrame(rows, columns=['path', 'latitude', 'longitude'])
+
+
+def _unit_vectors(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def nearest_profiles(index, latitudes, longitudes):
+    """
+    Returns the id (row in index, see resource_profile_index) of the profile closest to each of the given points.
+    The distances are measured on the sphere, with a KD-tree over the profile locations.
+    """
+    tree = cKDTree(_unit_vectors(index['latitude'], index['longitude']))
+    distance, profile = tree.query(_unit_vectors(latitudes, longitudes))
+    return profile
+
+
+@lru_cache(maxsize=32)
+def load_pv_profile(path, cache_dir=None):
+    """
+    Returns the hourly GHI (W/m2) and temperature profiles from a file written by get_pv_data. The most recently used
+    profiles are kept in memory, and the same arrays are returned to every caller, so they should not be modified.
+    """
+    ghi_curve, temp = read_environmental_data(path, skiprows=0, ghi_col=1, temp_col=2, cache_dir=cache_dir)
+    return ghi_curve[:, 0], temp[:, 0]
+
+
+def stack_profile_tables(tables, index, tiers, resource_range, diesel_range, resource='ghi'):
+    """
+    Stacks the lookup tables of each profile in index into one table with a leading profile axis. Profiles without a
+    table (None, no settlement uses them) are NaN.
+    """
+    shape = (len(tiers), len(resource_range), len(diesel_range))
+    table = {'profile': np.arange(len(index)), 'latitude': index['latitude'].values,
+             'longitude': index['longitude'].values, 'tier': tiers, resource: resource_range, 'diesel': diesel_range}
+    for name, cell_shape in [('lcoe', ()), ('investment', ()), ('capacity', ()), ('fuel_cost', ()),
+                             ('configuration', (3,))]:
+        table[name] = np.stack([np.full(shape + cell_shape, np.nan) if t is None or name not in t else t[name]
+                                for t in tables])
+    return table
+
+
+def cluster_representative_days(profiles, n_days, max_iter=100):
+    """
+    Clusters the 365 days of the year into n_days groups with similar hourly profiles (k-medoids), for a cheaper
+    simulation of only one representative day of each group.
+
+    Arguments
+    ---------
+    profiles : list of numpy.ndarray
+        Hourly profiles of one year (8760 values each), e.g. the GHI and temperature from read_environmental_data or
+        the wind speed from read_wind_environmental_data. Each profile is scaled by its standard deviation, so that
+        they count equally in the distance between two days. Only the PV-hybrid optimization simulates the
+        representative days, see wind_hybrids_lcoe_lookuptable for the wind-hybrid table.
+    n_days : int
+        Number of representative days
+    max_iter : int
+        Maximum number of medoid updates
+
+    Returns
+    -------
+    days : numpy.ndarray
+        Day of the year (0-364) of each representative day, in chronological order
+    weights : numpy.ndarray
+        Number of days of the year represented by each of them, adding up to 365
+    """
+    if n_days < 1:
+        raise ValueError('At least one representative day is needed')
+
+    features = []
+    for profile in profiles:
+        values = np.asarray(profile, dtype=np.float64).reshape(-1)
+        if len(values) != 8760:
+            raise ValueError('Representative days need hourly profiles of one year (8760 values), got {}'
+                             .format(len(values)))
+        scale = values.std()
+        features.append((values / scale if scale > 0 else values).reshape(365, 24))
+    days = np.hstack(features)
+
+    if n_days >= 365:
+        return np.arange(365), np.ones(365, dtype=int)
+
+    squares = (days ** 2).sum(axis=1)
+    distances = np.sqrt(np.maximum(squares[:, None] + squares[None, :] - 2 * days @ days.T, 0))
+
+    # Greedy start: the most central day, then each time the day that reduces the total distance the most
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    nearest = distances[medoids[0]]
+    for k in range(1, n_days):
+        gain = np.maximum(nearest[:, None] - distances, 0).sum(axis=0)
+        gain[medoids] = -1
+        medoids.append(int(np.argmax(gain)))
+        nearest = np.minimum(nearest, distances[medoids[-1]])
+    medoids = np.array(medoids)
+
+    # Alternate between assigning the days to the nearest medoid and moving each medoid to the most central member
+    for iteration in range(max_iter):
+        labels = np.argmin(distances[:, medoids], axis=1)
+        updated = medoids.copy()
+        for k in range(n_days):
+            members = np.flatnonzero(labels == k)
+            if len(members) > 0:
+                updated[k] = members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))]
+        if (updated == medoids).all():
+            break
+        medoids = updated
+
+    weights = np.bincount(np.argmin(distances[:, medoids], axis=1), minlength=n_days)
+    order = np.argsort(medoids)
+
+    return medoids[order], weights[order]
+
+
+def representative_hours(days, weights):
+    """
+    Returns the hour numbers (hours of the year, as used by the PV-hybrid optimizer) of the representative days and
+    the weight of each hour, to be simulated with year_simulation_bounded or find_least_cost_option_metrics.
+    """
+    hour_numbers = (np.asarray(days).reshape(-1, 1) * 24 + np.arange(24)).reshape(-1).astype(np.float64)
+    hour_weights = np.repeat(np.asarray(weights, dtype=np.float64), 24)
+    return hour_numbers, hour_weights
+
+
+# Hours simulated by the optimizers in this process, and the hours saved by stopping infeasible configurations early
+# (see year_simulation_bounded). Use reset_simulation_hours to start a new count. Worker processes keep their own
+# count, solve_table_cells(full_output=True) returns the hours of each cell to the parent process.
+simulation_hours = {'simulated': 0, 'saved': 0}
+
+
+def record_simulation_hours(hours_simulated, full_hours):
+    """Adds the hours simulated for a number of configurations to simulation_hours, full_hours being the hours the
+    same configurations would have needed without stopping early."""
+    simulation_hours['simulated'] += int(hours_simulated)
+    simulation_hours['saved'] += int(full_hours - hours_simulated)
+
+
+def reset_simulation_hours():
+    simulation_hours['simulated'] = 0
+    simulation_hours['saved'] = 0
+
+
+def hybrid_table_key(resource_curves, specs, axes, start_year, end_year, optimizer_config):
+    """
+    Returns a content hash identifying a hybrid mini-grid lookup table. The table only depends on the hourly resource
+    profile(s), the technology specs, the table axes, the start/end years and the (seeded) optimizer configuration,
+    so two runs with the same key produce the same table. This only holds for a seeded or deterministic optimizer,
+    unseeded tables should not be cached.
+
+    Arguments
+    ---------
+    resource_curves : list of numpy.ndarray
+        The hourly resource profiles used to build the table (e.g. GHI and temperature)
+    specs : dict
+        The mg_pv_hybrid_specs or mg_wind_hybrid_specs dictionary
+    axes : list of numpy.ndarray
+        The tier, resource and diesel cost axes of the table
+    start_year : int
+    end_year : int
+    optimizer_config : dict
+    """
+    h = hashlib.sha256()
+    for curve in resource_curves:
+        h.update(np.ascontiguousarray(curve, dtype=np.float64).tobytes())
+    # The minimum number of connections only decides which settlements use the table, not the table itself
+    table_specs = {k: v for k, v in specs.items() if k != 'min_mg_connections'}
+    h.update(json.dumps(table_specs, sort_keys=True, default=str).encode())
+    for axis in axes:
+        h.update(np.ascontiguousarray(axis, dtype=np.float64).tobytes())
+    h.update(json.dumps([int(start_year), int(end_year)]).encode())
+    h.update(json.dumps(optimizer_config, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+# The specs that enter the hourly dispatch simulation, all others only enter the costs
+DISPATCH_SPECS = ('n_chg', 'n_dis', 'dod_max', 'inv_eff', 'full_life_cycles')
+
+
+def dispatch_store_key(resource_curves, specs, axes, optimizer_config):
+    """
+    Returns a content hash identifying a store of dispatch simulation results for the cells of a lookup table. Unlike
+    hybrid_table_key, it only depends on the resource profiles, the specs in DISPATCH_SPECS, the table axes and the
+    optimizer configuration, so runs that differ in cost assumptions or years share the same store. Configurations
+    found by a different optimizer (e.g. the 'grid' optimizer or representative days) go to a different store.
+    """
+    return hybrid_table_key(resource_curves, {k: specs[k] for k in DISPATCH_SPECS}, axes, 0, 0,
+                            dict(optimizer_config, store='dispatch'))
+
+
+def load_hybrid_table(cache_dir, key):
+    """
+    Loads a cached hybrid lookup table (a dict of numpy arrays) from cache_dir. Returns None if it is not cached.
+    """
+    path = os.path.join(cache_dir, 'hybrid_table_{}.npz'.format(key))
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def save_hybrid_table(cache_dir, key, table):
+    """
+    Saves a hybrid lookup table (a dict of numpy arrays) to cache_dir. The file is written to a temporary name first,
+    so an interrupted run never leaves a partial table behind.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, 'hybrid_table_{}.npz'.format(key))
+    tmp_path = path + '.{}.tmp.npz'.format(os.getpid())
+    np.savez(tmp_path, **table)
+    os.replace(tmp_path, path)
+
+
+def hybrid_table_axis(values, step):
+    """
+    Returns a table axis with the given step that covers all values, e.g. the GHI or diesel cost of the settlements
+    """
+    low = np.floor(np.min(values) / step) * step
+    high = np.ceil(np.max(values) / step) * step
+    return np.round(low + step * np.arange(int(round((high - low) / step)) + 1), 6)
+
+
+def _axis_weights(axis, values):
+    """Index of the lower grid point and the weight of the upper one, for each value clipped to the axis"""
+    if len(axis) == 1:
+        return np.zeros(len(values), dtype=int), np.zeros(len(values))
+    values = np.clip(values, axis[0], axis[-1])
+    i = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+    return i, (values - axis[i]) / (axis[i + 1] - axis[i])
+
+
+def _table_corners(table, resource, tier, resource_values, diesel_values):
+    """Tier index and the (resource index, diesel index, weight) of the four interpolation corners of each value"""
+    ti = np.clip(np.searchsorted(table['tier'], np.asarray(tier)), 0, len(table['tier']) - 1)
+    ri, rw = _axis_weights(table[resource], np.asarray(resource_values, dtype=float))
+    di, dw = _axis_weights(table['diesel'], np.asarray(diesel_values, dtype=float))
+    r_upper = np.minimum(ri + 1, len(table[resource]) - 1)
+    d_upper = np.minimum(di + 1, len(table['diesel']) - 1)
+
+    return ti, [(ri, di, (1 - rw) * (1 - dw)), (r_upper, di, rw * (1 - dw)),
+                (ri, d_upper, (1 - rw) * dw), (r_upper, d_upper, rw * dw)]
+
+
+def hybrid_table_cells(table, resource, tier, resource_values, diesel_values):
+    """
+    Returns the (tier, resource, diesel) index tuples of the table cells needed to interpolate the given values,
+    i.e. the corners with a non-zero interpolation weight
+    """
+    ti, corners = _table_corners(table, resource, tier, resource_values, diesel_values)
+    cells = [np.column_stack([ti, r, d])[weight > 0] for r, d, weight in corners]
+    return [tuple(int(i) for i in cell) for cell in np.unique(np.concatenate(cells), axis=0)]
+
+
+def interpolate_hybrid_table(table, resource, tier, resource_values, diesel_values, infeasible=99, chunk_size=None,
+                             dtype='float64'):
+    """
+    Bilinear interpolation of a hybrid lookup table over (resource, diesel cost), for each tier.
+
+    Values outside the table axes are clipped to the edges. Infeasible corners (LCOE >= infeasible) are left out and
+    the weights of the remaining corners renormalized, if all corners are infeasible the LCOE is set to infeasible and
+    the other quantities to 0.
+
+    Arguments
+    ---------
+    table : dict
+        Lookup table with the axes 'tier', resource and 'diesel', and (tier, resource, diesel) shaped arrays 'lcoe',
+        'investment', 'capacity' and 'fuel_cost'
+    resource : str
+        Name of the resource axis, 'ghi' or 'wind'
+    tier, resource_values, diesel_values : array-like
+        Tier, resource and diesel cost of each settlement
+    chunk_size : int, optional
+        If given, the settlements are interpolated in blocks of this size, into preallocated result arrays, which
+        bounds the memory of the temporary arrays
+    dtype : str
+        Type of the interpolation weights, gathered table values and results, e.g. 'float32' to halve their memory
+
+    Returns
+    -------
+    dict of numpy.ndarray with the interpolated 'lcoe', 'investment', 'capacity' and 'fuel_cost'
+    """
+    if (chunk_size is not None) and (len(tier) > chunk_size):
+        tier, resource_values, diesel_values = np.asarray(tier), np.asarray(resource_values), np.asarray(diesel_values)
+        result = {name: np.empty(len(tier), dtype=dtype) for name in ['lcoe', 'investment', 'capacity', 'fuel_cost']}
+        for start in range(0, len(tier), chunk_size):
+            block = slice(start, start + chunk_size)
+            block_result = interpolate_hybrid_table(table, resource, tier[block], resource_values[block],
+                                                    diesel_values[block], infeasible, dtype=dtype)
+            for name in result:
+                result[name][block] = block_result[name]
+        return result
+
+    ti, corners = _table_corners(table, resource, tier, resource_values, diesel_values)
+    names = ['lcoe', 'investment', 'capacity', 'fuel_cost']
+    values = {name: np.asarray(table[name], dtype=dtype) for name in names}
+
+    total_weight = np.zeros(len(ti), dtype=dtype)
+    result = {name: np.zeros(len(ti), dtype=dtype) for name in names}
+    for r, d, weight in corners:
+        # Corners without weight are skipped, they may not have been solved in a lazy table
+        weight = np.where((weight > 0) & (table['lcoe'][ti, r, d] < infeasible), weight, 0).astype(dtype)
+        total_weight += weight
+        for name in names:
+            result[name] += np.where(weight > 0, weight * values[name][ti, r, d], 0)
+
+    feasible = total_weight > 0
+    for name in names:
+        result[name] = np.where(feasible, result[name] / np.where(feasible, total_weight, 1), 0)
+    result['lcoe'][~feasible] = infeasible
+
+    return result
+
+
+def warm_start_population(x0, min_bounds, max_bounds, size, near=5, spread=0.1, seed=None):
+    """
+    Returns an initial differential evolution population around a known good solution x0, e.g. the optimum of a
+    neighbouring lookup table cell. The first member is x0 itself and near - 1 members are drawn from a normal
+    distribution around it, with a standard deviation of spread times the width of the bounds. The rest of the
+    population is a Latin hypercube sample of the bounds, as in a cold start, so that the search does not get stuck
+    around x0 if the neighbouring optimum is a poor one.
+    """
+    rng = np.random.default_rng(seed)
+    min_bounds = np.asarray(min_bounds, dtype=float)
+    max_bounds = np.asarray(max_bounds, dtype=float)
+    x0 = np.clip(np.asarray(x0, dtype=float), min_bounds, max_bounds)
+
+    population = min_bounds + qmc.LatinHypercube(d=len(x0), seed=rng).random(size) * (max_bounds - min_bounds)
+    population[:near] = x0 + rng.normal(0, spread, (near, len(x0))) * (max_bounds - min_bounds)
+    population[0] = x0
+    return np.clip(population, min_bounds, max_bounds)
+
+
+def sweep_chains(cells):
+    """
+    Orders lookup table cells for warm-started optimization: one chain per tier, going back and forth over the diesel
+    axis for each resource value, so that each cell follows a direct neighbour where possible
+    """
+    chains = {}
+    for ti, ri, di in sorted(cells, key=lambda cell: (cell[0], cell[1], cell[2] if cell[1] % 2 == 0 else -cell[2])):
+        chains.setdefault(ti, []).append((ti, ri, di))
+    return list(chains.values())
+
+
+def grid_refine_minimize(func, func_batch, min_bounds, max_bounds, points=4, max_evaluations=300):
+    """
+    Minimizes func over box bounds with a coarse grid search followed by a bounded Nelder-Mead refinement of the best
+    grid point, using at most max_evaluations function evaluations in total.
+
+    Arguments
+    ---------
+    func : function
+        Objective for one candidate, func(x) with x of shape (n,)
+    func_batch : function
+        Objective for many candidates at once, func_batch(X) with X of shape (n, candidates)
+    min_bounds, max_bounds : numpy.ndarray
+        The box bounds, a variable with equal lower and upper bound is kept fixed
+    points : int
+        Number of grid points along each free variable
+    max_evaluations : int
+        Evaluation budget, for the grid and the refinement together
+
+    Returns
+    -------
+    x, fun, nfev : the best point, its objective value and the number of evaluations used
+    """
+    min_bounds = np.asarray(min_bounds, dtype=float)
+    max_bounds = np.asarray(max_bounds, dtype=float)
+    free = max_bounds > min_bounds
+
+    axes = [np.linspace(low, high, points) if f else np.array([low])
+            for low, high, f in zip(min_bounds, max_bounds, free)]
+    grid = np.array([axis.ravel() for axis in np.meshgrid(*axes, indexing='ij')])
+    if grid.shape[1] > max_evaluations:
+        raise ValueError('The grid of {} points does not fit in the budget of {} evaluations'
+                         .format(grid.shape[1], max_evaluations))
+
+    values = func_batch(grid)
+    best = np.argmin(values)
+    x, fun, nfev = grid[:, best].copy(), values[best], grid.shape[1]
+
+    # Bounded Nelder-Mead from the best grid points in turn, as long as the budget allows, since the LCOE surface has
+    # local minima at the steps of the reliability and diesel share constraints
+    step = (max_bounds - min_bounds)[free] / (points - 1)
+    bounds = list(zip(min_bounds[free], max_bounds[free]))
+    for start in np.argsort(values, kind='stable'):
+        budget = max_evaluations - nfev
+        if budget <= free.sum() + 1:
+            break
+
+        # Initial simplex of one grid step along each free variable, towards the inside of the bounds
+        fixed = grid[:, start].copy()
+        x0 = fixed[free]
+        simplex = [x0]
+        for i in range(len(x0)):
+            vertex = x0.copy()
+            vertex[i] += step[i] if x0[i] + step[i] <= max_bounds[free][i] else -step[i]
+            simplex.append(vertex)
+
+        def free_func(x_free):
+            x_full = fixed.copy()
+            x_full[free] = x_free
+            return func(x_full)
+
+        ret = minimize(free_func, x0, method='Nelder-Mead', bounds=bounds,
+                       options={'maxfev': budget, 'initial_simplex': np.array(simplex), 'xatol': 1e-3,
+                                'fatol': 1e-5})
+        nfev += ret.nfev
+        if ret.fun < fun:
+            x = fixed.copy()
+            x[free] = ret.x
+            fun = ret.fun
+
+    return x, fun, nfev
+
+
+def pv_table_dispatch(configuration, ghi_curve, temp, ghi, tier, specs, hours=None):
+    """
+    Simulates the dispatch of a PV-hybrid configuration for a lookup table cell, with the GHI profile scaled to the
+    annual GHI of the cell and the load curve of the tier. Returns the diesel generation share, battery life, unmet
+    demand share and annual fuel consumption, which do not depend on any cost.
+
+    By default the full year is simulated, hours can be the (hour_numbers, hour_weights) of representative days.
+    """
+    load_curve = calc_load_curve(tier, 10000)
+    hourly_ghi = ghi_curve * ghi * 1000 / ghi_curve.sum()
+    pv = float(configuration[0])
+    diesel = float(configuration[2])
+    if diesel < 0.5:
+        diesel = 0
+
+    net_load, pv_gen = pv_generation(temp, hourly_ghi, pv, load_curve, specs['inv_eff'])
+    if hours is None:
+        diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share = \
+            year_simulation_metrics(float(configuration[1]) * specs['dod_max'], diesel, net_load, np.arange(8760.),
+                                    specs['inv_eff'], specs['n_dis'], specs['n_chg'], load_curve.sum(),
+                                    specs['full_life_cycles'], specs['dod_max'], 1, 1)
+    else:
+        diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share, \
+            hours_simulated = year_simulation_bounded(float(configuration[1]) * specs['dod_max'], diesel, net_load,
+                                                      hours[0], hours[1], specs['inv_eff'], specs['n_dis'],
+                                                      specs['n_chg'], load_curve.sum(), specs['full_life_cycles'],
+                                                      specs['dod_max'], 1, 1, np.inf, np.inf)
+
+    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption
+
+
+def pv_table_recost(configuration, dispatch, tier, diesel_price, specs, start_year, end_year):
+    """
+    Calculates the costs of a PV-hybrid configuration from its stored dispatch results (see pv_table_dispatch),
+    without simulating the year again. Returns the LCOE, investment, capacity and fuel cost, as optimize_mini_grid.
+    """
+    load_curve = calc_load_curve(tier, 10000)
+    pv = float(configuration[0])
+    battery = float(configuration[1])
+    diesel = float(configuration[2])
+    if diesel < 0.5:
+        diesel = 0
+    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption = dispatch
+
+    lcoe, investment, fuel_cost, om_cost, npc, fuel_usage, annual_om = \
+        hybrid_configuration_costs(battery_life, unmet_demand_share, diesel_generation_share, annual_fuel_consumption,
+                                   pv, battery, diesel, load_curve.sum(), load_curve, diesel_price, end_year,
+                                   start_year, specs['pv_cost'], specs['charge_controller'], specs['pv_inverter'],
+                                   specs['pv_om'], specs['diesel_cost'], specs['diesel_om'],
+                                   specs['battery_inverter_life'], specs['battery_inverter_cost'],
+                                   specs['diesel_life'], specs['pv_life'], specs['battery_cost'],
+                                   specs['discount_rate'], specs['lpsp_max'], specs['diesel_limit'], 25, 25, 0, 0)
+
+    return lcoe, investment, pv + diesel, fuel_cost
+
+
+def representative_days_accuracy(cells, ghi_curve, temp, hours, specs, start_year, end_year):
+    """
+    Compares the simulation of representative days to the full year for a number of PV-hybrid configurations.
+
+    Arguments
+    ---------
+    cells : list
+        (configuration, annual GHI, tier, diesel price) of each configuration to compare, e.g. lookup table cells
+    hours : tuple
+        The (hour_numbers, hour_weights) of the representative days, see representative_hours
+
+    Returns
+    -------
+    pandas.DataFrame
+        The LCOE, unmet demand share (LPSP) and diesel generation share of the full year and of the representative
+        days, one row per configuration
+    """
+    rows = []
+    for configuration, ghi, tier, diesel_price in cells:
+        row = {}
+        for label, cell_hours in [('full', None), ('representative', hours)]:
+            dispatch = pv_table_dispatch(configuration, ghi_curve, temp, ghi, tier, specs, hours=cell_hours)
+            row['lcoe_' + label] = pv_table_recost(configuration, dispatch, tier, diesel_price, specs, start_year,
+                                                   end_year)[0]
+            row['lpsp_' + label] = dispatch[2]
+            row['diesel_share_' + label] = dispatch[0]
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=['lcoe_full', 'lpsp_full', 'diesel_share_full', 'lcoe_representative',
+                                       'lpsp_representative', 'diesel_share_representative'])
+
+
+def table_cell_seed(seed, cell):
+    """
+    Returns the optimizer seed for one lookup table cell, derived from the table seed and the cell indices. This keeps
+    the result of each cell the same no matter in which order, or in which process, the cells are solved.
+    """
+    if seed is None:
+        return None
+    return int(np.random.SeedSequence([seed] + [int(i) for i in cell]).generate_state(1)[0])
+
+
+# Resource profiles attached from shared memory in lookup table worker processes
+_worker_profiles = {}
+
+
+def _attach_shared_profiles(descriptors, num_threads):
+    for name, shm_name, shape, dtype in descriptors:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # The SharedMemory object is kept, since the array is only valid as long as the buffer is open
+        _worker_profiles[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    numba.set_num_threads(num_threads)
+
+
+def _solve_counted_cell(solve_cell, cell, profiles, args):
+    simulated, saved = simulation_hours['simulated'], simulation_hours['saved']
+    result = solve_cell(cell, profiles, *args)
+    return result, (simulation_hours['simulated'] - simulated, simulation_hours['saved'] - saved)
+
+
+def _solve_shared_cell(solve_cell, cell, args):
+    profiles = {name: array for name, (shm, array) in _worker_profiles.items()}
+    return _solve_counted_cell(solve_cell, cell, profiles, args)
+
+
+def solve_table_cells(solve_cell, cells, profiles, args, workers=None, description='Lookup table cells',
+                      full_output=False):
+    """
+    Solves each cell of a hybrid lookup table by calling solve_cell(cell, profiles, *args) and returns the results in
+    the same order as cells.
+
+    If workers is larger than 1, the cells are spread over a pool of worker processes. The resource profiles are
+    copied once into shared memory and attached by each worker, instead of being sent with every cell. The numba
+    threads are split between the workers, to not oversubscribe the cores.
+
+    Arguments
+    ---------
+    solve_cell : function
+        Module level function (or staticmethod) solving one cell, must be picklable
+    cells : list
+        The cells to solve, e.g. (tier, resource, diesel) index tuples
+    profiles : dict of numpy.ndarray
+        The hourly resource profiles used by solve_cell
+    args : tuple
+        Further arguments to solve_cell, the same for all cells
+    workers : int, optional
+        Number of worker processes, by default the cells are solved in this process
+    description : str
+        Used in the progress messages
+    full_output : bool
+        If True, the (simulated, saved) hours of each cell (see simulation_hours) are returned as well, counted in the
+        process that solved the cell
+
+    Returns
+    -------
+    list of the results of solve_cell, and with full_output a list of the (simulated, saved) hours of each cell
+    """
+    n = len(cells)
+    report_every = max(1, n // 10)
+    results = [None] * n
+    hours = [None] * n
+
+    if (workers is None) or (workers <= 1) or (n <= 1):
+        for i, cell in enumerate(cells):
+            results[i], hours[i] = _solve_counted_cell(solve_cell, cell, profiles, args)
+            if (i + 1) % report_every == 0 or i + 1 == n:
+                print(time.ctime(), '{}: {}/{} solved'.format(description, i + 1, n))
+        return (results, hours) if full_output else results
+
+    shms = []
+    descriptors = []
+    try:
+        for name, array in profiles.items():
+            array = np.ascontiguousarray(array)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            shms.append(shm)
+            descriptors.append((name, shm.name, array.shape, array.dtype.str))
+
+        num_threads = max(1, numba.config.NUMBA_NUM_THREADS // workers)
+        # Worker processes are spawned, since forking a process that already started numba threads is not safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_attach_shared_profiles,
+                                 initargs=(descriptors, num_threads)) as executor:
+            futures = {executor.submit(_solve_shared_cell, solve_cell, cell, args): i for i, cell in enumerate(cells)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]], hours[futures[future]] = future.result()
+                if done % report_every == 0 or done == n:
+                    print(time.ctime(), '{}: {}/{} solved'.format(description, done, n))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    return (results, hours) if full_output else results
+
 
 def calculate_distribution_lcoe(end_year, start_year, annual_demand,
                                 distribution_cost, om_costs, distribution_life,
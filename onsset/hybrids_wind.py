@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 import numba
 from numba import prange
 import requests
@@ -8,6 +7,11 @@ import json
 import time
 from io import StringIO
 
+try:
+    from hybrids import load_resource_profiles
+except ImportError:
+    from onsset.hybrids import load_resource_profiles
+
 
 @numba.njit
 def find_least_cost_option_wind(configuration, wind_curve, hour_numbers, load_curve, inv_eff, n_dis,
@@ -27,11 +31,11 @@ def find_least_cost_option_wind(configuration, wind_curve, hour_numbers, load_cu
     net_load, wind_gen = wind_generation(wind_curve, wind, load_curve, inv_eff)
 
     # For each hour of the year, diesel generation, battery charge/discharge and performance variables are calculated.
-    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, \
-        excess_gen_share, battery_soc_curve, diesel_gen_curve = \
-        year_simulation_wind(battery_size=usable_battery, diesel_capacity=diesel, net_load=net_load,
-                             hour_numbers=hour_numbers, inv_eff=inv_eff, n_dis=n_dis, n_chg=n_chg,
-                             annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max)
+    # Only the annual metrics are needed here, so the metrics-only kernel is used (no hourly curves are stored)
+    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share = \
+        year_simulation_wind_metrics(battery_size=usable_battery, diesel_capacity=diesel, net_load=net_load[0],
+                                     hour_numbers=hour_numbers, inv_eff=inv_eff, n_dis=n_dis, n_chg=n_chg,
+                                     annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max)
 
     # If the system could meet the demand in a satisfactory manner (i.e. with high enough reliability and low enough
     # share of the generation coming from the diesel generator), then the LCOE is calculated. Else 99 is returned.
@@ -84,23 +88,71 @@ def wind_generation(wind_curve, wind, load, inv_eff):
 @numba.njit
 def year_simulation_wind(battery_size, diesel_capacity, net_load, hour_numbers, inv_eff, n_dis, n_chg,
                     annual_demand, full_life_cycles, dod_max):
+    """
+    Simulates the dispatch for each hour in hour_numbers and returns the performance metrics together with the hourly
+    battery SOC and diesel generation curves (for plotting purposes).
+    """
+    battery_soc_curve = np.empty(len(hour_numbers), dtype=np.float32)
+    diesel_gen_curve = np.empty(len(hour_numbers), dtype=np.float32)
+
+    diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share = \
+        year_simulation_wind_trace(battery_size, diesel_capacity, net_load[0], hour_numbers, inv_eff, n_dis, n_chg,
+                                   annual_demand, full_life_cycles, dod_max, battery_soc_curve, diesel_gen_curve)
+
+    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, \
+        excess_gen_share, battery_soc_curve, diesel_gen_curve
+
+
+@numba.njit
+def year_simulation_wind_metrics(battery_size, diesel_capacity, net_load, hour_numbers, inv_eff, n_dis, n_chg,
+                                 annual_demand, full_life_cycles, dod_max):
+    """
+    Metrics-only version of year_simulation_wind. Only the annual totals are tracked, so nothing is allocated while
+    the hours are simulated. Note that net_load is the hourly net load itself (one value per hour).
+    """
     soc = 0.5  # Initial SOC of battery
 
     # Variables for tracking annual performance information
-    annual_unmet_demand = 0
-    annual_excess_gen = 0
-    annual_diesel_gen = 0
-    annual_battery_use = 0
-    annual_fuel_consumption = 0
+    annual_unmet_demand = 0.
+    annual_excess_gen = 0.
+    annual_diesel_gen = 0.
+    annual_battery_use = 0.
+    annual_fuel_consumption = 0.
 
-    # Arrays for tracking hourly values throughout the year (for plotting purposes)
-    diesel_gen_curve = []
-    battery_soc_curve = []
+    # Run the simulation for each hour during one year
+    for hour in hour_numbers:
+        load = net_load[int(hour)]
 
-    net_load = net_load[0]
+        diesel_gen, annual_fuel_consumption, annual_diesel_gen, annual_battery_use, soc, annual_unmet_demand, \
+            annual_excess_gen = hour_simulation_wind(hour, soc, load, diesel_capacity, annual_fuel_consumption,
+                                                annual_diesel_gen,
+                                                inv_eff, n_dis, n_chg, battery_size, annual_battery_use,
+                                                annual_unmet_demand,
+                                                annual_excess_gen)
+
+    return year_performance_wind(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen,
+                                 annual_diesel_gen, annual_fuel_consumption, annual_demand, full_life_cycles)
+
+
+@numba.njit
+def year_simulation_wind_trace(battery_size, diesel_capacity, net_load, hour_numbers, inv_eff, n_dis, n_chg,
+                               annual_demand, full_life_cycles, dod_max, battery_soc_curve, diesel_gen_curve):
+    """
+    Same as year_simulation_wind_metrics, but the battery SOC and diesel generation in each simulated hour are also
+    written to the preallocated arrays battery_soc_curve and diesel_gen_curve (float32, one value per hour simulated).
+    """
+    soc = 0.5  # Initial SOC of battery
+
+    # Variables for tracking annual performance information
+    annual_unmet_demand = 0.
+    annual_excess_gen = 0.
+    annual_diesel_gen = 0.
+    annual_battery_use = 0.
+    annual_fuel_consumption = 0.
 
     # Run the simulation for each hour during one year
-    for hour in hour_numbers:
+    for i in range(len(hour_numbers)):
+        hour = hour_numbers[i]
         load = net_load[int(hour)]
 
         diesel_gen, annual_fuel_consumption, annual_diesel_gen, annual_battery_use, soc, annual_unmet_demand, \
@@ -111,9 +163,16 @@ def year_simulation_wind(battery_size, diesel_capacity, net_load, hour_numbers,
                                                 annual_excess_gen)
 
         # Update plotting arrays
-        diesel_gen_curve.append(diesel_gen)
-        battery_soc_curve.append(soc)
+        diesel_gen_curve[i] = diesel_gen
+        battery_soc_curve[i] = soc
+
+    return year_performance_wind(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen,
+                                 annual_diesel_gen, annual_fuel_consumption, annual_demand, full_life_cycles)
+
 
+@numba.njit
+def year_performance_wind(battery_size, annual_battery_use, annual_unmet_demand, annual_excess_gen, annual_diesel_gen,
+                          annual_fuel_consumption, annual_demand, full_life_cycles):
     # When a full year has been simulated, calculate battery life and performance metrics
     if (battery_size > 0) & (annual_battery_use > 0):
         battery_life = min(round(full_life_cycles / (annual_battery_use)), 20)  # ToDo should dod_max be included here?
@@ -124,8 +183,7 @@ def year_simulation_wind(battery_size, diesel_capacity, net_load, hour_numbers,
     excess_gen_share = annual_excess_gen / annual_demand
     diesel_generation_share = annual_diesel_gen / annual_demand
 
-    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, \
-        excess_gen_share, battery_soc_curve, diesel_gen_curve
+    return diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share
 
 
 @numba.njit
@@ -400,14 +458,17 @@ def calc_load_curve_wind(tier, annual_demand):
 #         print('No token provided')
 
 
-def read_wind_environmental_data(wind_path, skiprows=3, wind_col=3):
+def read_wind_environmental_data(wind_path, skiprows=3, wind_col=3, cache_dir=None):
     """
         This method reads the wind resource (m/s) for each hour during one year from a csv-file.
-        The skiprows and skipcolumns define which rows and columns the data should be read from.
+        The skiprows and skipcolumns define which rows and columns the data should be read from. The csv-file is
+        only parsed the first time, see load_resource_profiles (and cache_dir there).
     """
     try:
-        wind_curve = pd.read_csv(wind_path, usecols=[wind_col], skiprows=skiprows).values
-        return wind_curve
-    except:
+        profiles = load_resource_profiles(wind_path, [wind_col], skiprows, cache_dir=cache_dir)
+    except Exception:
         print('Could not read data, try changing which columns and rows ro read')
+        raise
+
+    return profiles[:, [0]]
 
@@ -1,3 +1,4 @@
+import copy
 import logging
 from math import log, pi
 from typing import Dict
@@ -7,7 +8,8 @@ from shapely.geometry import Point
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-from numba import njit
+import numba
+from numba import njit, prange
 import shapely.geometry
 import geojson
 
@@ -112,6 +114,325 @@ SET_AVERAGE_TO_PEAK = "AverageToPeakLoadRatio"
 # General
 LHV_DIESEL = 9.9445485  # (kWh/l) lower heating value
 HOURS_PER_YEAR = 8760
+# Memory of the temporary arrays of a per-settlement stage (LCOEs of several technologies and years, networks), in
+# bytes per settlement, in addition to the settlement's columns (see SettlementProcessor.chunk_size)
+CHUNK_TEMPORARY_BYTES = 4096
+# Differential evolution warm-started from a neighbouring optimum (see optimize_mini_grid): population size multiplier,
+# members placed around the warm start and relative convergence tolerance, against popsize=15 and tol=0.01 cold
+WARM_START_POPSIZE = 5
+WARM_START_NEAR = 5
+WARM_START_TOL = 0.005
+
+
+def float_dtype(*values):
+    """float32 if the float arrays (or Series) among the values are all float32, as with
+    SettlementProcessor(precision='float32'), else float64"""
+    dtypes = [value.dtype for value in values if getattr(value, 'dtype', None) is not None and value.dtype.kind == 'f']
+    if dtypes and all(dtype == np.float32 for dtype in dtypes):
+        return np.dtype('float32')
+    return np.dtype('float64')
+
+
+def set_num_threads(num_threads=None):
+    """Sets the number of threads of the parallel numba kernels, e.g. of the 'numba' backend of Technology.get_lcoe,
+    for the calling thread. None uses all threads numba was started with (NUMBA_NUM_THREADS). Returns the previous
+    number of threads."""
+    previous = numba.get_num_threads()
+    numba.set_num_threads(numba.config.NUMBA_NUM_THREADS if num_threads is None else num_threads)
+    return previous
+
+
+@njit(error_model='numpy')
+def _maximum(a, b):
+    # np.maximum of two scalars, NaN if either is NaN
+    if np.isnan(a) or np.isnan(b):
+        return np.nan
+    return a if a > b else b
+
+
+@njit(error_model='numpy')
+def _distribution_network_nb(connections, consumption, grid_cell_area, base_to_peak_load_ratio, productive_nodes,
+                             standalone, distribution_losses, power_factor, lv_line_max_length, service_transf_type,
+                             max_nodes_per_serv_trans, load_moment):
+    # One settlement of Technology.distribution_network
+    average_load = consumption / (1 - distribution_losses) / HOURS_PER_YEAR
+    peak_load = average_load / base_to_peak_load_ratio
+
+    if standalone:
+        return 0., 0., 0., consumption, peak_load, 0.
+
+    s_max = peak_load / power_factor
+    max_transformer_area = pi * lv_line_max_length ** 2
+    total_nodes = connections + productive_nodes
+
+    no_of_service_transf = np.ceil(_maximum(s_max / service_transf_type,
+                                            _maximum(total_nodes / max_nodes_per_serv_trans,
+                                                     grid_cell_area / max_transformer_area)))
+
+    transformer_radius = ((grid_cell_area / no_of_service_transf) / pi) ** 0.5
+    transformer_load = peak_load / no_of_service_transf
+    cluster_radius = (grid_cell_area / pi) ** 0.5
+
+    cluster_lv_lines_length = 0.
+    cluster_mv_lines_length = 0.
+    if 2 / 3 * cluster_radius * transformer_load * 1000 < load_moment:
+        cluster_lv_lines_length = 2 / 3 * cluster_radius * no_of_service_transf
+    if 2 / 3 * cluster_radius * transformer_load * 1000 >= load_moment:
+        cluster_mv_lines_length = 2 * transformer_radius * no_of_service_transf
+
+    hh_area = grid_cell_area / total_nodes
+    hh_diameter = 2 * ((hh_area / pi) ** 0.5)
+    lv_km = cluster_lv_lines_length + hh_diameter * total_nodes
+
+    return cluster_mv_lines_length, lv_km, no_of_service_transf, consumption, peak_load, total_nodes
+
+
+@njit(error_model='numpy')
+def _transmission_network_nb(peak_load, additional_mv_line_length, additional_transformer, standalone,
+                             max_mv_load, mv_line_capacity, hv_line_capacity, mv_line_max_length,
+                             hv_mv_substation_type):
+    # One settlement of Technology.transmission_network
+    if standalone:
+        return 0., 0., 0.
+
+    mv_km = 0.
+    hv_km = 0.
+    if (peak_load <= max_mv_load) and (additional_mv_line_length < mv_line_max_length):
+        mv_km = additional_mv_line_length * np.ceil(peak_load / mv_line_capacity)
+    else:
+        hv_km = additional_mv_line_length * np.ceil(peak_load / hv_line_capacity)
+
+    no_of_hv_mv_subs = 0.
+    if additional_transformer:
+        no_of_hv_mv_subs = np.ceil(peak_load / hv_mv_substation_type)
+
+    return hv_km, mv_km, no_of_hv_mv_subs
+
+
+@njit(error_model='numpy')
+def _td_network_settlement_nb(people, new_connections, code, total_energy_per_cell, energy_per_cell,
+                              num_people_per_hh, grid_cell_area, base_to_peak_load_ratio, additional_mv_line_length,
+                              productive_nodes, additional_transformer, network):
+    # One settlement of Technology.td_network_cost, network are the parameters of Technology.network_kernel_parameters
+    standalone, mini_grid, distribution_losses, power_factor, lv_line_max_length, service_transf_type, \
+        max_nodes_per_serv_trans, load_moment, max_mv_load, mv_line_capacity, hv_line_capacity, mv_line_max_length, \
+        hv_mv_substation_type, hv_line_cost, mv_line_cost, lv_line_cost, service_transf_cost, connection_cost_per_hh, \
+        hv_mv_sub_station_cost = network
+    households = np.round(people / num_people_per_hh)
+
+    mv_total, lv_total, transf_total, gen_total, peak_total, nodes_total = _distribution_network_nb(
+        households, total_energy_per_cell, grid_cell_area, base_to_peak_load_ratio, productive_nodes,
+        standalone, distribution_losses, power_factor, lv_line_max_length, service_transf_type,
+        max_nodes_per_serv_trans, load_moment)
+    mv_existing, lv_existing, transf_existing, gen_existing, peak_existing, nodes_existing = \
+        _distribution_network_nb(_maximum(households - new_connections, 1.),
+                                 total_energy_per_cell - energy_per_cell, grid_cell_area,
+                                 base_to_peak_load_ratio, productive_nodes, standalone, distribution_losses,
+                                 power_factor, lv_line_max_length, service_transf_type, max_nodes_per_serv_trans,
+                                 load_moment)
+    mv_new, lv_new, transf_new, gen_new, peak_new, nodes_new = _distribution_network_nb(
+        households, energy_per_cell, grid_cell_area, base_to_peak_load_ratio, productive_nodes,
+        standalone, distribution_losses, power_factor, lv_line_max_length, service_transf_type,
+        max_nodes_per_serv_trans, load_moment)
+
+    hv_km_total, mv_km_total, subs_total = _transmission_network_nb(
+        peak_total, additional_mv_line_length, additional_transformer, standalone, max_mv_load,
+        mv_line_capacity, hv_line_capacity, mv_line_max_length, hv_mv_substation_type)
+    hv_km_existing, mv_km_existing, subs_existing = _transmission_network_nb(
+        peak_existing, additional_mv_line_length, additional_transformer, standalone, max_mv_load,
+        mv_line_capacity, hv_line_capacity, mv_line_max_length, hv_mv_substation_type)
+    hv_km_new, mv_km_new, subs_new = _transmission_network_nb(
+        peak_new, additional_mv_line_length, additional_transformer, standalone, max_mv_load,
+        mv_line_capacity, hv_line_capacity, mv_line_max_length, hv_mv_substation_type)
+
+    # Settlements with a distribution network already get the additional components only
+    if (code != 3) and (code != 99):
+        mv_distribution = _maximum(mv_total - mv_existing, 0.)
+        lv = _maximum(lv_total - lv_existing, 0.)
+        transformers = _maximum(transf_total - transf_existing, 0.)
+        nodes = _maximum(nodes_total - nodes_existing, 0.)
+        subs = _maximum(subs_total - subs_existing, 0.)
+        generation = _maximum(gen_total - gen_existing, 0.)
+    else:
+        mv_distribution = mv_new
+        lv = lv_new
+        transformers = transf_new
+        nodes = nodes_new
+        subs = subs_new
+        generation = gen_new
+
+    if code < 3:
+        hv_km = _maximum(hv_km_total - hv_km_existing, 0.)
+        mv_connection = _maximum(mv_km_total - mv_km_existing, 0.)
+    else:
+        hv_km = hv_km_new
+        mv_connection = mv_km_new
+
+    if code != 99:
+        peak_load = _maximum(peak_total - peak_existing, 0.)
+    else:
+        peak_load = peak_new
+
+    power_house = 0.
+    if mini_grid and (code != 5) and (code != 6) and (code != 7):
+        power_house = 20000.
+
+    hv_cost = hv_km * hv_line_cost
+    mv_cost = mv_distribution * mv_line_cost
+    lv_cost = lv * lv_line_cost
+    transformer_cost = transformers * service_transf_cost
+    connection_cost = nodes * connection_cost_per_hh
+    td_investment_cost = (hv_cost + mv_connection * mv_line_cost + lv_cost + mv_cost + transformer_cost +
+                          connection_cost + subs * hv_mv_sub_station_cost) + power_house
+
+    return generation, peak_load, td_investment_cost, hv_cost, mv_cost, lv_cost, transformer_cost, connection_cost
+
+
+@njit(parallel=True, error_model='numpy')
+def td_network_cost_nb(people, new_connections, prev_code, total_energy_per_cell, energy_per_cell, num_people_per_hh,
+                       grid_cell_area, base_to_peak_load_ratio, additional_mv_line_length, productive_nodes,
+                       additional_transformer, network):
+    """
+    Fused version of Technology.td_network_cost: computes the total, existing and new distribution and transmission
+    network of each settlement in one pass, without the full-length temporaries of the numpy version. All settlement
+    arguments are float64 (or float32) arrays of the same length, network are the Technology.network_kernel_parameters.
+
+    Returns the generation per year, peak load, T&D investment cost, and the HV line, MV distribution line, LV line,
+    service transformer and connection costs, one array each.
+    """
+    n = len(people)
+    generation_per_year = np.empty_like(people)
+    peak_load = np.empty_like(people)
+    td_investment_cost = np.empty_like(people)
+    hv_cost = np.empty_like(people)
+    mv_cost = np.empty_like(people)
+    lv_cost = np.empty_like(people)
+    transformer_cost = np.empty_like(people)
+    connection_cost = np.empty_like(people)
+
+    for i in prange(n):
+        generation_per_year[i], peak_load[i], td_investment_cost[i], hv_cost[i], mv_cost[i], lv_cost[i], \
+            transformer_cost[i], connection_cost[i] = _td_network_settlement_nb(
+                people[i], new_connections[i], prev_code[i], total_energy_per_cell[i], energy_per_cell[i],
+                num_people_per_hh[i], grid_cell_area[i], base_to_peak_load_ratio[i], additional_mv_line_length[i],
+                productive_nodes[i], additional_transformer, network)
+
+    return generation_per_year, peak_load, td_investment_cost, hv_cost, mv_cost, lv_cost, transformer_cost, \
+        connection_cost
+
+
+@njit(error_model='numpy')
+def _capital_cost_nb(thresholds, costs, capacity):
+    # Technology.capital_cost_per_kw of one capacity: the cost of the first threshold above it, the 0 sentinel if none
+    for j in range(len(thresholds)):
+        if capacity < thresholds[j]:
+            return costs[j]
+    return costs[len(thresholds)]
+
+
+@njit(error_model='numpy')
+def _backup_settlement_nb(people, num_people_per_hh, demand, unmet_demand, fuel_cost, base_to_peak_load_ratio,
+                          thresholds, costs, backup):
+    # One settlement of Technology.get_lcoe_backup, backup are the parameters of Technology.backup_kernel_parameters
+    standalone, capacity_factor, efficiency, om_costs, investment_factor, life_factor, salvage_fraction, \
+        salvage_factor = backup
+    unmet_demand = _maximum(unmet_demand, 0.000000000001)
+    capacity = demand / capacity_factor / HOURS_PER_YEAR / base_to_peak_load_ratio
+    if standalone:
+        cap_cost = unmet_demand * 0 + _capital_cost_nb(thresholds, costs, capacity / (people / num_people_per_hh))
+    else:
+        cap_cost = unmet_demand * 0 + _capital_cost_nb(thresholds, costs, capacity)
+
+    total_investment_cost = capacity * cap_cost
+    fuel = unmet_demand / efficiency * fuel_cost
+    total_om_cost = capacity * om_costs * cap_cost
+    salvage_value = total_investment_cost * salvage_fraction
+
+    discounted_investment = total_investment_cost * investment_factor
+    discounted_total = discounted_investment + (fuel + total_om_cost) * life_factor - salvage_value * salvage_factor
+    return discounted_total, discounted_investment, capacity
+
+
+@njit(parallel=True, error_model='numpy')
+def lcoe_backup_nb(people, num_people_per_hh, demand, unmet_demand, fuel_cost, base_to_peak_load_ratio, thresholds,
+                   costs, backup):
+    """Fused version of Technology.get_lcoe_backup. All settlement arguments are float64 (or float32) arrays of the
+    same length, backup are the Technology.backup_kernel_parameters. Returns the discounted total costs, the discounted investment
+    and the capacity of the back-up generators."""
+    n = len(people)
+    discounted_total = np.empty_like(people)
+    discounted_investment = np.empty_like(people)
+    capacity = np.empty_like(people)
+    for i in prange(n):
+        discounted_total[i], discounted_investment[i], capacity[i] = _backup_settlement_nb(
+            people[i], num_people_per_hh[i], demand[i], unmet_demand[i], fuel_cost[i], base_to_peak_load_ratio[i],
+            thresholds, costs, backup)
+    return discounted_total, discounted_investment, capacity
+
+
+@njit(parallel=True, error_model='numpy')
+def lcoe_nb(people, new_connections, prev_code, total_energy_per_cell, energy_per_cell, num_people_per_hh,
+            grid_cell_area, base_to_peak_load_ratio, additional_mv_line_length, productive_nodes, capacity_factor,
+            penalty, fuel_cost, unmet_demand, fuel_cost_settlement, additional_transformer, network, thresholds,
+            costs, lcoe_parameters, reliability_option, backup_thresholds, backup_costs, backup):
+    """
+    Fused version of Technology.get_lcoe: the T&D network, capacity, investment and discounted costs of each settlement
+    are computed in one pass, without temporary arrays. All settlement arguments are float64 (or float32) arrays of the
+    same length, the results have the same type.
+    network, lcoe_parameters and backup are the Technology.network_kernel_parameters, lcoe_kernel_parameters and
+    (of the back-up generator) backup_kernel_parameters. reliability_option is 0 for no cost of unreliable grid supply,
+    1 for CNSE and 2 for a diesel back-up generator.
+
+    Returns the LCOE, investment cost, installed capacity, peak load and generation per year, one array each.
+    """
+    standalone, om_of_td_lines, om_costs, grid_capacity_investment, cnse, investments, investment_factor, \
+        om_factor, generation_factor, salvage_fraction, salvage_factor, reliability_factor = lcoe_parameters
+    n = len(people)
+    lcoe = np.empty_like(people)
+    investment_cost = np.empty_like(people)
+    installed_capacity = np.empty_like(people)
+    peak_load = np.empty_like(people)
+    generation_per_year = np.empty_like(people)
+
+    for i in prange(n):
+        settlement_people = _maximum(people[i], 0.00001)
+        energy = _maximum(energy_per_cell[i], 0.000000000001)
+        generation, peak, td_investment_cost = _td_network_settlement_nb(
+            settlement_people, new_connections[i], prev_code[i], total_energy_per_cell[i], energy,
+            num_people_per_hh[i], grid_cell_area[i], base_to_peak_load_ratio[i], additional_mv_line_length[i],
+            productive_nodes[i], additional_transformer, network)[:3]
+
+        td_om_cost = td_investment_cost * om_of_td_lines * penalty[i]
+        capacity = peak / capacity_factor[i]
+        if standalone:
+            cap_cost = td_investment_cost * 0 + _capital_cost_nb(thresholds, costs,
+                                                                 capacity / (settlement_people / num_people_per_hh[i]))
+        else:
+            cap_cost = td_investment_cost * 0 + _capital_cost_nb(thresholds, costs, capacity)
+        total_om_cost = td_om_cost + (cap_cost * penalty[i] * om_costs * capacity)
+        total_investment_cost = td_investment_cost + capacity * cap_cost
+
+        discounted_reliability = 0.
+        discounted_backup = 0.
+        backup_capacity = 0.
+        if reliability_option == 1:
+            discounted_reliability = unmet_demand[i] * cnse * reliability_factor
+        elif reliability_option == 2:
+            discounted_reliability, discounted_backup, backup_capacity = _backup_settlement_nb(
+                new_connections[i], num_people_per_hh[i], energy, unmet_demand[i], fuel_cost_settlement[i],
+                base_to_peak_load_ratio[i], backup_thresholds, backup_costs, backup)
+
+        investment_cost[i] = (total_investment_cost + peak * grid_capacity_investment) * investments + \
+            discounted_backup
+        discounted_costs = total_investment_cost * investment_factor + (total_om_cost * om_factor) + \
+            generation * fuel_cost[i] * generation_factor - \
+            total_investment_cost * salvage_fraction * salvage_factor + discounted_reliability
+        lcoe[i] = discounted_costs / (generation * generation_factor)
+        installed_capacity[i] = capacity + backup_capacity
+        peak_load[i] = peak
+        generation_per_year[i] = generation
+
+    return lcoe, investment_cost, installed_capacity, peak_load, generation_per_year
 
 
 class Technology:
@@ -214,11 +535,100 @@ class Technology:
         cls.power_factor = power_factor
         cls.load_moment = load_moment  # for 50mm aluminum conductor under 5% voltage drop (kW m)
 
+    def capital_cost_per_kw(self, capacity):
+        """Capital cost (USD/kW) of each capacity (kW, or kW per household for stand-alone systems): the cost of the
+        lowest capital_cost threshold above the capacity, 0 if there is none (e.g. for NaN). A tier costing 0 takes the
+        cost of the next tier.
+
+        The capital_cost dict is compiled into sorted threshold and cost arrays once, and compiled again only if it
+        changes. The costs are then looked up with one np.searchsorted."""
+        thresholds, costs = self.capital_cost_tiers()
+        return costs.astype(float_dtype(capacity), copy=False)[
+            np.searchsorted(thresholds, np.asarray(capacity, dtype='float64'), side='right')]
+
+    def capital_cost_tiers(self):
+        """The sorted capital_cost thresholds, and the cost of each tier followed by the 0 sentinel, see
+        capital_cost_per_kw"""
+        tiers = tuple(sorted(self.capital_cost.items()))
+        if getattr(self, '_capital_cost_tiers', (None,))[0] != tiers:
+            thresholds = np.array([key for key, cost in tiers], dtype='float64')
+            costs = np.zeros(len(tiers) + 1)
+            for i in range(len(tiers) - 1, -1, -1):
+                costs[i] = tiers[i][1] if tiers[i][1] != 0 else costs[i + 1]
+            self._capital_cost_tiers = (tiers, thresholds, costs)
+
+        return self._capital_cost_tiers[1:]
+
+    @staticmethod
+    def nonzero_people_and_demand(people, energy_per_cell):
+        if type(people) == int or type(people) == float or type(people) == np.float64:
+            if people == 0:
+                # If there are no people, set the people low (prevent div/0 error) and continue.
+                people = 0.00001
+        else:
+            people = np.maximum(people, 0.00001)
+
+        if type(energy_per_cell) == int or type(energy_per_cell) == float or type(energy_per_cell) == np.float64:
+            if energy_per_cell == 0:
+                # If there is no demand, set the demand low (prevent div/0 error) and continue.
+                energy_per_cell = 0.000000000001
+        else:
+            energy_per_cell = np.maximum(energy_per_cell, 0.000000000001)
+
+        return people, energy_per_cell
+
+    @staticmethod
+    def get_lcoe_many(technologies, per_technology=None, **kwargs):
+        """Calculates the LCOE of several technologies for the same settlements.
+
+        The distribution networks (households, network geometry and peak loads) are computed once for all
+        technologies with the same network_parameters and base to peak load ratio, instead of once per technology.
+
+        Arguments
+        ---------
+        technologies : list of Technology
+        per_technology : list of dict, optional
+            get_lcoe arguments that differ between the technologies, one dict per technology, e.g. the
+            capacity_factor or additional_mv_line_length
+        kwargs
+            get_lcoe arguments that are the same for all technologies
+
+        Returns
+        -------
+        lcoe, investment and capacity : numpy.ndarray
+            Each of shape (settlements, technologies), e.g. lcoe.argmin(axis=1) is the least-cost technology
+        """
+        if per_technology is None:
+            per_technology = [{}] * len(technologies)
+
+        people, energy_per_cell = Technology.nonzero_people_and_demand(kwargs['people'], kwargs['energy_per_cell'])
+
+        distributions = {}
+        results = []
+        for technology, arguments in zip(technologies, per_technology):
+            arguments = dict(kwargs, **arguments)
+            if arguments.get('backend', 'numpy') == 'numpy':
+                base_to_peak_load_ratio = arguments['base_to_peak_load_ratio']
+                productive_nodes = arguments.get('productive_nodes', 0)
+                # The inputs are the same objects for all technologies, while this function runs
+                key = (technology.network_parameters(), id(base_to_peak_load_ratio), id(productive_nodes))
+                if key not in distributions:
+                    distributions[key] = technology.distribution_networks(
+                        people, arguments['new_connections'], arguments['total_energy_per_cell'], energy_per_cell,
+                        arguments['num_people_per_hh'], arguments['grid_cell_area'], base_to_peak_load_ratio,
+                        productive_nodes)
+                arguments['distribution'] = distributions[key]
+            results.append([np.asarray(result[0], dtype=float_dtype(result[0]))
+                            for result in technology.get_lcoe(**arguments)[:3]])
+
+        lcoe, investment, capacity = [np.column_stack([result[i] for result in results]) for i in range(3)]
+        return lcoe, investment, capacity
+
     def get_lcoe(self, energy_per_cell, people, num_people_per_hh, start_year, end_year, new_connections,
                  total_energy_per_cell, prev_code, grid_cell_area, base_to_peak_load_ratio, sa_diesel_calc={}, unmet_demand=0, additional_mv_line_length=0.0,
                  capacity_factor=0.9, grid_penalty_ratio=1, fuel_cost=0, elec_loop=0,
                  productive_nodes=0,  additional_transformer=0, penalty=1, get_max_dist=False, fuel_cost_settlement=0,
-                 grid_reliability_option='None'):
+                 grid_reliability_option='None', backend='numpy', extension_slope=False, distribution=None):
         """Calculates the LCOE depending on the parameters.
 
         Parameters
@@ -252,66 +662,23 @@ class Technology:
         capacity_factor : float or pandas.Series
         grid_penalty_ratio : float or pandas.Series
         fuel_cost : float or pandas.Series
+        backend : str
+            'numpy', or 'numba' to compute the LCOE, investment and capacity of each settlement with the fused,
+            parallel lcoe_nb kernel (see set_num_threads), without intermediate arrays
+        extension_slope : bool
+            If True (with get_max_dist), the increase of the LCOE and of the investment cost per km of
+            additional_mv_line_length are returned as well. Both are linear in the distance below mv_line_max_length,
+            see td_network_cost_per_km.
+        distribution : tuple, optional
+            Precomputed distribution_networks, see td_network_cost
 
         Returns
         -------
         lcoe or discounted investment cost
         """
 
-        if type(people) == int or type(people) == float or type(people) == np.float64:
-            if people == 0:
-                # If there are no people, set the people low (prevent div/0 error) and continue.
-                people = 0.00001
-        else:
-            people = np.maximum(people, 0.00001)
-
-        if type(energy_per_cell) == int or type(energy_per_cell) == float or type(energy_per_cell) == np.float64:
-            if energy_per_cell == 0:
-                # If there is no demand, set the demand low (prevent div/0 error) and continue.
-                energy_per_cell = 0.000000000001
-        else:
-            energy_per_cell = np.maximum(energy_per_cell, 0.000000000001)
-
         grid_penalty_ratio = 1
 
-        generation_per_year, peak_load, td_investment_cost, hv, mv, lv, service_transf, connection = \
-            self.td_network_cost(people,
-                                 new_connections,
-                                 prev_code,
-                                 total_energy_per_cell,
-                                 energy_per_cell,
-                                 num_people_per_hh,
-                                 grid_cell_area,
-                                 base_to_peak_load_ratio,
-                                 additional_mv_line_length,
-                                 additional_transformer,
-                                 productive_nodes,
-                                 elec_loop,
-                                 penalty
-                                 )
-
-        generation_per_year = pd.Series(generation_per_year)
-        peak_load = pd.Series(peak_load)
-        td_investment_cost = pd.Series(td_investment_cost)
-
-        td_investment_cost = td_investment_cost # * grid_penalty_ratio
-        td_om_cost = td_investment_cost * self.om_of_td_lines * penalty
-        installed_capacity = peak_load / capacity_factor
-
-        cap_cost = td_investment_cost * 0
-        cost_dict_list = self.capital_cost.keys()
-        cost_dict_list = sorted(cost_dict_list)
-        for key in cost_dict_list:
-            if self.standalone:
-                cap_cost.loc[((installed_capacity / (people / num_people_per_hh)) < key) & (cap_cost == 0)] = \
-                    self.capital_cost[key]
-            else:
-                cap_cost.loc[(installed_capacity < key) & (cap_cost == 0)] = self.capital_cost[key]
-
-        capital_investment = installed_capacity * cap_cost  # * penalty
-        total_om_cost = td_om_cost + (cap_cost * penalty * self.om_costs * installed_capacity)
-        total_investment_cost = td_investment_cost + capital_investment
-
         if self.grid_price > 0:
             fuel_cost = self.grid_price
 
@@ -323,24 +690,21 @@ class Technology:
         if self.tech_life + step < project_life:
             reinvest_year = self.tech_life + step
 
+        # Every cost and the generation are a per-settlement amount times a yearly profile that is the same for all
+        # settlements. The discounted sums over the years are therefore the amounts times the discounted sums of the
+        # profiles, which avoids (settlements x years) matrices.
         year = np.arange(project_life)
-        el_gen = np.outer(np.asarray(generation_per_year), np.ones(project_life))
-        for s in range(step):
-            el_gen[:, s] = 0
         discount_factor = (1 + self.discount_rate) ** year
+
+        el_gen = np.ones(project_life)
+        for s in range(step):
+            el_gen[s] = 0
+
         investments = np.zeros(project_life)
         investments[step] = 1
         # Calculate the year of re-investment if tech_life is smaller than project life
         if reinvest_year:
             investments[reinvest_year] = 1
-        investments = np.outer(total_investment_cost, investments)
-
-        grid_capacity_investments = np.zeros(project_life)
-        grid_capacity_investments[step] = 1
-        # Calculate the year of re-investment if tech_life is smaller than project life
-        if reinvest_year:
-            grid_capacity_investments[reinvest_year] = 1
-        grid_capacity_investments = np.outer(peak_load * self.grid_capacity_investment, grid_capacity_investments)
 
         # Calculate salvage value if tech_life is bigger than project life
         salvage = np.zeros(project_life)
@@ -349,54 +713,142 @@ class Technology:
         else:
             used_life = project_life - step - 1
         salvage[-1] = 1
-        salvage = np.outer(total_investment_cost * (1 - used_life / self.tech_life), salvage)
 
         operation_and_maintenance = np.ones(project_life)
         for s in range(step):
             operation_and_maintenance[s] = 0
-        operation_and_maintenance = np.outer(total_om_cost, operation_and_maintenance)
-        fuel = np.outer(np.asarray(generation_per_year), np.zeros(project_life))
-        for p in range(project_life):
-            fuel[:, p] = el_gen[:, p] * fuel_cost
-
-        if grid_reliability_option == 'DieselBackup':
-            total_costs_reliability, discounted_costs_backup, backup_capacity = \
-                sa_diesel_calc.get_lcoe_backup(project_life, step, new_connections, num_people_per_hh, energy_per_cell,
-                                               unmet_demand, fuel_cost_settlement, base_to_peak_load_ratio)
-        elif grid_reliability_option == 'CNSE':
-            discounted_costs_backup = np.outer(unmet_demand, 0)
-            total_costs_reliability = np.outer(unmet_demand, self.cnse)
-            backup_capacity = 0
-        else: # if grid_reliability_option == 'None'
-            discounted_costs_backup = np.outer(unmet_demand, 0)
-            total_costs_reliability = np.outer(unmet_demand, 0)
-            backup_capacity = 0
-
-        discounted_investments = investments / discount_factor
-        discounted_grid_capacity_investments = grid_capacity_investments / discount_factor
-
-        investment_cost = (np.sum(investments, axis=1) + np.sum(grid_capacity_investments, axis=1) + np.sum(discounted_costs_backup, axis=1))
-        discounted_investment_cost = (np.sum(discounted_investments, axis=1) + np.sum(discounted_grid_capacity_investments, axis=1) + np.sum(discounted_costs_backup, axis=1))
-        discounted_costs = (investments + operation_and_maintenance + fuel - salvage + total_costs_reliability) / discount_factor
-        #investment_cost = np.sum(discounted_investments, axis=1) + np.sum(discounted_grid_capacity_investments, axis=1)
-        #discounted_costs = (investments + operation_and_maintenance + fuel - salvage) / discount_factor
-        discounted_generation = el_gen / discount_factor
-        lcoe = np.sum(discounted_costs, axis=1) / np.sum(discounted_generation, axis=1)
-        # lcoe = pd.DataFrame(lcoe[:, np.newaxis])
-        # investment_cost = pd.DataFrame(investment_cost[:, np.newaxis])
-        # installed_capacity = pd.DataFrame(installed_capacity[:, np.newaxis])
+
+        # The discounted sums as Python floats, which keep the precision of float32 settlement arrays
+        total_investments = float(np.sum(investments))
+        investment_factor = float(np.sum(investments / discount_factor))
+        om_factor = float(np.sum(operation_and_maintenance / discount_factor))
+        generation_factor = float(np.sum(el_gen / discount_factor))
+        salvage_fraction = 1 - used_life / self.tech_life
+        salvage_factor = float(np.sum(salvage / discount_factor))
+        dtype = float_dtype(people, new_connections, total_energy_per_cell, energy_per_cell)
+
+        if backend == 'numba':
+            reliability_option = {'CNSE': 1, 'DieselBackup': 2}.get(grid_reliability_option, 0)
+            if reliability_option == 2:
+                backup_thresholds, backup_costs = sa_diesel_calc.capital_cost_tiers()
+                backup = sa_diesel_calc.backup_kernel_parameters(project_life, step)
+            else:
+                backup_thresholds, backup_costs, backup = np.zeros(0), np.zeros(1), (0.,) * 8
+            thresholds, costs = self.capital_cost_tiers()
+            lcoe_parameters = tuple(float(parameter) for parameter in
+                                    [self.standalone, self.om_of_td_lines, self.om_costs,
+                                     self.grid_capacity_investment, self.cnse, total_investments, investment_factor,
+                                     om_factor, generation_factor, salvage_fraction, salvage_factor,
+                                     np.sum(1 / discount_factor)])
+
+            lcoe, investment_cost, installed_capacity, peak_load, generation_per_year = lcoe_nb(
+                *self.kernel_arrays(people, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
+                                    num_people_per_hh, grid_cell_area, base_to_peak_load_ratio,
+                                    additional_mv_line_length, productive_nodes, capacity_factor, penalty, fuel_cost,
+                                    unmet_demand, fuel_cost_settlement, dtype=dtype),
+                bool(additional_transformer), self.network_kernel_parameters(), thresholds, costs, lcoe_parameters,
+                reliability_option, backup_thresholds, backup_costs, backup)
+            peak_load = pd.Series(peak_load)
+            discounted_generation = generation_per_year * generation_factor
+        else:
+            people, energy_per_cell = self.nonzero_people_and_demand(people, energy_per_cell)
+
+            generation_per_year, peak_load, td_investment_cost, hv, mv, lv, service_transf, connection = \
+                self.td_network_cost(people,
+                                     new_connections,
+                                     prev_code,
+                                     total_energy_per_cell,
+                                     energy_per_cell,
+                                     num_people_per_hh,
+                                     grid_cell_area,
+                                     base_to_peak_load_ratio,
+                                     additional_mv_line_length,
+                                     additional_transformer,
+                                     productive_nodes,
+                                     elec_loop,
+                                     penalty,
+                                     backend,
+                                     distribution
+                                     )
+
+            generation_per_year = pd.Series(generation_per_year)
+            peak_load = pd.Series(peak_load)
+            td_investment_cost = pd.Series(td_investment_cost)
+
+            td_investment_cost = td_investment_cost # * grid_penalty_ratio
+            td_om_cost = td_investment_cost * self.om_of_td_lines * penalty
+            installed_capacity = peak_load / capacity_factor
+
+            if self.standalone:
+                cap_cost = td_investment_cost * 0 + \
+                    self.capital_cost_per_kw(installed_capacity / (people / num_people_per_hh))
+            else:
+                cap_cost = td_investment_cost * 0 + self.capital_cost_per_kw(installed_capacity)
+
+            capital_investment = installed_capacity * cap_cost  # * penalty
+            total_om_cost = td_om_cost + (cap_cost * penalty * self.om_costs * installed_capacity)
+            total_investment_cost = td_investment_cost + capital_investment
+
+            generation_per_year = np.asarray(generation_per_year, dtype=dtype)
+            total_investment_cost = np.asarray(total_investment_cost, dtype=dtype)
+            salvage_value = total_investment_cost * salvage_fraction
+            grid_capacity_investment = np.asarray(peak_load, dtype=dtype) * self.grid_capacity_investment
+            fuel = generation_per_year * np.asarray(fuel_cost, dtype=dtype)
+
+            if grid_reliability_option == 'DieselBackup':
+                discounted_costs_reliability, discounted_costs_backup, backup_capacity = \
+                    sa_diesel_calc.get_lcoe_backup(project_life, step, new_connections, num_people_per_hh,
+                                                   energy_per_cell, unmet_demand, fuel_cost_settlement,
+                                                   base_to_peak_load_ratio)
+            elif grid_reliability_option == 'CNSE':
+                discounted_costs_backup = 0
+                discounted_costs_reliability = np.ravel(np.asarray(unmet_demand, dtype=dtype)) * self.cnse * \
+                    float(np.sum(1 / discount_factor))
+                backup_capacity = 0
+            else: # if grid_reliability_option == 'None'
+                discounted_costs_backup = 0
+                discounted_costs_reliability = 0
+                backup_capacity = 0
+
+            investment_cost = (total_investment_cost + grid_capacity_investment) * total_investments + \
+                discounted_costs_backup
+            discounted_costs = total_investment_cost * investment_factor + \
+                (np.asarray(total_om_cost, dtype=dtype) * om_factor) + \
+                fuel * generation_factor - salvage_value * salvage_factor + \
+                discounted_costs_reliability
+            #investment_cost = np.sum(discounted_investments, axis=1) + np.sum(discounted_grid_capacity_investments, axis=1)
+            #discounted_costs = (investments + operation_and_maintenance + fuel - salvage) / discount_factor
+            discounted_generation = generation_per_year * generation_factor
+            lcoe = discounted_costs / discounted_generation
+            installed_capacity = installed_capacity + backup_capacity
+            # lcoe = pd.DataFrame(lcoe[:, np.newaxis])
+            # investment_cost = pd.DataFrame(investment_cost[:, np.newaxis])
+            # installed_capacity = pd.DataFrame(installed_capacity[:, np.newaxis])
+
+        if extension_slope:
+            # Only the T&D investment depends on the distance: it is invested (and reinvested), has O&M costs and
+            # a salvage value
+            energy_per_cell = self.nonzero_people_and_demand(people, energy_per_cell)[1]
+            td_investment_per_km = np.asarray(
+                self.td_network_cost_per_km(new_connections, prev_code, total_energy_per_cell, energy_per_cell,
+                                            base_to_peak_load_ratio), dtype=dtype)
+            td_investment_factor = investment_factor + \
+                self.om_of_td_lines * np.asarray(penalty, dtype=dtype) * om_factor - salvage_fraction * salvage_factor
+            lcoe_per_km = pd.DataFrame(td_investment_per_km * td_investment_factor / discounted_generation)
+            investment_per_km = pd.DataFrame(td_investment_per_km * total_investments)
 
         lcoe = pd.DataFrame(lcoe)
         investment_cost = pd.DataFrame(investment_cost)
-        discounted_investment_cost = pd.DataFrame(discounted_investment_cost)
-        installed_capacity = pd.DataFrame(installed_capacity + backup_capacity)
+        installed_capacity = pd.DataFrame(installed_capacity)
 
         #if self.hybrid:
         #    print('Hybrid: ', lcoe, lcoe + pd.DataFrame(self.hybrid_fuel))
         #if get_max_dist:
         #    print('Grid: ', lcoe)
 
-        if get_max_dist:
+        if get_max_dist and extension_slope:
+            return lcoe, investment_cost, installed_capacity, peak_load, lcoe_per_km, investment_per_km
+        elif get_max_dist:
             return lcoe, investment_cost, installed_capacity, peak_load
         elif self.hybrid:
             hybrid_capacity = pd.DataFrame(self.hybrid_capacity)
@@ -404,32 +856,11 @@ class Technology:
         else:
             return lcoe, investment_cost, installed_capacity
 
-    def get_lcoe_backup(self, project_life, step, people, num_people_per_hh, demand, unmet_demand, fuel_cost_settlement,
-                        base_to_peak_load_ratio):
-
-        if type(unmet_demand) == int or type(unmet_demand) == float or type(unmet_demand) == np.float64:
-            if unmet_demand == 0:
-                # If there is no demand, set the demand low (prevent div/0 error) and continue.
-                unmet_demand = 0.000000000001
-        else:
-            unmet_demand = np.maximum(unmet_demand, 0.000000000001)
-
+    def backup_kernel_parameters(self, project_life, step):
+        """The parameters of a diesel back-up generator, as used by get_lcoe_backup and passed to the numba kernels:
+        its technical parameters and the discounted sums of its investments, operation and salvage over the project
+        life"""
         reinvest_year = 0
-
-        cap_cost = unmet_demand * 0
-        cost_dict_list = self.capital_cost.keys()
-        cost_dict_list = sorted(cost_dict_list)
-
-        # Sizing diesel generator
-        installed_capacity_diesel_genset = demand / self.capacity_factor / HOURS_PER_YEAR / base_to_peak_load_ratio
-
-        for key in cost_dict_list:
-            if self.standalone:
-                cap_cost.loc[((installed_capacity_diesel_genset / (people / num_people_per_hh)) < key) & (cap_cost == 0)] = \
-                    self.capital_cost[key]
-            else:
-                cap_cost.loc[(installed_capacity_diesel_genset < key) & (cap_cost == 0)] = self.capital_cost[key]
-
         # If the technology life is less than the project life, we will have to invest twice to buy it again
         if self.tech_life + step < project_life:
             reinvest_year = self.tech_life + step
@@ -439,23 +870,12 @@ class Technology:
 
         capital_cost_diesel_genset = np.zeros(project_life)
         capital_cost_diesel_genset[0] = 1
-        total_investment_cost = installed_capacity_diesel_genset * cap_cost
-
         # Calculate the year of re-investment if tech_life is smaller than project life
         if reinvest_year:
             capital_cost_diesel_genset[reinvest_year] = 1
-        capital_cost_diesel_genset = np.outer(total_investment_cost, capital_cost_diesel_genset)
 
-        # Diesel usage and O&M
-        diesel_gen_set_generation = unmet_demand / self.efficiency  # kWh
-        fuel_gen_set = diesel_gen_set_generation * fuel_cost_settlement  # kWh * USD/kWh
         life_time_diesel = np.ones(project_life)
 
-        total_om_cost_diesel = np.outer(
-            installed_capacity_diesel_genset * self.om_costs * cap_cost, life_time_diesel)
-
-        fuel_gen_set = np.outer(fuel_gen_set, life_time_diesel)
-
         if reinvest_year > 0:
             used_life = (project_life - step) - self.tech_life
         else:
@@ -463,14 +883,63 @@ class Technology:
 
         salvage_diesel_genset = np.zeros(project_life)
         salvage_diesel_genset[-1] = 1
-        salvage_diesel_genset = np.outer(installed_capacity_diesel_genset * cap_cost * (
-                    1 - used_life / self.tech_life), salvage_diesel_genset)
 
-        total_diesel_genset = capital_cost_diesel_genset + fuel_gen_set + total_om_cost_diesel - salvage_diesel_genset
+        return tuple(float(parameter) for parameter in
+                     [self.standalone, self.capacity_factor, self.efficiency, self.om_costs,
+                      np.sum(capital_cost_diesel_genset / discount_factor), np.sum(life_time_diesel / discount_factor),
+                      1 - used_life / self.tech_life, np.sum(salvage_diesel_genset / discount_factor)])
+
+    def get_lcoe_backup(self, project_life, step, people, num_people_per_hh, demand, unmet_demand, fuel_cost_settlement,
+                        base_to_peak_load_ratio, backend='numpy'):
+        """Costs of a diesel back-up generator for the unmet demand of unreliable grid supply. Returns the discounted
+        total costs and the discounted investment over the project life, and the generator capacity.
+
+        With backend='numba', the costs are computed by the fused, parallel lcoe_backup_nb kernel."""
+
+        backup = self.backup_kernel_parameters(project_life, step)
+        if backend == 'numba':
+            thresholds, costs = self.capital_cost_tiers()
+            return lcoe_backup_nb(*self.kernel_arrays(people, num_people_per_hh, demand, unmet_demand,
+                                                      fuel_cost_settlement, base_to_peak_load_ratio,
+                                                      dtype=float_dtype(people, demand, unmet_demand)),
+                                  thresholds, costs, backup)
+        elif backend != 'numpy':
+            raise ValueError('Unknown backend {}, use numpy or numba'.format(backend))
+        investment_factor, life_factor, salvage_fraction, salvage_factor = backup[4:]
+        dtype = float_dtype(people, demand, unmet_demand)
 
-        discounted_total_diesel_genset = capital_cost_diesel_genset / discount_factor
+        if type(unmet_demand) == int or type(unmet_demand) == float or type(unmet_demand) == np.float64:
+            if unmet_demand == 0:
+                # If there is no demand, set the demand low (prevent div/0 error) and continue.
+                unmet_demand = 0.000000000001
+        else:
+            unmet_demand = np.maximum(unmet_demand, 0.000000000001)
 
-        return total_diesel_genset, discounted_total_diesel_genset, installed_capacity_diesel_genset
+        # Sizing diesel generator
+        installed_capacity_diesel_genset = demand / self.capacity_factor / HOURS_PER_YEAR / base_to_peak_load_ratio
+
+        if self.standalone:
+            cap_cost = unmet_demand * 0 + \
+                self.capital_cost_per_kw(installed_capacity_diesel_genset / (people / num_people_per_hh))
+        else:
+            cap_cost = unmet_demand * 0 + self.capital_cost_per_kw(installed_capacity_diesel_genset)
+
+        total_investment_cost = np.asarray(installed_capacity_diesel_genset * cap_cost, dtype=dtype)
+
+        # Diesel usage and O&M
+        diesel_gen_set_generation = unmet_demand / self.efficiency  # kWh
+        fuel_gen_set = np.asarray(diesel_gen_set_generation * fuel_cost_settlement, dtype=dtype)  # kWh * USD/kWh
+
+        total_om_cost_diesel = np.asarray(installed_capacity_diesel_genset * self.om_costs * cap_cost, dtype=dtype)
+
+        salvage_value = total_investment_cost * salvage_fraction
+
+        # Discounted sums over the project life, see get_lcoe
+        discounted_investment_diesel_genset = total_investment_cost * investment_factor
+        discounted_total_diesel_genset = discounted_investment_diesel_genset + \
+            (fuel_gen_set + total_om_cost_diesel) * life_factor - salvage_value * salvage_factor
+
+        return discounted_total_diesel_genset, discounted_investment_diesel_genset, installed_capacity_diesel_genset
 
     def transmission_network(self, peak_load, additional_mv_line_length=0, additional_transformer=0):
         """This method calculates the required components for connecting the settlement
@@ -580,9 +1049,30 @@ class Technology:
 
         return cluster_mv_lines_length, lv_km, no_of_service_transf, consumption, peak_load, total_nodes
 
+    def network_parameters(self):
+        """The parameters that determine the distribution_network of a settlement. Technologies with the same
+        parameters have the same distribution networks."""
+        return (self.standalone, self.distribution_losses, self.power_factor, self.lv_line_max_length,
+                self.service_transf_type, self.max_nodes_per_serv_trans, self.load_moment)
+
+    def distribution_networks(self, people, new_connections, total_energy_per_cell, energy_per_cell,
+                              num_people_per_hh, grid_cell_area, base_to_peak_load_ratio, productive_nodes=0):
+        """The distribution_network meeting all of the demand, the one already there and the one meeting the new
+        demand only, as used by td_network_cost"""
+        households = round(people / num_people_per_hh)
+        total = self.distribution_network(households, total_energy_per_cell, grid_cell_area, base_to_peak_load_ratio,
+                                          productive_nodes)
+        existing = self.distribution_network(np.maximum((households - new_connections), 1),
+                                             (total_energy_per_cell - energy_per_cell), grid_cell_area,
+                                             base_to_peak_load_ratio, productive_nodes)
+        new = self.distribution_network(households, energy_per_cell, grid_cell_area, base_to_peak_load_ratio,
+                                        productive_nodes)
+        return total, existing, new
+
     def td_network_cost(self, people, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
                         num_people_per_hh, grid_cell_area, base_to_peak_load_ratio, additional_mv_line_length=0,
-                        additional_transformer=0, productive_nodes=0, elec_loop=0, penalty=1):
+                        additional_transformer=0, productive_nodes=0, elec_loop=0, penalty=1, backend='numpy',
+                        distribution=None):
         """Calculates all the transmission and distribution network components
 
         Parameters
@@ -611,20 +1101,35 @@ class Technology:
             Round of extension in grid extension algorithm
         penalty : float
             Cost penalty factor for T&D network, e.g. https://www.mdpi.com/2071-1050/12/3/777
+        backend : str
+            'numpy', or 'numba' for the fused, parallel td_network_cost_nb kernel, which computes the same in one
+            pass over the settlements
+        distribution : tuple, optional
+            The distribution_networks of the settlements, if already computed for another Technology with the same
+            network_parameters (see get_lcoe_many)
         """
 
+        if backend == 'numba':
+            return self.td_network_cost_numba(people, new_connections, prev_code, total_energy_per_cell,
+                                              energy_per_cell, num_people_per_hh, grid_cell_area,
+                                              base_to_peak_load_ratio, additional_mv_line_length,
+                                              additional_transformer, productive_nodes)
+        elif backend != 'numpy':
+            raise ValueError('Unknown backend {}, use numpy or numba'.format(backend))
+
+        if distribution is None:
+            distribution = self.distribution_networks(people, new_connections, total_energy_per_cell, energy_per_cell,
+                                                      num_people_per_hh, grid_cell_area, base_to_peak_load_ratio,
+                                                      productive_nodes)
+        total, existing, new = distribution
+
         # Start by calculating the distribution network required to meet all of the demand
         cluster_mv_lines_length_total, cluster_lv_lines_length_total, no_of_service_transf_total, \
-            generation_per_year_total, peak_load_total, total_nodes_total = \
-            self.distribution_network(round(people / num_people_per_hh), total_energy_per_cell, grid_cell_area,
-                                      base_to_peak_load_ratio, productive_nodes)
+            generation_per_year_total, peak_load_total, total_nodes_total = total
 
         # Next calculate the network that is already there
         cluster_mv_lines_length_existing, cluster_lv_lines_length_existing, no_of_service_transf_existing, \
-            generation_per_year_existing, peak_load_existing, total_nodes_existing = \
-            self.distribution_network(np.maximum((round(people / num_people_per_hh) - new_connections), 1),
-                                      (total_energy_per_cell - energy_per_cell), grid_cell_area,
-                                      base_to_peak_load_ratio, productive_nodes)
+            generation_per_year_existing, peak_load_existing, total_nodes_existing = existing
 
         # Then calculate the difference between the two
         mv_lines_distribution_length_additional = \
@@ -658,9 +1163,7 @@ class Technology:
 
         # If no distribution network is present, perform the calculations only once
         mv_lines_distribution_length_new, total_lv_lines_length_new, num_transformers_new, generation_per_year_new, \
-            peak_load_new, total_nodes_new = self.distribution_network(round(people / num_people_per_hh),
-                                                                       energy_per_cell, grid_cell_area,
-                                                                       base_to_peak_load_ratio, productive_nodes)
+            peak_load_new, total_nodes_new = new
         # ToDo this can be removed
 
         mv_distribution = np.where(mv_lines_distribution_length_new > 0, True, False)
@@ -729,12 +1232,78 @@ class Technology:
             num_transformers * self.service_transf_cost, total_nodes * self.connection_cost_per_hh
 
 
+    def td_network_cost_per_km(self, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
+                               base_to_peak_load_ratio):
+        """The increase of the T&D investment cost of td_network_cost per km of additional_mv_line_length (without
+        additional transformer). The HV and MV connection lines are the only components that depend on the distance,
+        linearly as long as it is shorter than mv_line_max_length. Only the peak loads of the distribution networks are
+        needed, not the networks themselves."""
+        peak_loads = []
+        for consumption in [total_energy_per_cell, total_energy_per_cell - energy_per_cell, energy_per_cell]:
+            average_load = consumption / (1 - self.distribution_losses) / HOURS_PER_YEAR  # kW
+            peak_loads.append(average_load / base_to_peak_load_ratio)  # kW
+        peak_load_total, peak_load_existing, peak_load_new = peak_loads
+
+        hv_km_total, mv_km_total = self.transmission_network(peak_load_total, 1)[:2]
+        hv_km_existing, mv_km_existing = self.transmission_network(peak_load_existing, 1)[:2]
+        hv_km_new, mv_km_new = self.transmission_network(peak_load_new, 1)[:2]
+
+        hv_km = np.where(prev_code < 3, np.maximum(hv_km_total - hv_km_existing, 0), hv_km_new)
+        mv_km = np.where(prev_code < 3, np.maximum(mv_km_total - mv_km_existing, 0), mv_km_new)
+
+        return hv_km * self.hv_line_cost + mv_km * self.mv_line_cost
+
+    def network_kernel_parameters(self):
+        """The parameters of the T&D network, as passed to the numba kernels (see td_network_cost_nb)"""
+        hv_to_mv_lines = self.hv_line_cost / self.mv_line_cost
+        max_mv_load = self.mv_line_amperage_limit * self.mv_line_type * hv_to_mv_lines
+        mv_line_capacity = (self.service_transf_type / self.mv_line_type) * self.mv_line_type
+        hv_line_capacity = (self.hv_mv_substation_type / self.hv_line_type) * self.hv_line_type
+
+        # All floats, so that the kernels are compiled once for all technologies
+        return tuple(float(parameter) for parameter in
+                     [self.standalone, self.mini_grid, self.distribution_losses, self.power_factor,
+                      self.lv_line_max_length, self.service_transf_type, self.max_nodes_per_serv_trans,
+                      self.load_moment, max_mv_load, mv_line_capacity, hv_line_capacity, self.mv_line_max_length,
+                      self.hv_mv_substation_type, self.hv_line_cost, self.mv_line_cost, self.lv_line_cost,
+                      self.service_transf_cost, self.connection_cost_per_hh, self.hv_mv_sub_station_cost])
+
+    @staticmethod
+    def kernel_arrays(*values, dtype='float64'):
+        """The settlement arguments of the numba kernels: contiguous float64 (or float32) arrays of the same length,
+        also for scalars"""
+        arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=dtype)) for value in values])
+        return [np.ascontiguousarray(array) for array in arrays]
+
+    def td_network_cost_numba(self, people, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
+                              num_people_per_hh, grid_cell_area, base_to_peak_load_ratio, additional_mv_line_length=0,
+                              additional_transformer=0, productive_nodes=0):
+        """td_network_cost computed by the fused td_network_cost_nb kernel. Returns arrays, also for scalar input."""
+        arrays = self.kernel_arrays(people, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
+                                    num_people_per_hh, grid_cell_area, base_to_peak_load_ratio,
+                                    additional_mv_line_length, productive_nodes,
+                                    dtype=float_dtype(people, new_connections, total_energy_per_cell, energy_per_cell))
+        return td_network_cost_nb(*arrays, bool(additional_transformer), self.network_kernel_parameters())
+
 class SettlementProcessor:
     """
     Processes the DataFrame and adds all the columns to determine the cheapest option and the final costs and summaries
+
+    With precision='float32', the float columns of the settlements (except the coordinates) are stored and computed in
+    float32, which halves the memory and memory traffic of the LCOE, demand and lookup table stages. Cumulative sums for
+    the targets and limits are accumulated in float64 (pandas sums are accumulated in float64 anyway). The LCOEs are
+    within about 1e-7 relative of float64 for most settlements. Settlements close to a discrete threshold (rounding of
+    households, number of transformers and lines, capital cost tiers) can get a different network or cost tier, and
+    their LCOE differs by up to a few %, which was the case for less than 0.05% of 1M random settlements.
     """
 
-    def __init__(self, path):
+    precision = 'float64'
+
+    def __init__(self, path, precision='float64'):
+        if precision not in ['float64', 'float32']:
+            raise ValueError('Unknown precision {}, use float64 or float32'.format(precision))
+        self.precision = precision
+
         try:
             self.df = pd.read_csv(path)
         except FileNotFoundError:
@@ -751,6 +1320,153 @@ class SettlementProcessor:
                 print('Column "GHI" not found, check column names in calibrated csv-file')
                 raise
 
+        self.cast_precision()
+
+    def cast_precision(self):
+        """Casts the float64 columns, except the coordinates, to float32 if the precision is float32. Called after
+        loading and after the stages that add float64 columns."""
+        if self.precision == 'float64':
+            return
+        columns = [column for column in self.df.columns if self.df[column].dtype == np.float64 and
+                   column not in [SET_X_DEG, SET_Y_DEG]]
+        if columns:
+            self.df = self.df.astype({column: self.precision for column in columns})
+
+    def chunk_size(self, memory_budget, bytes_per_settlement=None):
+        """Number of settlements to process at once with run_in_chunks to stay within a memory budget
+
+        Arguments
+        ---------
+        memory_budget : int
+            Memory available to one block of settlements, in bytes
+        bytes_per_settlement : int, optional
+            Memory needed per settlement, by default a row of the settlements table (for the columns a stage changes
+            or adds in a block) plus CHUNK_TEMPORARY_BYTES for the temporary arrays of a stage
+        """
+        if bytes_per_settlement is None:
+            bytes_per_settlement = self.df.memory_usage(index=False, deep=True).sum() / max(len(self.df), 1) + \
+                CHUNK_TEMPORARY_BYTES
+        return max(int(memory_budget // bytes_per_settlement), 1)
+
+    @staticmethod
+    def _chunk_argument(value, start, stop):
+        """The part of a per-settlement stage argument that belongs to the settlements start to stop"""
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            return value.iloc[start:stop].reset_index(drop=True)
+        if isinstance(value, Technology):
+            value = copy.copy(value)
+            for attribute in ['hybrid_fuel', 'hybrid_investment', 'hybrid_capacity']:
+                if getattr(value, attribute) is not None:
+                    setattr(value, attribute,
+                            SettlementProcessor._chunk_argument(getattr(value, attribute), start, stop))
+            return value
+        return value[start:stop]
+
+    @staticmethod
+    def _unchanged_column(block_values, values):
+        """Whether a column of a block still holds the values of the settlements table. Columns the stage did not
+        assign to still share their memory with the settlements table (copy-on-write), others are compared."""
+        if block_values.dtype == values.dtype and block_values.ctypes.data == values.ctypes.data and \
+                block_values.strides == values.strides:
+            return True
+        if block_values.dtype.kind == 'f' and values.dtype.kind == 'f':
+            return np.array_equal(block_values, values, equal_nan=True)
+        return pd.Series(block_values).equals(pd.Series(values))
+
+    def run_in_chunks(self, stage, *args, chunk_size=None, per_settlement=(), **kwargs):
+        """Runs a per-settlement stage on blocks of settlements, to limit the memory of its temporary arrays
+
+        Each block is processed with a copy of this SettlementProcessor holding the rows of the block, and the
+        columns the stage adds or changes are written into preallocated arrays of all settlements. The rows of a
+        block share their memory with the settlements table until the stage assigns to a column. The arguments
+        listed in per_settlement are split into the blocks as well. Returned Series and DataFrames are
+        concatenated, arrays are written into preallocated arrays, other values are taken from the first block.
+
+        Only stages in which each settlement is independent of the others give the same results as without blocks,
+        e.g. calculate_demand (if the household demand is already set, or not set, for all settlements),
+        calculate_unmet_demand, diesel_cost_columns, calculate_off_grid_lcoes (with choose_minimum=False, since
+        hydro-power sites are shared) and results_columns. The grid extension is always run for all settlements.
+
+        Arguments
+        ---------
+        stage : str
+            Name of the SettlementProcessor method to run
+        chunk_size : int, optional
+            Number of settlements per block (see chunk_size), by default all settlements at once
+        per_settlement : collection of int and str
+            Positions (in args) and names (in kwargs) of the arguments with one value per settlement: Series,
+            DataFrames or arrays, or a Technology with hybrid values per settlement (hybrid_fuel, hybrid_investment
+            and hybrid_capacity)
+        """
+        n = len(self.df)
+        if chunk_size is None or n <= chunk_size:
+            return getattr(self, stage)(*args, **kwargs)
+
+        columns = {}
+        missing = {}
+        removed = set()
+        results = []
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            block = copy.copy(self)
+            block.df = self.df.iloc[start:stop].reset_index(drop=True)
+            block_columns = block.df.columns
+            result = getattr(block, stage)(*[self._chunk_argument(value, start, stop) if i in per_settlement
+                                             else value for i, value in enumerate(args)],
+                                           **{key: self._chunk_argument(value, start, stop) if key in per_settlement
+                                              else value for key, value in kwargs.items()})
+
+            for column in block.df.columns:
+                values = block.df[column].to_numpy()
+                if column not in columns:
+                    if column in self.df:
+                        if self._unchanged_column(values, self.df[column].to_numpy()[start:stop]):
+                            continue
+                        columns[column] = self.df[column].to_numpy().copy()
+                    else:
+                        columns[column] = np.empty(n, dtype=values.dtype)
+                        missing[column] = [(0, start)] if start > 0 else []
+                dtype = np.result_type(columns[column].dtype, values.dtype)
+                if dtype != columns[column].dtype:
+                    columns[column] = columns[column].astype(dtype)
+                columns[column][start:stop] = values
+            for column in columns:
+                if column in missing and column not in block.df:
+                    missing[column].append((start, stop))
+            removed.update(block_columns.difference(block.df.columns))
+            results.append(result)
+
+        for column, spans in missing.items():
+            if spans:
+                # Settlements of blocks in which the stage did not add the column
+                if columns[column].dtype.kind not in 'fcO':
+                    columns[column] = columns[column].astype(np.result_type(columns[column].dtype, float))
+                for start, stop in spans:
+                    columns[column][start:stop] = np.nan
+        self.df = self.df.drop(columns=[column for column in removed if column not in columns])
+        for column, values in columns.items():
+            self.df[column] = values
+
+        if isinstance(results[0], tuple):
+            return tuple(self._combine_chunks([result[i] for result in results], n)
+                         for i in range(len(results[0])))
+        return self._combine_chunks(results, n)
+
+    @staticmethod
+    def _combine_chunks(values, n):
+        """Combines the values a stage returned for each block of settlements"""
+        if isinstance(values[0], (pd.Series, pd.DataFrame)):
+            return pd.concat(values, ignore_index=True)
+        if isinstance(values[0], np.ndarray) and values[0].ndim > 0:
+            combined = np.empty((n,) + values[0].shape[1:],
+                                dtype=np.result_type(*[value.dtype for value in values]))
+            start = 0
+            for value in values:
+                combined[start:start + len(value)] = value
+                start += len(value)
+            return combined
+        return values[0]
+
     @staticmethod
     def _diesel_fuel_cost_calculator(diesel_price: float,
                                      diesel_truck_consumption: float,
@@ -832,6 +1548,7 @@ class SettlementProcessor:
                                                sa_diesel_cost, mg_diesel_cost, year)
 
         self.df = self.df.join(diesel_cost)
+        self.cast_precision()
 
     def conditioning(self):
 
@@ -1096,7 +1813,7 @@ class SettlementProcessor:
         # The calibration build into the model only classifies into urban/rural
 
         self.df.sort_values(by=[SET_POP_CALIB], inplace=True, ascending=False)
-        cumulative_urban_pop = self.df[SET_POP_CALIB].cumsum()
+        cumulative_urban_pop = self.df[SET_POP_CALIB].astype('float64').cumsum()
         self.df[SET_URBAN] = np.where(cumulative_urban_pop < (urban_current * self.df[SET_POP_CALIB].sum()), 2, 0)
         self.df.sort_index(inplace=True)
 
@@ -1463,13 +2180,12 @@ class SettlementProcessor:
         # Calculate max extension for each settlement to be connected to the grid at
         # a lower cost than least-cost off-grid alternative
 
-        filter_lcoe, filter_investment, filter_capacity, peak_load = \
+        # The LCOE without extension, and its increase per km of extension
+        filter_lcoe, filter_investment, filter_capacity, peak_load, lcoe_per_km, investment_per_km = \
             self.get_grid_lcoe(0, 0, 0, year, time_step, end_year, grid_calc, sa_diesel_calc,
-                               grid_reliability_option, get_max_dist=True)
-
-        filter_lcoe_1, filter_investment_1, filter_capacity_1, peak_load_1 = \
-            self.get_grid_lcoe(1, 0, 0, year, time_step, end_year, grid_calc, sa_diesel_calc,
-                               grid_reliability_option, get_max_dist=True)
+                               grid_reliability_option, get_max_dist=True, extension_slope=True)
+        filter_lcoe_1 = filter_lcoe + lcoe_per_km
+        filter_investment_1 = filter_investment + investment_per_km
 
         self.df['NoExtensionInvestment{}'.format(year)] = filter_investment[0]
         self.df['FilterLCOE' + "{}".format(year)] = filter_lcoe[0]
@@ -1481,11 +2197,6 @@ class SettlementProcessor:
 
         years = np.arange(project_life)
         step = (year - time_step) - start_year
-        generation_per_year = self.df[SET_ENERGY_PER_CELL + '{}'.format(year)]
-
-        el_gen = np.outer(np.asarray(generation_per_year), np.ones(project_life))
-        for s in range(step):
-            el_gen[:, s] = 0
 
         discount_factor = (1 + grid_calc.discount_rate) ** years
 
@@ -1515,7 +2226,7 @@ class SettlementProcessor:
 
         cost_per_km -= salvage
 
-        marginal_lcoe = filter_lcoe_1[0] - filter_lcoe[0]
+        marginal_lcoe = lcoe_per_km[0]
 
         self.df['MaxDist' + '{}'.format(year)] = (self.df['Minimum_LCOE_Off_grid{}'.format(year)] - filter_lcoe[0]) / marginal_lcoe
 
@@ -1843,7 +2554,7 @@ class SettlementProcessor:
             x_coordinates, y_coordinates, feature_collection
 
     def get_grid_lcoe(self, dist_adjusted, elecorder, additional_transformer, year, time_step, end_year, grid_calc,
-                      sa_diesel_calc, grid_reliability_option, get_max_dist=False):
+                      sa_diesel_calc, grid_reliability_option, get_max_dist=False, extension_slope=False):
         grid = \
             grid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
                                start_year=year - time_step,
@@ -1863,11 +2574,12 @@ class SettlementProcessor:
                                fuel_cost_settlement=self.df[SET_MG_DIESEL_FUEL + "{}".format(year)],
                                sa_diesel_calc=sa_diesel_calc,
                                grid_reliability_option=grid_reliability_option,
-                               base_to_peak_load_ratio=self.df[SET_AVERAGE_TO_PEAK]
+                               base_to_peak_load_ratio=self.df[SET_AVERAGE_TO_PEAK],
+                               extension_slope=extension_slope
                                )
 
         if get_max_dist:
-            return grid[0], grid[1], grid[2], grid[3]
+            return grid
         else:
             return grid[0], grid[1], grid[2]
 
@@ -1938,11 +2650,11 @@ class SettlementProcessor:
         average_load = consumption / (1 - grid_calc.distribution_losses) / HOURS_PER_YEAR  # kW
         peak_load = average_load / base_to_peak_load_ratio  # kW
         peak_load.loc[grid_lcoe >= min_code_lcoes] = 0
-        peak_load_cum_sum = np.cumsum(peak_load)
+        peak_load_cum_sum = np.cumsum(peak_load.astype('float64'))
         grid_lcoe.loc[peak_load_cum_sum > grid_capacity_limit] = 99
         new_grid_connections = self.df[SET_NEW_CONNECTIONS + "{}".format(year)].copy()
         new_grid_connections.loc[grid_lcoe >= min_code_lcoes] = 0
-        new_grid_connections_cum_sum = np.cumsum(new_grid_connections)
+        new_grid_connections_cum_sum = np.cumsum(new_grid_connections.astype('float64'))
         grid_lcoe.loc[new_grid_connections_cum_sum > grid_connect_limit] = 99
 
         # Update limiting values
@@ -2122,6 +2834,7 @@ class SettlementProcessor:
         self.set_residential_demand(urban_tier, rural_tier_large, rural_tier_small, rural_cutoff,
                                tiers, year)
         self.calculate_total_demand_per_settlement(year, time_step)
+        self.cast_precision()
 
     def calculate_unmet_demand(self, year, reliability=1):
         if SET_GRID_RELIABILITY in self.df:
@@ -2133,7 +2846,33 @@ class SettlementProcessor:
 
     @staticmethod
     def optimize_mini_grid(ghi_curve, temp, energy, tier, diesel_price, start_year, end_year,
-                           year, time_step, mg_pv_hybrid_specs):
+                           year, time_step, mg_pv_hybrid_specs, vectorized=True, seed=None, warm_start=None,
+                           full_output=False, optimizer='differential_evolution', max_evaluations=300, hours=None):
+        """Finds the least-cost PV-hybrid mini-grid configuration for one load and resource profile
+
+        Arguments
+        ---------
+        vectorized : bool
+            If True, each generation of the differential evolution is evaluated in one call to the parallel
+            find_least_cost_option_batch kernel, otherwise each candidate is evaluated separately
+        seed : int, optional
+            Seed for the differential evolution, makes the result reproducible
+        warm_start : array-like, optional
+            A known good (PV, battery, diesel) configuration, e.g. the optimum for a similar GHI and diesel cost. The
+            differential evolution then uses a smaller population (WARM_START_POPSIZE), of which WARM_START_NEAR
+            members are placed around the warm start, and a tighter tolerance (WARM_START_TOL).
+        full_output : bool
+            If True, the optimal configuration and the number of evaluations are returned as well
+        optimizer : str
+            'differential_evolution' (scipy), 'numba_de' for the differential evolution compiled as a whole
+            (differential_evolution_nb), or 'grid' for a fast, lower fidelity coarse grid search followed by a bounded
+            Nelder-Mead refinement (grid_refine_minimize)
+        max_evaluations : int
+            Evaluation budget of the 'grid' optimizer
+        hours : tuple, optional
+            The (hour_numbers, hour_weights) to simulate, e.g. of representative days (see representative_hours). By
+            default every hour of the year is simulated once. The returned results are those of the same hours.
+        """
 
         load_curve = calc_load_curve(tier, energy)
 
@@ -2181,36 +2920,111 @@ class SettlementProcessor:
             hour_numbers = np.empty(8760)
             for i in prange(8760):
                 hour_numbers[i] = i
+            hour_weights = np.ones(8760)
+            final_weights = None  # The final evaluation of the optimum uses the unweighted kernel for a full year
+            if hours is not None:
+                hour_numbers, hour_weights = hours
+                final_weights = hour_weights
+
+            # Number of configurations simulated, the nfev of a vectorized differential evolution counts generations
+            evaluations = [0]
 
             def opt_func(X):
-                lcoe = find_least_cost_option(X, hourly_temp, hourly_ghi, hour_numbers,
-                                              load_curve, inv_eff, n_dis, n_chg, dod_max,
-                                              diesel_price, end_year, start_year, pv_cost, charge_controller,
-                                              pv_inverter, inv_eff, pv_om,
-                                              diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
-                                              diesel_life, pv_life,
-                                              battery_cost, discount_rate, lpsp_max, diesel_limit,
-                                              full_life_cycles)[0]
+                evaluations[0] += 1
+                lcoe, hours_simulated = \
+                    find_least_cost_option_bounded(X, hourly_temp, hourly_ghi, hour_numbers, hour_weights,
+                                                   load_curve, inv_eff, n_dis, n_chg, dod_max,
+                                                   diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                                   pv_inverter, inv_eff, pv_om,
+                                                   diesel_cost, diesel_om, battery_inverter_life,
+                                                   battery_inverter_cost, diesel_life, pv_life,
+                                                   battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                                   full_life_cycles)
+                record_simulation_hours(hours_simulated, len(hour_numbers))
+
+                return lcoe
+
+            def opt_func_batch(X):
+                # X has shape (3, population size), the whole population is simulated in one parallel call
+                evaluations[0] += X.shape[1]
+                lcoe, hours_simulated = \
+                    find_least_cost_option_batch(np.ascontiguousarray(X, dtype=np.float64), hourly_temp, hourly_ghi,
+                                                 hour_numbers, hour_weights, load_curve, inv_eff, n_dis, n_chg,
+                                                 dod_max, diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                                 pv_inverter, inv_eff, pv_om,
+                                                 diesel_cost, diesel_om, battery_inverter_life,
+                                                 battery_inverter_cost, diesel_life, pv_life,
+                                                 battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                                 full_life_cycles)
+                record_simulation_hours(hours_simulated.sum(), X.shape[1] * len(hour_numbers))
 
                 return lcoe
 
-            ret = differential_evolution(opt_func, bounds, popsize=15,
-                                         init='latinhypercube')  # init='halton' on newer env
+            if optimizer == 'grid':
+                x, lcoe, nfev = grid_refine_minimize(opt_func, opt_func_batch, min_bounds, max_bounds,
+                                                     max_evaluations=max_evaluations)
+                result = find_least_cost_option_metrics(x, hourly_temp, hourly_ghi, hour_numbers,
+                                                        load_curve, inv_eff, n_dis, n_chg, dod_max,
+                                                        diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                                        pv_inverter, inv_eff, pv_om,
+                                                        diesel_cost, diesel_om, battery_inverter_life,
+                                                        battery_inverter_cost, diesel_life, pv_life,
+                                                        battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                                        full_life_cycles, hour_weights=final_weights)
+                return result, list(x), nfev
+            elif optimizer == 'numba_de':
+                x, lcoe, nfev, hours_simulated = \
+                    differential_evolution_nb(min_bounds.astype(np.float64), max_bounds.astype(np.float64), 15, 1000,
+                                              0.01, -1 if seed is None else seed,
+                                              hourly_temp, hourly_ghi, hour_numbers, hour_weights,
+                                              load_curve, inv_eff, n_dis, n_chg, dod_max,
+                                              diesel_price, end_year, start_year, pv_cost,
+                                              charge_controller, pv_inverter, inv_eff, pv_om,
+                                              diesel_cost, diesel_om, battery_inverter_life,
+                                              battery_inverter_cost, diesel_life, pv_life,
+                                              battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                              full_life_cycles)
+                record_simulation_hours(hours_simulated, nfev * len(hour_numbers))
+                result = find_least_cost_option_metrics(x, hourly_temp, hourly_ghi, hour_numbers,
+                                                        load_curve, inv_eff, n_dis, n_chg, dod_max,
+                                                        diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                                        pv_inverter, inv_eff, pv_om,
+                                                        diesel_cost, diesel_om, battery_inverter_life,
+                                                        battery_inverter_cost, diesel_life, pv_life,
+                                                        battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                                        full_life_cycles, hour_weights=final_weights)
+                return result, list(x), nfev
+            elif optimizer != 'differential_evolution':
+                raise ValueError('Unknown optimizer {}'.format(optimizer))
+
+            init, popsize, tol = 'latinhypercube', 15, 0.01
+            if warm_start is not None:
+                # A smaller population, part of it around the warm start, which converges in fewer evaluations
+                popsize, tol = WARM_START_POPSIZE, WARM_START_TOL
+                init = warm_start_population(warm_start, min_bounds, max_bounds, popsize * len(min_bounds),
+                                             near=WARM_START_NEAR, seed=seed)
+
+            if vectorized:
+                ret = differential_evolution(opt_func_batch, bounds, popsize=popsize, tol=tol, seed=seed,
+                                             init=init, vectorized=True, updating='deferred')
+            else:
+                ret = differential_evolution(opt_func, bounds, popsize=popsize, tol=tol, seed=seed,
+                                             init=init)  # init='halton' on newer env
 
             X = [ret.x[0], ret.x[1], ret.x[2]]
 
-            result = find_least_cost_option(X, hourly_temp, hourly_ghi, hour_numbers,
-                                            load_curve, inv_eff, n_dis, n_chg, dod_max,
-                                            diesel_price, end_year, start_year, pv_cost, charge_controller,
-                                            pv_inverter, inv_eff, pv_om,
-                                            diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
-                                            diesel_life, pv_life,
-                                            battery_cost, discount_rate, lpsp_max, diesel_limit,
-                                            full_life_cycles)
+            result = find_least_cost_option_metrics(np.array(X), hourly_temp, hourly_ghi, hour_numbers,
+                                                    load_curve, inv_eff, n_dis, n_chg, dod_max,
+                                                    diesel_price, end_year, start_year, pv_cost, charge_controller,
+                                                    pv_inverter, inv_eff, pv_om,
+                                                    diesel_cost, diesel_om, battery_inverter_life,
+                                                    battery_inverter_cost, diesel_life, pv_life,
+                                                    battery_cost, discount_rate, lpsp_max, diesel_limit,
+                                                    full_life_cycles, hour_weights=final_weights)
 
-            return result
+            return result, X, evaluations[0]
 
-        result = optimizer_de(diesel_price=diesel_price,
+        result, X, nfev = optimizer_de(diesel_price=diesel_price,
                               hourly_ghi=ghi_curve,
                               hourly_temp=temp,
                               load_curve=load_curve,
@@ -2218,9 +3032,15 @@ class SettlementProcessor:
                               end_year=end_year,
                               )
 
+        if full_output:
+            return result[0], result[3], result[8] + result[9], result[4], np.array(X), nfev
         return result[0], result[3], result[8] + result[9], result[4]
 
-    def pv_hybrids_lcoe(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_folder_path=r'../test_data'):
+    def pv_hybrids_lcoe(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_folder_path=r'../test_data',
+                        workers=None, seed=None, optimizer='differential_evolution'):
+        """Optimizes the PV-hybrid mini-grid of each potential mini-grid settlement. Settlements with identical GHI,
+        diesel cost, tier and demand share one optimization, and the unique optimizations are spread over workers
+        processes (see solve_table_cells)."""
         #logging.info('Starting hybrid gen lcoe')
         print(time.ctime(), 'Starting PV-hybrid LCOE calculation for year {}'.format(year))
 
@@ -2235,20 +3055,36 @@ class SettlementProcessor:
                                           (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 2)) |
                                           (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
 
-        gen_lcoe, inv, cap, fuel_cost = zip(
-            *self.df.apply(lambda row: self.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / row[SET_GHI]),
-                                                               temp,
-                                                               row[SET_ENERGY_PER_CELL + '{}'.format(year)],
-                                                               row[SET_TIER],
-                                                               row[SET_MG_DIESEL_FUEL + '{}'.format(year)],
-                                                               year - time_step,
-                                                               end_year,
-                                                               year,
-                                                               time_step,
-                                                               mg_pv_hybrid_specs)
-            if row['PotentialMG'] == 1
-            else [99, 0, 0, 0],
-                           axis=1))
+        potential_mg = self.df['PotentialMG'].values == 1
+        problems = pd.DataFrame({'ghi': self.df[SET_GHI].values[potential_mg],
+                                 'diesel': self.df[SET_MG_DIESEL_FUEL + '{}'.format(year)].values[potential_mg],
+                                 'tier': self.df[SET_TIER].values[potential_mg],
+                                 'energy': self.df[SET_ENERGY_PER_CELL + '{}'.format(year)].values[potential_mg]})
+        unique_problems = problems.drop_duplicates()
+        problem_index = problems.merge(unique_problems.reset_index(drop=True).reset_index(), how='left',
+                                       on=['ghi', 'diesel', 'tier', 'energy'])['index'].values
+
+        print(time.ctime(), '{} potential mini-grid settlements, {} unique PV-hybrid optimizations'.format(
+            len(problems), len(unique_problems)))
+
+        # Each problem is numbered, its seed is derived from the number since the inputs may be NaN
+        results = solve_table_cells(SettlementProcessor.solve_pv_settlement,
+                                    [(number,) + problem for number, problem in
+                                     enumerate(unique_problems.itertuples(index=False, name=None))],
+                                    {'ghi': ghi_curve[:, 0], 'temp': temp[:, 0]},
+                                    (year, time_step, end_year, mg_pv_hybrid_specs, seed, optimizer),
+                                    workers=workers, description='PV-hybrid settlements')
+
+        gen_lcoe = np.full(len(self.df), 99.)
+        inv = np.zeros(len(self.df))
+        cap = np.zeros(len(self.df))
+        fuel_cost = np.zeros(len(self.df))
+        if len(results) > 0:
+            results = np.array(results, dtype='float64')[problem_index]
+            gen_lcoe[potential_mg] = results[:, 0]
+            inv[potential_mg] = results[:, 1]
+            cap[potential_mg] = results[:, 2]
+            fuel_cost[potential_mg] = results[:, 3]
 
         del self.df['PotentialMG']
 
@@ -2263,88 +3099,381 @@ class SettlementProcessor:
 
         return hybrid_lcoe, hybrid_capacity, hybrid_investment
 
-    def pv_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_path=r'../test_data'):
+    @staticmethod
+    def solve_pv_settlement(problem, profiles, year, time_step, end_year, mg_pv_hybrid_specs, seed,
+                            optimizer='differential_evolution'):
+        """Optimizes the PV-hybrid mini-grid for one (number, GHI, diesel cost, tier, energy) settlement problem.
+        Returns the LCOE, investment, capacity and fuel cost."""
+        number, ghi, diesel_price, tier, energy = problem
+        ghi_curve = profiles['ghi']
+
+        return SettlementProcessor.optimize_mini_grid(ghi_curve * ghi * 1000 / ghi_curve.sum(),
+                                                      profiles['temp'],
+                                                      energy,
+                                                      tier,
+                                                      diesel_price,
+                                                      year - time_step,
+                                                      end_year,
+                                                      year,
+                                                      time_step,
+                                                      mg_pv_hybrid_specs,
+                                                      seed=table_cell_seed(seed, (number,)),
+                                                      optimizer=optimizer)
+
+    @staticmethod
+    def solve_pv_table_cell(cell, profiles, tiers, ghi_range, diesel_range, year, time_step, end_year,
+                            mg_pv_hybrid_specs, seed, optimizer='differential_evolution'):
+        """Optimizes the PV-hybrid mini-grid for one (tier, GHI, diesel cost) cell of the lookup table. Returns the
+        LCOE, investment, capacity, fuel cost, the optimal configuration and the number of configurations evaluated.
+        If profiles include 'hour_numbers' and
+        'hour_weights', only those (representative) hours are simulated."""
+        ti, gi, di = cell
+        ghi_curve = profiles['ghi']
+        g = ghi_range[gi]
+        hours = (profiles['hour_numbers'], profiles['hour_weights']) if 'hour_numbers' in profiles else None
+
+        return SettlementProcessor.optimize_mini_grid(ghi_curve * g * 1000 / ghi_curve.sum(), #((ghi_curve.sum() / 1000) / g),
+                                                      profiles['temp'],
+                                                      10000,
+                                                      tiers[ti],
+                                                      diesel_range[di],
+                                                      year - time_step,
+                                                      end_year,
+                                                      year,
+                                                      time_step,
+                                                      mg_pv_hybrid_specs,
+                                                      seed=table_cell_seed(seed, cell),
+                                                      full_output=True,
+                                                      optimizer=optimizer,
+                                                      hours=hours)
+
+    @staticmethod
+    def solve_pv_table_chain(chain, profiles, tiers, ghi_range, diesel_range, year, time_step, end_year,
+                             mg_pv_hybrid_specs, seed, optimizer='differential_evolution'):
+        """Optimizes a chain of neighbouring lookup table cells in order, each one warm-started from the optimum of
+        the previous one"""
+        ghi_curve = profiles['ghi']
+        hours = (profiles['hour_numbers'], profiles['hour_weights']) if 'hour_numbers' in profiles else None
+        results = []
+        optimum = None
+        for cell in chain:
+            ti, gi, di = cell
+            gen_lcoe, inv, cap, fuel_cost, optimum, nfev = \
+                SettlementProcessor.optimize_mini_grid(ghi_curve * ghi_range[gi] * 1000 / ghi_curve.sum(),
+                                                       profiles['temp'],
+                                                       10000,
+                                                       tiers[ti],
+                                                       diesel_range[di],
+                                                       year - time_step,
+                                                       end_year,
+                                                       year,
+                                                       time_step,
+                                                       mg_pv_hybrid_specs,
+                                                       seed=table_cell_seed(seed, cell),
+                                                       warm_start=optimum,
+                                                       full_output=True,
+                                                       optimizer=optimizer,
+                                                       hours=hours)
+            results.append((gen_lcoe, inv, cap, fuel_cost, optimum, nfev))
+
+        return results
+
+    def pv_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_path=r'../test_data',
+                                    cache_dir=None, seed=None, workers=None, ghi_step=100, diesel_step=0.1,
+                                    lazy=False, warm_start=False, warm_start_check=0,
+                                    optimizer='differential_evolution', recost=False, representative_days=None,
+                                    chunk_size=None):
+        """Calculates the PV-hybrid mini-grid LCOE from a lookup table of optimized configurations for each tier,
+        GHI and diesel cost. The values of each settlement are interpolated bilinearly between the table points.
+
+        Arguments
+        ---------
+        pv_path : str
+            The csv-file with the hourly GHI and temperature profile used for all settlements, or a folder of
+            per-location profiles as written by get_pv_data. In that case each settlement uses the profile closest to
+            it, and the table gets a leading profile axis (one table for each profile, see build_pv_hybrid_table).
+        ghi_step : float
+            Spacing of the GHI axis of the table (kWh/m2/year)
+        diesel_step : float
+            Spacing of the diesel cost axis of the table (USD/liter)
+        cache_dir : str, optional
+            If given, the lookup table is cached in this folder, keyed by a hash of all inputs it depends on (resource
+            profile, mg_pv_hybrid_specs, table axes, start/end years and optimizer settings). If a table with the same
+            key is found, it is loaded instead of optimized again. The parsed resource profiles are stored in this
+            folder too, instead of next to the csv-files (see load_resource_profiles). Tables of the differential
+            evolution optimizers are only cached with a seed, as unseeded tables are not reproducible.
+        seed : int, optional
+            Seed for the optimizer, makes the table reproducible. Each cell gets its own seed derived from this one,
+            so the table is the same whether it is built serially or in parallel. Needed to cache the tables of the
+            differential evolution optimizers.
+        workers : int, optional
+            Number of processes to build the table with, by default it is built in this process
+        lazy : bool
+            If True, only the table cells needed to interpolate the potential mini-grid settlements are solved, the
+            others are left as NaN. A cached table is completed with the cells it is missing.
+        warm_start : bool
+            If True, the cells of each tier are solved as one chain, sweeping back and forth over the diesel axis for
+            each GHI value, and each optimization is warm-started from the optimum of the previous cell, with a
+            smaller population (see optimize_mini_grid). This takes about half the evaluations of a cold start. The
+            chains (one per tier) are spread over the workers.
+        warm_start_check : int
+            Number of warm-started cells to optimize again from a cold start, to report the difference in LCOE and in
+            the number of configurations evaluated
+        optimizer : str
+            Optimizer of the mini-grid configurations, 'differential_evolution', 'numba_de' or the faster, lower
+            fidelity 'grid' (see optimize_mini_grid). The warm start only applies to 'differential_evolution'.
+        recost : bool
+            Requires cache_dir, and a seed unless the optimizer is 'grid'. If True, the dispatch results (diesel and unmet demand shares, battery life, fuel use)
+            of the optimized configurations are stored in cache_dir, keyed only by the inputs they depend on and the
+            optimizer settings (see dispatch_store_key), which takes one more simulation per solved cell. Cells found
+            in this store are not optimized again, but the stored configurations are costed with the current cost
+            assumptions and years. This is fast for cost sensitivity runs, but the configurations are not
+            re-optimized for the new costs. With representative_days, the stored dispatch results are those of the
+            representative days, as the optimization, in a store of their own.
+        representative_days : int, optional
+            Screening mode. The days of the year are clustered on their GHI and temperature profiles (see
+            cluster_representative_days), and the configurations are optimized and costed simulating only this
+            number of weighted representative days, carrying the battery state of charge from one day to the next.
+            The LCOE, LPSP and diesel share of the optimal configurations are compared to a full-year simulation, and
+            the differences are reported.
+        chunk_size : int, optional
+            Number of settlements interpolated at once (see chunk_size and interpolate_hybrid_table), by default all
+        """
+        if recost and cache_dir is None:
+            raise ValueError('recost needs the dispatch results stored in a cache_dir')
+        if recost and seed is None and optimizer != 'grid':
+            raise ValueError('recost needs a seed, unseeded differential evolution tables are not cached')
+
         logging.info('Starting hybrid gen lcoe')
         # lats = sorted(self.df['Y_deg'].round().unique())
         # longs = sorted(self.df['X_deg'].round().unique())
 
         self.df['PVHybridGenLCOE' + "{}".format(year)] = 0.
 
-        ghi_curve, temp = read_environmental_data(pv_path)
-        ghi_curve = ghi_curve[:, 0]
-        temp = temp[:, 0]
-
-        ghi_min = round(min(self.df[SET_GHI]), -2)
-        ghi_max = round(max(self.df[SET_GHI]), -2)
-        diesel_min = round(min(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]), 1)
-        diesel_max = round(max(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]), 1)
-        ghi_range = np.round(np.arange(ghi_min, ghi_max + 100, 100), -2)
-        diesel_range = np.round(np.arange(diesel_min, diesel_max + 0.1, 0.1), 1)
-
-        tiers = [1, 2, 3, 4, 5]
-
-        pv_hybrids_lcoe = {}
-        pv_hybrid_investment = {}
-        pv_hybrid_capacity = {}
-        pv_hybrid_fuel_cost = {}
-
-        for t in tiers:
-            for g in ghi_range:
-                for d in diesel_range:
-                    gen_lcoe, inv, cap, fuel_cost = \
-                        self.optimize_mini_grid(ghi_curve * g * 1000 / ghi_curve.sum(), #((ghi_curve.sum() / 1000) / g),
-                                                temp,
-                                                10000,
-                                                t,
-                                                d,
-                                                year - time_step,
-                                                end_year,
-                                                year,
-                                                time_step,
-                                                mg_pv_hybrid_specs)
-
-                    pv_hybrids_lcoe[t, g, d] = gen_lcoe
-                    pv_hybrid_investment[t, g, d] = inv
-                    pv_hybrid_capacity[t, g, d] = cap
-                    pv_hybrid_fuel_cost[t, g, d] = fuel_cost
-
-        def local_hybrid(ghi, diesel, tier, energy):
-            ghi = round(ghi, -2)
-            diesel = round(diesel, 1)
-
-            hybrid_lcoe = pv_hybrids_lcoe[tier, ghi, diesel]
-            hybrid_investment = pv_hybrid_investment[tier, ghi, diesel] #* (energy / 10000)
-            hybrid_capacity = pv_hybrid_capacity[tier, ghi, diesel] #* (energy / 10000)
-            hybrid_fuel_cost = pv_hybrid_fuel_cost[tier, ghi, diesel] #* (energy / 10000)
-
-            return hybrid_lcoe, hybrid_investment, hybrid_capacity, hybrid_fuel_cost
-
-        self.df['PotentialMG'] = np.where(
-            ((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_connections'])
-             & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
-             (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) |
-            (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
-
-        hybrid_series = self.df.apply(
-            lambda row: local_hybrid(row[SET_GHI], row[SET_MG_DIESEL_FUEL + "{}".format(year)],
-                                     row[SET_TIER], row[SET_ENERGY_PER_CELL + "{}".format(year)])
-            if row['PotentialMG'] == 1
-            else [99, 0, 0, 0],
-            axis=1,
-            result_type='expand')
-
-        del self.df['PotentialMG']
-
-        hybrid_lcoe = pd.Series(hybrid_series[0])
-        hybrid_capacity = pd.Series(hybrid_series[2] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
-        hybrid_investment = pd.Series(hybrid_series[1] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
-        fuel_cost = pd.Series(hybrid_series[3] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        ghi_range = hybrid_table_axis(self.df[SET_GHI], ghi_step)
+        diesel_range = hybrid_table_axis(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)], diesel_step)
+
+        tiers = np.array([1, 2, 3, 4, 5])
+
+        potential_mg = (((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_connections'])
+                         & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
+                         (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) |
+                        (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5)).values
+        settlement_tier = self.df[SET_TIER].values[potential_mg]
+        settlement_ghi = self.df[SET_GHI].values[potential_mg]
+        settlement_diesel = self.df[SET_MG_DIESEL_FUEL + "{}".format(year)].values[potential_mg]
+
+        table_args = (tiers, ghi_range, diesel_range, year, time_step, end_year, mg_pv_hybrid_specs, cache_dir, seed,
+                      workers, lazy, warm_start, warm_start_check, optimizer, recost, representative_days)
+
+        if os.path.isdir(pv_path):
+            index = resource_profile_index(pv_path)
+            settlement_profile = nearest_profiles(index, self.df[SET_Y_DEG].values[potential_mg],
+                                                  self.df[SET_X_DEG].values[potential_mg])
+            hybrid = {name: np.empty(len(settlement_tier), dtype=self.precision)
+                      for name in ['lcoe', 'investment', 'capacity', 'fuel_cost']}
+            tables = [None] * len(index)
+            for profile in np.unique(settlement_profile):
+                in_profile = settlement_profile == profile
+                print(time.ctime(), 'PV-hybrid lookup table for profile {} of {} ({}), {} settlements'
+                      .format(profile + 1, len(index), os.path.basename(index['path'][profile]), in_profile.sum()))
+                ghi_curve, temp = load_pv_profile(index['path'][profile], cache_dir)
+                tables[profile] = self.build_pv_hybrid_table(ghi_curve, temp, settlement_tier[in_profile],
+                                                             settlement_ghi[in_profile],
+                                                             settlement_diesel[in_profile], *table_args)
+                profile_hybrid = interpolate_hybrid_table(tables[profile], 'ghi', settlement_tier[in_profile],
+                                                          settlement_ghi[in_profile], settlement_diesel[in_profile],
+                                                          chunk_size=chunk_size, dtype=self.precision)
+                for name in hybrid:
+                    hybrid[name][in_profile] = profile_hybrid[name]
+            table = stack_profile_tables(tables, index, tiers, ghi_range, diesel_range)
+        else:
+            ghi_curve, temp = read_environmental_data(pv_path, cache_dir=cache_dir)
+            table = self.build_pv_hybrid_table(ghi_curve[:, 0], temp[:, 0], settlement_tier, settlement_ghi,
+                                               settlement_diesel, *table_args)
+            hybrid = interpolate_hybrid_table(table, 'ghi', settlement_tier, settlement_ghi, settlement_diesel,
+                                              chunk_size=chunk_size, dtype=self.precision)
+
+        # Settlements that can not get a mini-grid keep LCOE 99 and no investment, capacity or fuel cost
+        hybrid_series = {'lcoe': np.full(len(self.df), 99., dtype=self.precision),
+                         'investment': np.zeros(len(self.df), dtype=self.precision),
+                         'capacity': np.zeros(len(self.df), dtype=self.precision),
+                         'fuel_cost': np.zeros(len(self.df), dtype=self.precision)}
+        for name in hybrid_series:
+            hybrid_series[name][potential_mg] = hybrid[name]
+
+        energy_scale = self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000
+        hybrid_lcoe = pd.Series(hybrid_series['lcoe'], index=self.df.index)
+        hybrid_capacity = pd.Series(hybrid_series['capacity'], index=self.df.index) * energy_scale
+        hybrid_investment = pd.Series(hybrid_series['investment'], index=self.df.index) * energy_scale
+        fuel_cost = pd.Series(hybrid_series['fuel_cost'], index=self.df.index) * energy_scale
         emission_factor = fuel_cost / self.df[
             SET_MG_DIESEL_FUEL + '{}'.format(year)] * 256.9131097 * 9.9445485  # ToDo check emission factor
         self.df['PVHybridEmissionFactor' + "{}".format(year)] = emission_factor
         self.df['PVHybridGenLCOE' + "{}".format(year)] += hybrid_lcoe
 
-        return hybrid_lcoe, hybrid_capacity, hybrid_investment, pv_hybrid_investment
+        return hybrid_lcoe, hybrid_capacity, hybrid_investment, table
+
+    @staticmethod
+    def build_pv_hybrid_table(ghi_curve, temp, settlement_tier, settlement_ghi, settlement_diesel, tiers, ghi_range,
+                              diesel_range, year, time_step, end_year, mg_pv_hybrid_specs, cache_dir=None, seed=None,
+                              workers=None, lazy=False, warm_start=False, warm_start_check=0,
+                              optimizer='differential_evolution', recost=False, representative_days=None):
+        """Builds (or loads from the cache and completes) the PV-hybrid lookup table of one GHI and temperature
+        profile, over the tier, GHI and diesel cost axes. With lazy=True, only the cells needed by the given
+        settlements are solved. See pv_hybrids_lcoe_lookuptable for the other arguments."""
+        table = None
+        # The differential evolution optimizers give another table on every unseeded run, so it is not cached
+        cache_table = cache_dir is not None and (seed is not None or optimizer == 'grid')
+        if cache_dir is not None and not cache_table:
+            print(time.ctime(), 'PV-hybrid lookup table: not cached, the optimizer is not seeded')
+        if cache_table:
+            if optimizer == 'grid':
+                optimizer_config = {'optimizer': 'grid', 'points': 4, 'max_evaluations': 300}
+            elif optimizer == 'numba_de':
+                optimizer_config = {'optimizer': 'numba_de', 'popsize': 15, 'maxiter': 1000, 'tol': 0.01,
+                                    'seed': seed, 'seeding': 'per_cell'}
+            else:
+                optimizer_config = {'optimizer': 'differential_evolution', 'popsize': 15, 'init': 'latinhypercube',
+                                    'seed': seed, 'seeding': 'per_cell'}
+                if warm_start:
+                    optimizer_config['warm_start'] = {'order': 'tier_sweep', 'popsize': WARM_START_POPSIZE,
+                                                      'near': WARM_START_NEAR, 'tol': WARM_START_TOL}
+            if representative_days is not None:
+                optimizer_config['representative_days'] = int(representative_days)
+            if recost:
+                store_key = dispatch_store_key([ghi_curve, temp], mg_pv_hybrid_specs,
+                                               [tiers, ghi_range, diesel_range], optimizer_config)
+                store = load_hybrid_table(cache_dir, store_key)
+                optimizer_config['recost'] = True
+            key = hybrid_table_key([ghi_curve, temp], mg_pv_hybrid_specs, [tiers, ghi_range, diesel_range],
+                                   year - time_step, end_year, optimizer_config)
+            table = load_hybrid_table(cache_dir, key)
+            if table is not None:
+                logging.info('Loaded cached PV-hybrid lookup table {}'.format(key))
+
+
+        shape = (len(tiers), len(ghi_range), len(diesel_range))
+        if table is None:
+            # Cells that are not solved yet are NaN
+            table = {'tier': tiers, 'ghi': ghi_range, 'diesel': diesel_range, 'lcoe': np.full(shape, np.nan),
+                     'investment': np.full(shape, np.nan), 'capacity': np.full(shape, np.nan),
+                     'fuel_cost': np.full(shape, np.nan), 'configuration': np.full(shape + (3,), np.nan)}
+        elif 'configuration' not in table:
+            table['configuration'] = np.full(shape + (3,), np.nan)
+        if recost and store is None:
+            store = {'tier': tiers, 'ghi': ghi_range, 'diesel': diesel_range,
+                     'configuration': np.full(shape + (3,), np.nan), 'dispatch': np.full(shape + (4,), np.nan)}
+
+        if lazy:
+            needed = hybrid_table_cells(table, 'ghi', settlement_tier, settlement_ghi, settlement_diesel)
+        else:
+            needed = list(np.ndindex(table['lcoe'].shape))
+        cells = [cell for cell in needed if np.isnan(table['lcoe'][cell])]
+
+        if recost:
+            recosted = [cell for cell in cells if not np.isnan(store['dispatch'][cell][0])]
+            for cell in recosted:
+                table['lcoe'][cell], table['investment'][cell], table['capacity'][cell], table['fuel_cost'][cell] = \
+                    pv_table_recost(store['configuration'][cell], store['dispatch'][cell], tiers[cell[0]],
+                                    diesel_range[cell[2]], mg_pv_hybrid_specs, year - time_step, end_year)
+                table['configuration'][cell] = store['configuration'][cell]
+            print(time.ctime(), 'PV-hybrid lookup table: {} cells costed from stored dispatch results'
+                  .format(len(recosted)))
+            cells = [cell for cell in cells if np.isnan(table['lcoe'][cell])]
+            if len(recosted) > 0 and len(cells) == 0:
+                save_hybrid_table(cache_dir, key, table)
+
+        print(time.ctime(), 'PV-hybrid lookup table: solving {} of {} cells, {} already solved, {} not needed by any '
+                            'settlement'.format(len(cells), table['lcoe'].size, len(needed) - len(cells),
+                                                table['lcoe'].size - len(needed)))
+
+        if len(cells) > 0:
+            profiles = {'ghi': ghi_curve, 'temp': temp}
+            if representative_days is not None:
+                days, weights = cluster_representative_days([ghi_curve, temp], representative_days)
+                profiles['hour_numbers'], profiles['hour_weights'] = representative_hours(days, weights)
+            args = (tiers, ghi_range, diesel_range, year, time_step, end_year, mg_pv_hybrid_specs, seed, optimizer)
+            if warm_start and optimizer == 'differential_evolution':
+                chains = sweep_chains(cells)
+                chain_results, hours = solve_table_cells(SettlementProcessor.solve_pv_table_chain, chains, profiles,
+                                                         args, workers=workers, full_output=True,
+                                                         description='PV-hybrid lookup table tier chains')
+                cells = [cell for chain in chains for cell in chain]
+                results = [result for chain_result in chain_results for result in chain_result]
+            else:
+                results, hours = solve_table_cells(SettlementProcessor.solve_pv_table_cell, cells, profiles, args,
+                                                   workers=workers, full_output=True,
+                                                   description='PV-hybrid lookup table cells')
+
+            simulated = sum(cell_hours[0] for cell_hours in hours)
+            saved = sum(cell_hours[1] for cell_hours in hours)
+            if simulated > 0:
+                print(time.ctime(), 'PV-hybrid lookup table: {} hours simulated, {} hours ({:.1%}) saved by stopping '
+                                    'infeasible configurations early'.format(simulated, saved,
+                                                                            saved / (simulated + saved)))
+
+            evaluations = {}
+            for cell, (gen_lcoe, inv, cap, fuel_cost, configuration, nfev) in zip(cells, results):
+                evaluations[cell] = nfev
+                table['lcoe'][cell] = gen_lcoe
+                table['investment'][cell] = inv
+                table['capacity'][cell] = cap
+                table['fuel_cost'][cell] = fuel_cost
+                table['configuration'][cell] = configuration
+            print(time.ctime(), 'PV-hybrid lookup table: {} configurations evaluated, {:.0f} per cell'
+                  .format(sum(evaluations.values()), sum(evaluations.values()) / len(cells)))
+
+            if representative_days is not None:
+                accuracy = representative_days_accuracy(
+                    [(table['configuration'][cell], ghi_range[cell[1]], tiers[cell[0]], diesel_range[cell[2]])
+                     for cell in cells], ghi_curve, temp, (profiles['hour_numbers'], profiles['hour_weights']),
+                    mg_pv_hybrid_specs, year - time_step, end_year)
+                feasible = (accuracy['lcoe_full'] < 99) & (accuracy['lcoe_representative'] < 99)
+                lcoe_error = (accuracy['lcoe_representative'] / accuracy['lcoe_full'] - 1)[feasible].abs()
+                lpsp_error = (accuracy['lpsp_representative'] - accuracy['lpsp_full']).abs()
+                diesel_error = (accuracy['diesel_share_representative'] - accuracy['diesel_share_full']).abs()
+                infeasible = ((accuracy['lcoe_full'] >= 99) & (accuracy['lcoe_representative'] < 99)).sum()
+                print(time.ctime(), 'PV-hybrid lookup table on {} representative days, compared to the full year on {} '
+                                    'cells: LCOE differs by {:.2%} on average (max {:.2%}), LPSP by {:.4f} and the '
+                                    'diesel share by {:.4f} on average, {} cells are infeasible over the full year'
+                      .format(representative_days, len(accuracy), lcoe_error.mean(), lcoe_error.max(),
+                              lpsp_error.mean(), diesel_error.mean(), infeasible))
+
+            if warm_start and optimizer == 'differential_evolution' and warm_start_check > 0:
+                sample = [cells[i] for i in np.unique(np.linspace(0, len(cells) - 1, warm_start_check).astype(int))]
+                cold = solve_table_cells(SettlementProcessor.solve_pv_table_cell, sample, profiles, args,
+                                         workers=workers, description='PV-hybrid cold start check cells')
+                warm_lcoe = np.array([table['lcoe'][cell] for cell in sample])
+                cold_lcoe = np.array([result[0] for result in cold])
+                warm_evaluations = sum(evaluations[cell] for cell in sample)
+                cold_evaluations = sum(result[5] for result in cold)
+                print(time.ctime(), 'PV-hybrid warm start check on {} cells: {:.0f} configurations evaluated per cell '
+                                    'warm-started, {:.0f} from a cold start'
+                      .format(len(sample), warm_evaluations / len(sample), cold_evaluations / len(sample)))
+                feasible = (warm_lcoe < 99) & (cold_lcoe < 99)
+                difference = (warm_lcoe[feasible] - cold_lcoe[feasible]) / cold_lcoe[feasible]
+                if feasible.any():
+                    print(time.ctime(), 'PV-hybrid warm start check on {} cells: LCOE differs from a cold start by '
+                                        '{:.2%} on average (min {:.2%}, max {:.2%})'
+                          .format(len(difference), difference.mean(), difference.min(), difference.max()))
+
+            if cache_table:
+                save_hybrid_table(cache_dir, key, table)
+
+            if recost:
+                # One simulation per cell, to store the dispatch results of the optimal configurations over the same
+                # hours they were optimized on, the representative days if any (the store is keyed on them)
+                dispatch_hours = (profiles['hour_numbers'], profiles['hour_weights']) \
+                    if 'hour_numbers' in profiles else None
+                for cell in cells:
+                    store['configuration'][cell] = table['configuration'][cell]
+                    store['dispatch'][cell] = pv_table_dispatch(table['configuration'][cell], ghi_curve, temp,
+                                                                ghi_range[cell[1]], tiers[cell[0]], mg_pv_hybrid_specs,
+                                                                hours=dispatch_hours)
+                save_hybrid_table(cache_dir, store_key, store)
+
+        return table
 
     @staticmethod
     def optimize_wind_mini_grid(wind_curve, energy, tier, diesel_price, start_year, end_year,
@@ -2470,128 +3599,180 @@ class SettlementProcessor:
 
         return hybrid_lcoe, hybrid_capacity, hybrid_investment
 
-    def wind_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_wind_hybrid_specs, wind_path=r'../test_data'):
+    @staticmethod
+    def solve_wind_table_cell(cell, profiles, tiers, wind_range, diesel_range, year, time_step, end_year,
+                              mg_wind_hybrid_specs):
+        """Calculates the wind-hybrid mini-grid for one (tier, wind speed, diesel cost) cell of the lookup table"""
+        ti, gi, di = cell
+        wind_curve = profiles['wind']
+
+        return SettlementProcessor.optimize_wind_mini_grid(wind_curve * wind_range[gi] / np.average(wind_curve),
+                                                           10000,
+                                                           tiers[ti],
+                                                           diesel_range[di],
+                                                           year - time_step,
+                                                           end_year,
+                                                           year,
+                                                           time_step,
+                                                           mg_wind_hybrid_specs)
+
+    def wind_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_wind_hybrid_specs, wind_path=r'../test_data',
+                                      cache_dir=None, workers=None, wind_step=1, diesel_step=0.1, lazy=False,
+                                      chunk_size=None):
+        """Calculates the wind-hybrid mini-grid LCOE from a lookup table of configurations for each tier, wind speed
+        and diesel cost. The values of each settlement are interpolated bilinearly between the table points.
+
+        Arguments
+        ---------
+        wind_step : float
+            Spacing of the wind speed axis of the table (m/s)
+        diesel_step : float
+            Spacing of the diesel cost axis of the table (USD/liter)
+        cache_dir : str, optional
+            If given, the lookup table is cached in this folder, keyed by a hash of all inputs it depends on (resource
+            profile, mg_wind_hybrid_specs, table axes and start/end years). If a table with the same key is found, it
+            is loaded instead of calculated again. The parsed wind profile is stored in this folder too, instead of
+            next to the csv-file (see load_resource_profiles).
+        workers : int, optional
+            Number of processes to build the table with, by default it is built in this process
+        lazy : bool
+            If True, only the table cells needed to interpolate the potential mini-grid settlements are solved, the
+            others are left as NaN. A cached table is completed with the cells it is missing.
+        chunk_size : int, optional
+            Number of settlements interpolated at once (see chunk_size and interpolate_hybrid_table), by default all
+
+        There is no representative-days screening mode for the wind-hybrid table, unlike the PV-hybrid table. The
+        wind dispatch (optimize_wind_mini_grid) walks the hours of the day (0-23) of the first day of the wind series
+        365 times, not the days of the year, so there are no days to cluster until it simulates the whole series.
+        """
         logging.info('Starting wind hybrid gen lcoe')
         # lats = sorted(self.df['Y_deg'].round().unique())
         # longs = sorted(self.df['X_deg'].round().unique())
 
         self.df['windHybridGenLCOE' + "{}".format(year)] = 0.
 
-        wind_curve = read_wind_environmental_data(wind_path)
-
-        wind_min = round(min(self.df[SET_WINDVEL]))
-        wind_max = round(max(self.df[SET_WINDVEL]))
-        diesel_min = round(min(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]), 1)
-        diesel_max = round(max(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]), 1)
-        wind_range = np.round(np.arange(wind_min, wind_max + 1))
-        diesel_range = np.round(np.arange(diesel_min, diesel_max + 0.1, 0.1), 1)
-
-        tiers = [1, 2, 3, 4, 5]
-
-        wind_hybrids_lcoe = {}
-        wind_hybrid_investment = {}
-        wind_hybrid_capacity = {}
-        wind_hybrid_fuel_cost = {}
-
-        for t in tiers:
-            for g in wind_range:
-                for d in diesel_range:
-                    gen_lcoe, inv, cap, fuel_cost = \
-                        self.optimize_wind_mini_grid(wind_curve * g / np.average(wind_curve),
-                                                     10000,
-                                                     t,
-                                                     d,
-                                                     year - time_step,
-                                                     end_year,
-                                                     year,
-                                                     time_step,
-                                                     mg_wind_hybrid_specs)
-
-                    wind_hybrids_lcoe[t, g, d] = gen_lcoe
-                    wind_hybrid_investment[t, g, d] = inv
-                    wind_hybrid_capacity[t, g, d] = cap
-                    wind_hybrid_fuel_cost[t, g, d] = fuel_cost
-
-        def local_hybrid(wind, diesel, tier, energy):
-            wind = round(wind)
-            diesel = round(diesel, 1)
-
-            hybrid_lcoe = wind_hybrids_lcoe[tier, wind, diesel]
-            hybrid_investment = wind_hybrid_investment[tier, wind, diesel] #* (energy / 10000)
-            hybrid_capacity = wind_hybrid_capacity[tier, wind, diesel] #* (energy / 10000)
-            hybrid_fuel_cost = wind_hybrid_fuel_cost[tier, wind, diesel] #* (energy / 10000)
-
-            return hybrid_lcoe, hybrid_investment, hybrid_capacity, hybrid_fuel_cost
-
-        self.df['PotentialMG'] = np.where(
-            ((self.df[SET_POP + "{}".format(year)] > mg_wind_hybrid_specs['min_mg_connections'])
-             & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
-             (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 2)) |
-            (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
-
-        hybrid_series = self.df.apply(
-            lambda row: local_hybrid(row[SET_WINDVEL], row[SET_MG_DIESEL_FUEL + "{}".format(year)],
-                                     row[SET_TIER], row[SET_ENERGY_PER_CELL + "{}".format(year)])
-            if row['PotentialMG'] == 1
-            else [99, 0, 0, 0],
-            axis=1,
-            result_type='expand')
-
-        del self.df['PotentialMG']
-
-        hybrid_lcoe = pd.Series(hybrid_series[0])
-        hybrid_capacity = pd.Series(hybrid_series[2] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
-        hybrid_investment = pd.Series(hybrid_series[1] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
-        fuel_cost = pd.Series(hybrid_series[3] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        wind_curve = read_wind_environmental_data(wind_path, cache_dir=cache_dir)
+
+        wind_range = hybrid_table_axis(self.df[SET_WINDVEL], wind_step)
+        diesel_range = hybrid_table_axis(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)], diesel_step)
+
+        tiers = np.array([1, 2, 3, 4, 5])
+
+        table = None
+        if cache_dir is not None:
+            optimizer_config = {'optimizer': 'optimize_wind_mini_grid'}
+            key = hybrid_table_key([wind_curve], mg_wind_hybrid_specs, [tiers, wind_range, diesel_range],
+                                   year - time_step, end_year, optimizer_config)
+            table = load_hybrid_table(cache_dir, key)
+            if table is not None:
+                logging.info('Loaded cached wind-hybrid lookup table {}'.format(key))
+
+        if table is None:
+            shape = (len(tiers), len(wind_range), len(diesel_range))
+            # Cells that are not solved yet are NaN
+            table = {'tier': tiers, 'wind': wind_range, 'diesel': diesel_range, 'lcoe': np.full(shape, np.nan),
+                     'investment': np.full(shape, np.nan), 'capacity': np.full(shape, np.nan),
+                     'fuel_cost': np.full(shape, np.nan)}
+
+        potential_mg = (((self.df[SET_POP + "{}".format(year)] > mg_wind_hybrid_specs['min_mg_connections'])
+                         & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
+                         (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 2)) |
+                        (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5)).values
+        settlement_tier = self.df[SET_TIER].values[potential_mg]
+        settlement_wind = self.df[SET_WINDVEL].values[potential_mg]
+        settlement_diesel = self.df[SET_MG_DIESEL_FUEL + "{}".format(year)].values[potential_mg]
+
+        if lazy:
+            needed = hybrid_table_cells(table, 'wind', settlement_tier, settlement_wind, settlement_diesel)
+        else:
+            needed = list(np.ndindex(table['lcoe'].shape))
+        cells = [cell for cell in needed if np.isnan(table['lcoe'][cell])]
+        print(time.ctime(), 'Wind-hybrid lookup table: solving {} of {} cells, {} already solved, {} not needed by any '
+                            'settlement'.format(len(cells), table['lcoe'].size, len(needed) - len(cells),
+                                                table['lcoe'].size - len(needed)))
+
+        if len(cells) > 0:
+            results = solve_table_cells(self.solve_wind_table_cell, cells, {'wind': wind_curve},
+                                        (tiers, wind_range, diesel_range, year, time_step, end_year,
+                                         mg_wind_hybrid_specs),
+                                        workers=workers, description='Wind-hybrid lookup table cells')
+
+            for cell, (gen_lcoe, inv, cap, fuel_cost) in zip(cells, results):
+                table['lcoe'][cell] = gen_lcoe
+                table['investment'][cell] = inv
+                table['capacity'][cell] = cap
+                table['fuel_cost'][cell] = fuel_cost
+
+            if cache_dir is not None:
+                save_hybrid_table(cache_dir, key, table)
+
+        # Settlements that can not get a mini-grid keep LCOE 99 and no investment, capacity or fuel cost
+        hybrid_series = {'lcoe': np.full(len(self.df), 99., dtype=self.precision),
+                         'investment': np.zeros(len(self.df), dtype=self.precision),
+                         'capacity': np.zeros(len(self.df), dtype=self.precision),
+                         'fuel_cost': np.zeros(len(self.df), dtype=self.precision)}
+        hybrid = interpolate_hybrid_table(table, 'wind', settlement_tier, settlement_wind, settlement_diesel,
+                                          chunk_size=chunk_size, dtype=self.precision)
+        for name in hybrid_series:
+            hybrid_series[name][potential_mg] = hybrid[name]
+
+        energy_scale = self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000
+        hybrid_lcoe = pd.Series(hybrid_series['lcoe'], index=self.df.index)
+        hybrid_capacity = pd.Series(hybrid_series['capacity'], index=self.df.index) * energy_scale
+        hybrid_investment = pd.Series(hybrid_series['investment'], index=self.df.index) * energy_scale
+        fuel_cost = pd.Series(hybrid_series['fuel_cost'], index=self.df.index) * energy_scale
         emission_factor = fuel_cost / self.df[
             SET_MG_DIESEL_FUEL + '{}'.format(year)] * 256.9131097 * 9.9445485  # ToDo check emission factor
         self.df['windHybridEmissionFactor' + "{}".format(year)] = emission_factor
         self.df['windHybridGenLCOE' + "{}".format(year)] += hybrid_lcoe
 
-        return hybrid_lcoe, hybrid_capacity, hybrid_investment, wind_hybrid_investment
+        return hybrid_lcoe, hybrid_capacity, hybrid_investment, table
 
     def calculate_off_grid_lcoes(self, mg_hydro_calc, mg_wind_hybrid_calc, sa_pv_calc,  mg_pv_hybrid_calc, year, end_year, time_step, techs, tech_codes,
-                                 min_mg_size=0, mg_min_grid_dist=0):
+                                 min_mg_size=0, mg_min_grid_dist=0, choose_minimum=True):
         """
         Calculate the LCOEs for all off-grid technologies
+
+        If choose_minimum is False, the least-cost off-grid technology is not chosen (choose_minimum_off_grid_tech),
+        e.g. to calculate the LCOEs in blocks of settlements with run_in_chunks, and then choose for all settlements
+        at once. Choosing is not independent per settlement, since hydro-power sites are shared.
         """
 
         print(time.ctime(), 'Starting off-grid LCOE calculation for year {}'.format(year))
 
-        logging.info('Calculate minigrid hydro LCOE')
-        self.df[SET_LCOE_MG_HYDRO + "{}".format(year)], mg_hydro_investment, mg_hydro_capacity = \
-            mg_hydro_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                   start_year=year - time_step,
-                                   end_year=end_year,
-                                   people=self.df[SET_POP + "{}".format(year)],
-                                   new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                   total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                   prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                   num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                   grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                   additional_mv_line_length=self.df[SET_HYDRO_DIST],
-                                   capacity_factor=mg_hydro_calc.capacity_factor,
-                                   base_to_peak_load_ratio=self.df[SET_AVERAGE_TO_PEAK]
-                                   )
+        logging.info('Calculate minigrid hydro, PV Hybrid, Wind Hybrid and standalone PV LCOE')
+        # The mini-grids share their distribution networks, which are computed only once
+        lcoe, investment, capacity = Technology.get_lcoe_many(
+            [mg_hydro_calc, mg_pv_hybrid_calc, mg_wind_hybrid_calc, sa_pv_calc],
+            per_technology=[{'additional_mv_line_length': self.df[SET_HYDRO_DIST],
+                             'capacity_factor': mg_hydro_calc.capacity_factor},
+                            {'capacity_factor': self.df[SET_GHI] / HOURS_PER_YEAR},
+                            {'capacity_factor': self.df[SET_WINDCF]},
+                            {'capacity_factor': self.df[SET_GHI] / HOURS_PER_YEAR,
+                             'base_to_peak_load_ratio': sa_pv_calc.base_to_peak_load_ratio}],
+            energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
+            start_year=year - time_step,
+            end_year=end_year,
+            people=self.df[SET_POP + "{}".format(year)],
+            new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
+            total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
+            prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
+            num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
+            grid_cell_area=self.df[SET_GRID_CELL_AREA],
+            base_to_peak_load_ratio=self.df[SET_AVERAGE_TO_PEAK])
+
+        self.df[SET_LCOE_MG_HYDRO + "{}".format(year)] = lcoe[:, 0]
+        self.df[SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = lcoe[:, 1]
+        self.df[SET_LCOE_MG_WIND + "{}".format(year)] = lcoe[:, 2]
+        self.df[SET_LCOE_SA_PV + "{}".format(year)] = lcoe[:, 3]
+        mg_hydro_investment, mg_pv_hybrid_investment, mg_wind_investment, sa_pv_investment = \
+            [pd.DataFrame(investment[:, i]) for i in range(4)]
+        mg_hydro_capacity, mg_pv_hybrid_capacity, mg_wind_capacity, sa_pv_capacity = \
+            [pd.DataFrame(capacity[:, i]) for i in range(4)]
 
         self.df.loc[(self.df[SET_POP + "{}".format(year)] / self.df[SET_NUM_PEOPLE_PER_HH]) < min_mg_size, SET_LCOE_MG_HYDRO + "{}".format(year)] = 99
         self.df.loc[self.df[SET_MV_DIST_CURRENT] < mg_min_grid_dist, SET_LCOE_MG_HYDRO + "{}".format(year)] = 99
 
-        logging.info('Calculate minigrid PV Hybrid LCOE')
-        self.df[SET_LCOE_MG_PV_HYBRID + "{}".format(year)], mg_pv_hybrid_investment, mg_pv_hybrid_capacity = \
-            mg_pv_hybrid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                       start_year=year - time_step,
-                                       end_year=end_year,
-                                       people=self.df[SET_POP + "{}".format(year)],
-                                       new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                       total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                       prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                       num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                       grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                       capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR,
-                                       base_to_peak_load_ratio=self.df[SET_AVERAGE_TO_PEAK]
-                                       )
-
         self.df.loc[self.df[SET_LCOE_MG_PV_HYBRID + "{}".format(year)] > 99, SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = 99
 
         self.df.loc[(self.df[SET_POP + "{}".format(year)] / self.df[SET_NUM_PEOPLE_PER_HH]) < min_mg_size, SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = 99
@@ -2599,44 +3780,18 @@ class SettlementProcessor:
 
         self.df.loc[self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5, SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = 0.01 # ToDo ensure remain mg
 
-        logging.info('Calculate minigrid Wind Hybrid LCOE')
-        self.df[SET_LCOE_MG_WIND + "{}".format(year)], mg_wind_investment, mg_wind_capacity = \
-            mg_wind_hybrid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                         start_year=year - time_step,
-                                         end_year=end_year,
-                                         people=self.df[SET_POP + "{}".format(year)],
-                                         new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                         total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                         prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                         num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                         grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                         capacity_factor=self.df[SET_WINDCF],
-                                         base_to_peak_load_ratio=self.df[SET_AVERAGE_TO_PEAK])
         self.df.loc[self.df[SET_LCOE_MG_WIND + "{}".format(year)] > 99, SET_LCOE_MG_WIND + "{}".format(year)] = 99
 
         self.df.loc[(self.df[SET_POP + "{}".format(year)] / self.df[SET_NUM_PEOPLE_PER_HH]) < min_mg_size, SET_LCOE_MG_WIND + "{}".format(year)] = 99
         self.df.loc[self.df[SET_MV_DIST_CURRENT] < mg_min_grid_dist, SET_LCOE_MG_WIND + "{}".format(year)] = 99
 
-        logging.info('Calculate standalone PV LCOE')
-        self.df[SET_LCOE_SA_PV + "{}".format(year)], sa_pv_investment, sa_pv_capacity = \
-            sa_pv_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                start_year=year - time_step,
-                                end_year=end_year,
-                                people=self.df[SET_POP + "{}".format(year)],
-                                new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR,
-                                base_to_peak_load_ratio=sa_pv_calc.base_to_peak_load_ratio)
-
         self.df.loc[(self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 3) &
                     (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 99),
                     SET_LCOE_SA_PV + "{}".format(year)] = 99
 
-        self.choose_minimum_off_grid_tech(year, mg_hydro_calc, techs, tech_codes, sa_pv_investment,
-                                          mg_pv_hybrid_investment, mg_wind_investment, mg_hydro_investment)
+        if choose_minimum:
+            self.choose_minimum_off_grid_tech(year, mg_hydro_calc, techs, tech_codes, sa_pv_investment,
+                                              mg_pv_hybrid_investment, mg_wind_investment, mg_hydro_investment)
 
         return sa_pv_investment, sa_pv_capacity, mg_pv_hybrid_investment, mg_pv_hybrid_capacity, mg_wind_investment, \
             mg_wind_capacity, mg_hydro_investment, mg_hydro_capacity
@@ -2716,7 +3871,8 @@ class SettlementProcessor:
                                                   (self.df[SET_HYDRO_DIST] < max_hydro_dist)].sum()
             if hydro_usage > hydro_df[SET_HYDRO][index]:
                 hydro_usage_cumsum = additional_capacity.loc[(self.df[SET_HYDRO_FID] == index) &
-                                                             (self.df[SET_HYDRO_DIST] < max_hydro_dist)].cumsum()
+                                                             (self.df[SET_HYDRO_DIST] < max_hydro_dist)]
+                hydro_usage_cumsum = hydro_usage_cumsum.astype('float64').cumsum()
                 hydro_usage = hydro_usage_cumsum.loc[hydro_usage_cumsum > hydro_df[SET_HYDRO][index]]
                 hydro_lcoe[hydro_usage.index] = 99
 
@@ -2873,7 +4029,7 @@ class SettlementProcessor:
             self.df['Elec_POP'] = self.df[SET_ELEC_POP + "{}".format(year - time_step)] + self.df[
                 SET_NEW_CONNECTIONS + "{}".format(year)] * self.df[SET_NUM_PEOPLE_PER_HH]
             cumulative_pop = self.df['Elec_POP'].cumsum()
-            cumulative_pop = self.df[SET_POP + "{}".format(year)].cumsum()
+            cumulative_pop = self.df[SET_POP + "{}".format(year)].astype('float64').cumsum()
 
             self.df['PreSelection' + "{}".format(year)] = np.where(cumulative_pop < elec_target_pop, 1, 0)
 
@@ -2920,7 +4076,7 @@ class SettlementProcessor:
             self.df['Elec_POP'] = self.df[SET_ELEC_POP + "{}".format(year - time_step)] + self.df[
                 SET_NEW_CONNECTIONS + "{}".format(year)] * self.df[SET_NUM_PEOPLE_PER_HH]
             cumulative_pop = self.df['Elec_POP'].cumsum() # ToDo check if works correctly
-            cumulative_pop = self.df[SET_POP + "{}".format(year)].cumsum()
+            cumulative_pop = self.df[SET_POP + "{}".format(year)].astype('float64').cumsum()
 
             self.df[SET_LIMIT + "{}".format(year)] = np.where(cumulative_pop < elec_target_pop, 1, 0)
 
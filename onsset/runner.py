@@ -10,7 +10,7 @@ import geojson
 import pandas as pd
 from onsset import (SET_ELEC_ORDER, SET_LCOE_GRID, SET_MIN_GRID_DIST, SET_GRID_PENALTY,
                     SET_MV_CONNECT_DIST, SET_WINDVEL, SET_WINDCF, SET_X_DEG, SET_Y_DEG,
-                    SettlementProcessor, Technology)
+                    SettlementProcessor, Technology, set_num_threads)
 
 try:
     from onsset.specs import (SPE_COUNTRY, SPE_ELEC, SPE_ELEC_MODELLED,
@@ -106,7 +106,8 @@ def calibration(specs_path, csv_path, specs_path_calib, calibrated_csv_path):
     onsseter.df.to_csv(settlements_out_csv, index=False)
 
 
-def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv_path, wind_path, mv_path):
+def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv_path, wind_path, mv_path,
+             precision='float64'):
     """
 
     Arguments
@@ -115,6 +116,8 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
     calibrated_csv_path : str
     results_folder : str
     summary_folder : str
+    precision : str
+        'float64', or 'float32' to compute the settlements in float32 (see SettlementProcessor)
 
     """
 
@@ -127,7 +130,7 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
     for scenario in scenarios:
         print('Scenario: ' + str(scenario + 1))
 
-        onsseter = SettlementProcessor(calibrated_csv_path)
+        onsseter = SettlementProcessor(calibrated_csv_path, precision=precision)
 
         x_mv_exist, y_mv_exist = onsseter.start_extension_points(mv_path)
         x_coordinates = x_mv_exist
@@ -212,6 +215,16 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
 
         mg_interconnection = True  # True if mini-grids are allowed to be integrated into the grid, else False
         hybrid_lookup_table = True
+        hybrid_table_cache = None  # Folder to cache the hybrid lookup tables in (e.g. os.path.join(results_folder, 'hybrid_tables')), None to disable
+        hybrid_table_workers = None  # Number of processes to build the hybrid lookup tables with, None to build them in this process
+        hybrid_table_lazy = False  # If True, only the lookup table cells needed by the settlements are optimized
+        hybrid_table_warm_start = False  # If True, the PV-hybrid optimizations are warm-started from neighbouring table cells
+        hybrid_table_seed = None  # Seed of the hybrid table optimizer, makes the tables reproducible (needed to cache the differential evolution tables)
+        hybrid_optimizer = 'differential_evolution'  # Or 'numba_de', or 'grid' (about 8x faster with a few % higher LCOE, for screening)
+        hybrid_table_recost = False  # If True, store the dispatch results in hybrid_table_cache and cost the stored configurations instead of optimizing again (cost sensitivity runs)
+        hybrid_representative_days = None  # Number of representative days to simulate instead of the full year (screening runs, e.g. 12 or 24), None for the full year (PV-hybrid table only)
+        chunk_memory_budget = None  # Memory in bytes to process the per-settlement stages in blocks of settlements with (e.g. 2e9), None to process all settlements at once
+        numba_threads = None  # Number of threads of the parallel numba kernels (e.g. the hybrid simulations), None to use all cores
         min_mg_size = 100  # minimum number of households in settlement for mini-grids to be considered as an option
 
         grid_reliability_option = 'None'  # Options: 'None', 'CNSE', 'DieselBackup'
@@ -222,6 +235,8 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
 
         new_lines_geojson = {}
 
+        set_num_threads(numba_threads)
+
         time_steps = {}
         for i in range(len(yearsofanalysis)):
             if i == 0:
@@ -408,24 +423,36 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
             num_people_per_hh_urban = float(specs_data.loc[year][SPE_NUM_PEOPLE_PER_HH_URBAN])
             max_grid_extension_dist = float(specs_data.loc[year][SPE_MAX_GRID_EXTENSION_DIST])
 
-            onsseter.calculate_demand(year, num_people_per_hh_rural, num_people_per_hh_urban, time_step,
-                                      urban_tier, rural_tier_large, rural_tier_small, rural_cutoff, tiers)
+            chunk_size = onsseter.chunk_size(chunk_memory_budget) if chunk_memory_budget else None
+
+            onsseter.run_in_chunks('calculate_demand', year, num_people_per_hh_rural, num_people_per_hh_urban,
+                                   time_step, urban_tier, rural_tier_large, rural_tier_small, rural_cutoff, tiers,
+                                   chunk_size=chunk_size)
 
-            onsseter.calculate_unmet_demand(year, reliability=0.963)
+            onsseter.run_in_chunks('calculate_unmet_demand', year, reliability=0.963, chunk_size=chunk_size)
 
-            onsseter.diesel_cost_columns(sa_diesel_cost, mg_diesel_cost, year)
+            onsseter.run_in_chunks('diesel_cost_columns', sa_diesel_cost, mg_diesel_cost, year,
+                                   chunk_size=chunk_size)
 
             if hybrid_lookup_table:
                 hybrid_lcoe, hybrid_capacity, hybrid_investment, check = \
                     onsseter.pv_hybrids_lcoe_lookuptable(year, time_step, end_year,
-                                                         mg_pv_hybrid_params, pv_path=pv_path)
+                                                         mg_pv_hybrid_params, pv_path=pv_path,
+                                                         cache_dir=hybrid_table_cache, seed=hybrid_table_seed,
+                                                         workers=hybrid_table_workers, lazy=hybrid_table_lazy,
+                                                         warm_start=hybrid_table_warm_start,
+                                                         optimizer=hybrid_optimizer, recost=hybrid_table_recost,
+                                                         representative_days=hybrid_representative_days,
+                                                         chunk_size=chunk_size)
                 mg_pv_hybrid_calc.hybrid_fuel = hybrid_lcoe
                 mg_pv_hybrid_calc.hybrid_investment = hybrid_investment
                 mg_pv_hybrid_calc.hybrid_capacity = hybrid_capacity
 
                 wind_hybrid_lcoe, wind_hybrid_capacity, wind_hybrid_investment, wind_check = \
                     onsseter.wind_hybrids_lcoe_lookuptable(year, time_step, end_year, mg_wind_hybrid_params,
-                                                           wind_path=wind_path)
+                                                           wind_path=wind_path, cache_dir=hybrid_table_cache,
+                                                           workers=hybrid_table_workers, lazy=hybrid_table_lazy,
+                                                           chunk_size=chunk_size)
                 wind_hybrid_investment.fillna(0, inplace=True)
                 wind_hybrid_capacity.fillna(0, inplace=True)
 
@@ -435,16 +462,20 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
             else:
                 hybrid_lcoe, hybrid_capacity, hybrid_investment = \
                     onsseter.pv_hybrids_lcoe(year, time_step, end_year,
-                                             mg_pv_hybrid_params, pv_folder_path=pv_path)
+                                             mg_pv_hybrid_params, pv_folder_path=pv_path,
+                                             workers=hybrid_table_workers, optimizer=hybrid_optimizer)
 
 
 
             sa_pv_investment, sa_pv_capacity, mg_pv_hybrid_investment, mg_pv_hybrid_capacity, \
-            mg_wind_investment, mg_wind_capacity, mg_hydro_investment, mg_hydro_capacity = onsseter.calculate_off_grid_lcoes(mg_hydro_calc, mg_wind_hybrid_calc,
-                                                                                       sa_pv_calc,
-                                                                                       mg_pv_hybrid_calc,
-                                                                                       year, end_year, time_step,
-                                                                                       techs, tech_codes, min_mg_size, 0)
+            mg_wind_investment, mg_wind_capacity, mg_hydro_investment, mg_hydro_capacity = \
+                onsseter.run_in_chunks('calculate_off_grid_lcoes', mg_hydro_calc, mg_wind_hybrid_calc, sa_pv_calc,
+                                       mg_pv_hybrid_calc, year, end_year, time_step, techs, tech_codes, min_mg_size,
+                                       0, choose_minimum=False, chunk_size=chunk_size,
+                                       per_settlement=(1, 3))  # The hybrid values of the wind and PV hybrids
+            # The hydro-power sites are shared by the settlements, so the off-grid technology is chosen for all at once
+            onsseter.choose_minimum_off_grid_tech(year, mg_hydro_calc, techs, tech_codes, sa_pv_investment,
+                                                  mg_pv_hybrid_investment, mg_wind_investment, mg_hydro_investment)
 
             grid_investment, grid_capacity, grid_cap_gen_limit, grid_connect_limit = \
                 onsseter.pre_electrification(grid_price, year, time_step, end_year, grid_calc, sa_diesel_calc,
@@ -473,8 +504,8 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
                                               mg_interconnection=False,
                                               )
 
-            onsseter.results_columns(techs, tech_codes, year, time_step, prioritization, auto_intensification,
-                                     mg_interconnection)
+            onsseter.run_in_chunks('results_columns', techs, tech_codes, year, time_step, prioritization,
+                                   auto_intensification, mg_interconnection, chunk_size=chunk_size)
 
             onsseter.calculate_investments_and_capacity(sa_pv_investment, sa_pv_capacity,
                                                 mg_pv_hybrid_investment, mg_pv_hybrid_capacity, mg_wind_investment,
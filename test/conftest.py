@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from onsset.onsset import (SET_AVERAGE_TO_PEAK, SET_ELEC_FINAL_CODE, SET_ENERGY_PER_CELL, SET_GHI, SET_GRID_CELL_AREA,
+                           SET_HYDRO_DIST, SET_MV_DIST_CURRENT, SET_NEW_CONNECTIONS, SET_NUM_PEOPLE_PER_HH, SET_POP,
+                           SET_TOTAL_ENERGY_PER_CELL, SET_WINDCF, SET_X_DEG, SET_Y_DEG, SettlementProcessor,
+                           Technology)
+
+from pytest import fixture, mark
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', help='Also run the timing benchmarks (marked benchmark)')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: timing benchmark, only run with --benchmark')
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skips the benchmarks unless --benchmark is given, since their times depend on the machine and its load"""
+    if config.getoption('--benchmark'):
+        return
+    skip = mark.skip(reason='Timing benchmark, run with --benchmark')
+    for item in items:
+        if item.get_closest_marker('benchmark') is not None:
+            item.add_marker(skip)
+
+
+@fixture
+def off_grid_settlements():
+    """Returns a function making a SettlementProcessor with n random settlements, with the columns needed by
+    calculate_off_grid_lcoes for the year 2025"""
+    def make(n):
+        rng = np.random.default_rng(0)
+        year = 2025
+        settlementprocessor = SettlementProcessor.__new__(SettlementProcessor)
+        settlementprocessor.df = pd.DataFrame({
+            SET_X_DEG: rng.uniform(-20, 50, n), SET_Y_DEG: rng.uniform(-35, 35, n),
+            SET_HYDRO_DIST: rng.uniform(0, 30, n), SET_GHI: rng.uniform(1500, 2500, n),
+            SET_WINDCF: rng.uniform(0.1, 0.4, n), SET_ENERGY_PER_CELL + str(year): rng.uniform(0, 1e6, n),
+            SET_POP + str(year): rng.uniform(0, 5000, n), SET_NEW_CONNECTIONS + str(year): rng.uniform(0, 1000, n),
+            SET_TOTAL_ENERGY_PER_CELL: rng.uniform(1, 2e6, n),
+            SET_ELEC_FINAL_CODE + '2020': rng.choice([1, 3, 5, 99], n), SET_NUM_PEOPLE_PER_HH: 4.5,
+            SET_GRID_CELL_AREA: rng.uniform(0.1, 10, n), SET_AVERAGE_TO_PEAK: rng.choice([0.3, 0.5], n),
+            SET_MV_DIST_CURRENT: rng.uniform(0, 50, n)})
+        return settlementprocessor
+
+    return make
+
+
+@fixture
+def off_grid_arguments():
+    """Returns a function making the arguments of calculate_off_grid_lcoes for n settlements in 2025: four
+    technologies, the second one with hybrid values per settlement, followed by the years and limits"""
+    def make(n, dtype='float64'):
+        Technology.set_default_values(base_year=2020, start_year=2021, end_year=2030)
+        mini_grid = dict(om_of_td_lines=0.02, distribution_losses=0.05, connection_cost_per_hh=100, mini_grid=True)
+        technologies = [Technology(tech_life=30, capital_cost={float('inf'): 3000}, om_costs=0.03,
+                                   capacity_factor=0.5, **mini_grid),
+                        Technology(tech_life=20, hybrid=True,
+                                   hybrid_fuel=pd.Series(np.linspace(0.1, 0.3, n, dtype=dtype)),
+                                   hybrid_investment=pd.Series(np.linspace(1e4, 1e5, n, dtype=dtype)),
+                                   hybrid_capacity=pd.Series(np.linspace(5, 50, n, dtype=dtype)), **mini_grid),
+                        Technology(tech_life=20, capital_cost={float('inf'): 2500}, om_costs=0.02, **mini_grid),
+                        Technology(tech_life=5, om_costs=0.02, standalone=True, base_to_peak_load_ratio=0.9,
+                                   capital_cost={float('inf'): 6950, 1: 4470, 0.1: 6380})]
+        return technologies + [2025, 2030, 5, None, None, 100, 5]
+
+    return make
+
+
+@fixture
+def mini_grid_specs():
+    """Returns the PV-hybrid mini-grid specifications shared by the hybrid tests"""
+    return {'diesel_cost': 500, 'discount_rate': 0.08, 'n_chg': 0.92, 'n_dis': 0.92, 'battery_cost': 300,
+            'pv_cost': 1400, 'charge_controller': 0, 'pv_inverter': 0, 'pv_life': 25, 'diesel_life': 10,
+            'pv_om': 0.015, 'diesel_om': 0.1, 'battery_inverter_cost': 150, 'battery_inverter_life': 10,
+            'dod_max': 0.8, 'inv_eff': 0.93, 'lpsp_max': 0.02, 'diesel_limit': 0.5, 'full_life_cycles': 4000}
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from onsset.onsset import SettlementProcessor
+
+from pandas.testing import assert_frame_equal, assert_series_equal
+from pytest import fixture
+
+
+class BlockStages(SettlementProcessor):
+
+    def mark_settlements(self, offset):
+        """Changes, adds and removes columns, some of them only in some blocks"""
+        self.df['Code'] = self.df['Code'] + offset
+        if (self.df['Code'] > 5).any():
+            self.df['Code'] = np.where(self.df['Code'] > 5, 0.5, self.df['Code'])
+        self.df['Label'] = np.where(self.df['Value'] > 0.5, 'high', 'low')
+        if (self.df['Value'] > 0.9).any():
+            self.df['Large'] = 1
+        self.df = self.df.drop(columns=['Unused'])
+        return self.df['Value'] * offset, self.df['Code'].values, len(self.df)
+
+    def count_values(self, values):
+        """Returns the number of values it gets, without changing any column"""
+        return len(values)
+
+
+class TestRunInChunks:
+
+    @fixture
+    def setup_settlementprocessor(self, off_grid_settlements) -> SettlementProcessor:
+        return off_grid_settlements(50)
+
+    def test_off_grid_lcoes(self, setup_settlementprocessor, off_grid_arguments):
+        """The off-grid LCOEs and investments are the same if calculated in blocks of settlements"""
+        args = off_grid_arguments(len(setup_settlementprocessor.df))
+
+        expected = setup_settlementprocessor
+        chunked = SettlementProcessor.__new__(SettlementProcessor)
+        chunked.df = expected.df.copy()
+        expected_results = expected.calculate_off_grid_lcoes(*args, choose_minimum=False)
+        results = chunked.run_in_chunks('calculate_off_grid_lcoes', *args, choose_minimum=False, chunk_size=7,
+                                        per_settlement=(1,))
+
+        assert_frame_equal(chunked.df, expected.df)
+        for result, expected_result in zip(results, expected_results):
+            assert_frame_equal(result, expected_result)
+
+    def test_columns_and_results(self, setup_settlementprocessor):
+        """Added, changed and removed columns and the returned values are combined from the blocks"""
+        sp = BlockStages.__new__(BlockStages)
+        sp.df = pd.DataFrame({'Code': np.arange(10), 'Value': np.linspace(0, 1, 10), 'Unused': 0},
+                             index=np.arange(10, 20))
+        offset = np.arange(10) % 2
+
+        values, codes, length = sp.run_in_chunks('mark_settlements', offset, chunk_size=4, per_settlement=(0,))
+
+        assert list(sp.df.columns) == ['Code', 'Value', 'Label', 'Large']
+        assert list(sp.df.index) == list(range(10, 20))
+        assert list(sp.df['Code']) == [0, 2, 2, 4, 4, 0.5, 0.5, 0.5, 0.5, 0.5]
+        assert list(sp.df['Label']) == ['low'] * 5 + ['high'] * 5
+        assert sp.df['Large'].iloc[:8].isna().all() and (sp.df['Large'].iloc[8:] == 1).all()
+        assert_series_equal(values, pd.Series(np.linspace(0, 1, 10) * offset, name='Value'))
+        assert list(codes) == list(sp.df['Code'])
+        assert length == 4
+
+    def test_whole_arguments(self):
+        """Only the arguments listed in per_settlement are split, other arguments and the columns are left as they are
+        """
+        sp = BlockStages.__new__(BlockStages)
+        sp.df = pd.DataFrame({'Code': np.arange(10), 'Value': np.linspace(0, 1, 10), 'Label': 'low'})
+        expected = sp.df.copy()
+
+        assert sp.run_in_chunks('count_values', np.arange(10), chunk_size=4) == 10
+        assert sp.run_in_chunks('count_values', values=np.arange(10), chunk_size=4, per_settlement=('values',)) == 4
+        assert_frame_equal(sp.df, expected)
+
+    def test_chunk_size(self, setup_settlementprocessor):
+        assert setup_settlementprocessor.chunk_size(1e6, bytes_per_settlement=1000) == 1000
+        assert setup_settlementprocessor.chunk_size(10, bytes_per_settlement=1000) == 1
+        assert 0 < setup_settlementprocessor.chunk_size(1e6) < 1e6 / 4096
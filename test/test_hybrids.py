@@ -0,0 +1,726 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from onsset.hybrids import (TokenBucket, calc_load_curve, cluster_representative_days, dispatch_store_key,
+                            find_least_cost_option, find_least_cost_option_batch, find_least_cost_option_bounded,
+                            find_least_cost_option_metrics, grid_refine_minimize, hybrid_table_axis, hybrid_table_cells,
+                            hybrid_table_key, interpolate_hybrid_table, load_hybrid_table, load_pv_profile,
+                            load_resource_profiles, nearest_profiles, prefetch_pv_data, pv_data_path, pv_generation,
+                            pv_table_dispatch, pv_table_recost, read_environmental_data, representative_days_accuracy,
+                            representative_hours, resource_profile_index, save_hybrid_table, solve_table_cells,
+                            sweep_chains, table_cell_seed, warm_start_population, year_simulation_metrics,
+                            year_simulation_trace)
+from onsset.hybrids_wind import read_wind_environmental_data
+from onsset.onsset import (SET_ELEC_FINAL_CODE, SET_ENERGY_PER_CELL, SET_GHI, SET_MG_DIESEL_FUEL, SET_POP, SET_TIER,
+                           SET_X_DEG, SET_Y_DEG, SettlementProcessor)
+
+from pytest import fixture, approx, raises
+
+
+class TestHybridSimulation:
+
+    @fixture
+    def setup_profile(self):
+        """A synthetic hourly GHI and temperature profile for one year"""
+        hours = np.arange(8760)
+        rng = np.random.default_rng(0)
+        ghi = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 800 * (0.7 + 0.3 * rng.random(8760))
+        temp = 20 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+        load_curve = calc_load_curve(3, 10000)
+
+        return ghi, temp, load_curve, np.arange(8760.)
+
+    def test_metrics_and_trace_match(self, setup_profile):
+        """The metrics-only and the trace kernels give the same annual results
+        """
+        ghi, temp, load_curve, hour_numbers = setup_profile
+        net_load, pv_gen = pv_generation(temp, ghi, 5., load_curve, 0.93)
+
+        soc = np.empty(8760, dtype=np.float32)
+        diesel = np.empty(8760, dtype=np.float32)
+
+        metrics = year_simulation_metrics(8., 1., net_load, hour_numbers, 0.93, 0.92, 0.92, load_curve.sum(),
+                                          4000, 0.8, 1, 1)
+        trace = year_simulation_trace(8., 1., net_load, hour_numbers, 0.93, 0.92, 0.92, load_curve.sum(),
+                                      4000, 0.8, 1, 1, soc, diesel)
+
+        assert metrics == approx(trace)
+        assert soc.min() >= 0
+        assert diesel.max() <= 1.
+
+    def test_find_least_cost_option_metrics(self, setup_profile):
+        """The metrics-only option evaluation returns the same values as the full one
+        """
+        ghi, temp, load_curve, hour_numbers = setup_profile
+        args = (temp, ghi, hour_numbers, load_curve, 0.93, 0.92, 0.92, 0.8, 0.5, 2030, 2020, 1400, 0, 0, 0.93, 0.015,
+                500, 0.1, 10, 150, 10, 25, 300, 0.08, 0.02, 0.5, 4000)
+
+        for configuration in [np.array([5., 10., 1.]), np.array([0.1, 0., 0.])]:
+            full = find_least_cost_option(configuration, *args)
+            metrics = find_least_cost_option_metrics(configuration, *args)
+
+            assert metrics[:13] == approx(full[:13])
+            assert metrics[13] == approx(full[14])
+
+    def test_bounded_simulation(self, setup_profile):
+        """Stopping infeasible configurations early gives the same LCOE, with fewer hours simulated
+        """
+        ghi, temp, load_curve, hour_numbers = setup_profile
+        args = (temp, ghi, hour_numbers, load_curve, 0.93, 0.92, 0.92, 0.8, 0.5, 2030, 2020, 1400, 0, 0, 0.93, 0.015,
+                500, 0.1, 10, 150, 10, 25, 300, 0.08, 0.02, 0.5, 4000)
+        configurations = np.array([[5., 10., 1.], [0.1, 0., 0.], [1., 2., 0.6], [20., 40., 3.]]).T
+
+        weighted_args = args[:3] + (np.ones(8760),) + args[3:]
+
+        lcoe, hours = find_least_cost_option_batch(configurations, *weighted_args)
+        for i in range(configurations.shape[1]):
+            assert find_least_cost_option_bounded(configurations[:, i], *weighted_args) == (lcoe[i], hours[i])
+            assert lcoe[i] == find_least_cost_option_metrics(configurations[:, i], *args)[0]
+            if lcoe[i] < 99:
+                assert hours[i] == 8760
+
+        assert (lcoe == 99).any()
+        assert hours[lcoe == 99].max() < 8760
+
+
+class TestRepresentativeDays:
+
+    @fixture
+    def setup_profile(self, mini_grid_specs):
+        """A synthetic hourly GHI and temperature profile with seasons and cloudy days"""
+        hours = np.arange(8760)
+        rng = np.random.default_rng(1)
+        season = 1 + 0.3 * np.cos(hours / 8760 * 2 * np.pi)
+        clouds = np.repeat(rng.choice([0.3, 0.7, 1.], 365), 24)
+        ghi = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 900 * season * clouds
+        temp = 20 + 5 * season + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+
+        return ghi, temp, mini_grid_specs
+
+    def test_cluster_days(self, setup_profile):
+        ghi, temp, specs = setup_profile
+
+        days, weights = cluster_representative_days([ghi, temp], 12)
+        assert len(days) == 12
+        assert (np.diff(days) > 0).all()
+        assert weights.sum() == 365
+        assert (weights > 0).all()
+
+        days, weights = cluster_representative_days([ghi.reshape(8760, 1)], 400)
+        assert (days == np.arange(365)).all()
+        assert (weights == 1).all()
+
+        hour_numbers, hour_weights = representative_hours([2, 10], [300, 65])
+        assert hour_numbers[:2] == approx([48, 49])
+        assert hour_numbers[-1] == 10 * 24 + 23
+        assert hour_weights.sum() == 365 * 24
+
+    def test_full_year_matches(self, setup_profile):
+        """With every day as its own representative day, the weighted simulation is the full-year simulation
+        """
+        ghi, temp, specs = setup_profile
+        cells = [(np.array([40., 100., 5.]), 2000, 3, 0.5), (np.array([20., 30., 0.]), 1800, 2, 0.4)]
+
+        accuracy = representative_days_accuracy(cells, ghi, temp, representative_hours(np.arange(365),
+                                                                                       np.ones(365)),
+                                                specs, 2020, 2030)
+        for column in ['lcoe', 'lpsp', 'diesel_share']:
+            assert accuracy[column + '_representative'].values == approx(accuracy[column + '_full'].values)
+
+    def test_accuracy(self, setup_profile):
+        """24 representative days approximate the full-year LCOE of feasible configurations within a few percent
+        """
+        ghi, temp, specs = setup_profile
+        hours = representative_hours(*cluster_representative_days([ghi, temp], 24))
+        assert len(hours[0]) == 24 * 24
+
+        cells = [(np.array([40., 100., 5.]), 2000, 3, 0.5), (np.array([60., 150., 3.]), 1900, 3, 0.6)]
+        accuracy = representative_days_accuracy(cells, ghi, temp, hours, specs, 2020, 2030)
+
+        assert (accuracy['lcoe_full'] < 99).all()
+        assert accuracy['lcoe_representative'].values == approx(accuracy['lcoe_full'].values, rel=0.05)
+        assert accuracy['diesel_share_representative'].values == approx(accuracy['diesel_share_full'].values,
+                                                                        abs=0.05)
+
+
+class TestResourceProfiles:
+
+    @fixture
+    def setup_csv(self, tmp_path):
+        """A resource csv-file with two header rows to skip, a column header and 8760 hours"""
+        rng = np.random.default_rng(2)
+        data = pd.DataFrame({'time': np.arange(8760), 'wind': rng.uniform(0, 12, 8760),
+                             'temp': rng.uniform(15, 35, 8760), 'ghi': rng.uniform(0, 1000, 8760)})
+        path = tmp_path / 'resource.csv'
+        with open(path, 'w') as f:
+            f.write('source\nunits\n')
+            data.to_csv(f, index=False)
+
+        return str(path), data
+
+    def test_parse_once(self, setup_csv, monkeypatch):
+        path, data = setup_csv
+
+        ghi, temp = read_environmental_data(path, skiprows=2)
+        assert ghi.shape == (8760, 1)
+        assert ghi[:, 0] == approx(data['ghi'].values)
+        assert temp[:, 0] == approx(data['temp'].values)
+
+        # The sidecar is used from now on, the csv-file is not parsed again
+        def read_csv(*args, **kwargs):
+            raise AssertionError('csv-file parsed again')
+
+        monkeypatch.setattr(pd, 'read_csv', read_csv)
+        cached_ghi, cached_temp = read_environmental_data(path, skiprows=2)
+        assert (cached_ghi == ghi).all()
+        assert (cached_temp == temp).all()
+
+        # Other columns are stored in their own sidecar
+        monkeypatch.undo()
+        wind = read_wind_environmental_data(path, skiprows=2, wind_col=1)
+        assert wind[:, 0] == approx(data['wind'].values)
+
+    def test_modified_file(self, setup_csv):
+        path, data = setup_csv
+        assert load_resource_profiles(path, [3], 2)[0, 0] == approx(data['ghi'][0])
+
+        data['ghi'] += 1
+        with open(path, 'w') as f:
+            f.write('source\nunits\n')
+            data.to_csv(f, index=False)
+        assert load_resource_profiles(path, [3], 2)[0, 0] == approx(data['ghi'][0])
+
+    def test_cache_dir(self, setup_csv, tmp_path, monkeypatch):
+        """With a cache_dir, the sidecar is stored there and nothing is written next to the csv-file"""
+        path, data = setup_csv
+        cache_dir = tmp_path / 'profiles'
+
+        wind = read_wind_environmental_data(path, skiprows=2, wind_col=1, cache_dir=str(cache_dir))
+        assert wind[:, 0] == approx(data['wind'].values)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['profiles', 'resource.csv']
+        assert len(list(cache_dir.glob('resource.csv.*.npy'))) == 1
+
+        def read_csv(*args, **kwargs):
+            raise AssertionError('csv-file parsed again')
+
+        monkeypatch.setattr(pd, 'read_csv', read_csv)
+        assert (read_wind_environmental_data(path, skiprows=2, wind_col=1, cache_dir=str(cache_dir)) == wind).all()
+
+    def test_wrong_length(self, setup_csv):
+        path, data = setup_csv
+
+        with raises(ValueError):
+            load_resource_profiles(path, [3], 3)
+
+
+class TestResourceProfileFolder:
+
+    @fixture
+    def setup_folder(self, tmp_path):
+        """A folder of three profiles in the format of get_pv_data, one of them for a leap year"""
+        hours = np.arange(8760)
+        for latitude, longitude, shift, leap in [(8.5, -11.5, 0, False), (9., -12., 2, True), (-1., 179.5, 4, False)]:
+            ghi = np.clip(np.sin((hours % 24 - 6 - shift) / 12 * np.pi), 0, None) * 900
+            temp = 25 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+            if leap:
+                ghi = np.insert(ghi, 59 * 24, np.zeros(24))
+                temp = np.insert(temp, 59 * 24, np.zeros(24))
+            pd.DataFrame({'time': np.arange(len(ghi)), 'ghi': ghi, 'temp': temp}).to_csv(
+                tmp_path / 'pv_data_lat_{}_long_{}.csv'.format(latitude, longitude), index=False)
+        (tmp_path / 'notes.txt').write_text('not a profile')
+
+        return str(tmp_path)
+
+    def test_index_and_nearest(self, setup_folder):
+        index = resource_profile_index(setup_folder)
+        assert list(index['latitude']) == [-1., 8.5, 9.]
+        assert list(index['longitude']) == [179.5, -11.5, -12.]
+
+        # Nearest on the sphere, also across the antimeridian
+        assert list(nearest_profiles(index, [8.4, 9.1, -1.5, 0.], [-11.4, -12.2, -179.9, 170.])) == [1, 2, 0, 0]
+
+        ghi_curve, temp = load_pv_profile(index['path'][2])
+        assert len(ghi_curve) == 8760
+        assert temp[59 * 24] != 0  # 29 February is left out
+        assert load_pv_profile(index['path'][2])[0] is ghi_curve
+
+    def test_table_per_profile(self, setup_folder, mini_grid_specs):
+        """Each settlement is interpolated in the table of its nearest profile, profiles without settlements are
+        not solved"""
+        specs = dict(mini_grid_specs, min_mg_connections=100)
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        sp.df = pd.DataFrame({SET_GHI: [1900., 2000., 2000.], SET_MG_DIESEL_FUEL + '2025': [0.5, 0.5, 0.5],
+                              SET_POP + '2025': [500, 500, 500], SET_ELEC_FINAL_CODE + '2020': [99, 99, 99],
+                              SET_TIER: [3, 3, 3], SET_ENERGY_PER_CELL + '2025': [10000., 20000., 10000.],
+                              SET_Y_DEG: [8.4, 8.6, 9.1], SET_X_DEG: [-11.4, -11.6, -12.1]})
+
+        lcoe, capacity, investment, table = sp.pv_hybrids_lcoe_lookuptable(2025, 5, 2030, specs, pv_path=setup_folder,
+                                                                           lazy=True, optimizer='grid')
+
+        assert table['lcoe'].shape == (3, 5, 2, 1)
+        assert np.isnan(table['lcoe'][0]).all()
+        assert not np.isnan(table['lcoe'][1][2]).any()
+        assert np.isnan(table['lcoe'][2][2][0])
+        assert (lcoe < 99).all()
+        assert lcoe[2] == approx(table['lcoe'][2][2][1][0])
+        assert lcoe[1] == approx(table['lcoe'][1][2][1][0])
+        assert lcoe[1] != approx(lcoe[2])
+
+
+class TestPrefetchPVData:
+
+    @fixture
+    def setup_server(self):
+        """A local stub of the renewables.ninja PV API, which rate limits the first request of each location once and
+        answers 400 outside of the dataset (latitude > 80)"""
+        requests_made = []
+        limited = set()
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                query = {key: value[0] for key, value in parse_qs(urlparse(self.path).query).items()}
+                requests_made.append((query['lat'], query['lon']))
+                if self.headers.get('Authorization') != 'Token secret':
+                    self.send_response(403)
+                    body = b'{}'
+                elif float(query['lat']) > 80:
+                    self.send_response(400)
+                    body = b'{}'
+                elif (query['lat'], query['lon']) not in limited:
+                    limited.add((query['lat'], query['lon']))
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    body = b'{}'
+                else:
+                    self.send_response(200)
+                    data = {str(1577836800000 + h * 3600000): {'local_time': '2020-01-01 {:02d}:00'.format(h),
+                                                               'irradiance_direct': float(query['lat']) / 1000 * h,
+                                                               'irradiance_diffuse': 0.1, 'temperature': 20. + h}
+                            for h in range(24)}
+                    body = json.dumps({'data': data, 'metadata': {}}).encode()
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield 'http://127.0.0.1:{}/api/'.format(server.server_address[1]), requests_made
+        server.shutdown()
+        server.server_close()
+
+    def test_prefetch_and_resume(self, setup_server, tmp_path):
+        api_base, requests_made = setup_server
+        coordinates = [(8.5, -11.5), (9.0, -12.0), (10.25, -13.0), (85.0, 0.0)]
+
+        result = prefetch_pv_data(coordinates, 'secret', str(tmp_path), workers=3, requests_per_hour=360000, burst=4,
+                                  backoff=0.01, api_base=api_base)
+
+        assert list(result.sort_values('latitude')['status']) == ['downloaded', 'downloaded', 'downloaded', 'failed']
+        # Each location is rate limited once and retried, the location outside the dataset is not retried
+        assert len(requests_made) == 7
+
+        profile = pd.read_csv(pv_data_path(str(tmp_path), 9.0, -12.0))
+        assert list(profile.columns) == ['time', 'ghi', 'temp']
+        assert profile['ghi'][2] == approx((9.0 / 1000 * 2 + 0.1) * 1000)
+        assert profile['temp'][3] == approx(23.)
+        assert profile['time'][0] == '2020-01-01 00:00:00'
+
+        # Running again requests nothing
+        result = prefetch_pv_data(coordinates, 'secret', str(tmp_path), api_base=api_base)
+        assert len(requests_made) == 7
+        assert list(result.sort_values('latitude')['status']) == ['cached', 'cached', 'cached', 'failed']
+
+    def test_invalid_token(self, setup_server, tmp_path):
+        api_base, requests_made = setup_server
+
+        result = prefetch_pv_data([(8.5, -11.5), (9.0, -12.0)], 'wrong', str(tmp_path), workers=1,
+                                  requests_per_hour=360000, api_base=api_base)
+
+        assert (result['status'] == 'failed').all()
+        assert len(requests_made) == 1
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, capacity=5)
+        start = time.monotonic()
+        for i in range(15):
+            bucket.acquire()
+        # 5 at once, then 10 at 100 per second
+        assert time.monotonic() - start == approx(0.1, abs=0.05)
+
+
+class TestPerSettlementOptimization:
+
+    @fixture
+    def setup_settlements(self, tmp_path, mini_grid_specs):
+        """Settlements of which two share all PV-hybrid inputs and one is not a potential mini-grid, and a PV profile
+        in the default format of read_environmental_data"""
+        hours = np.arange(8760)
+        path = tmp_path / 'pv.csv'
+        with open(path, 'w') as f:
+            f.write('\n' * 341882)
+            pd.DataFrame({'time': hours, 'x': 0, 'temp': 25 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi),
+                          'ghi': np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 900}).to_csv(f, index=False)
+
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        sp.df = pd.DataFrame({SET_GHI: [1900., 2100., 1900., 1900.], SET_MG_DIESEL_FUEL + '2025': [0.5, 0.5, 0.5, 0.6],
+                              SET_POP + '2025': [500, 500, 500, 50], SET_ELEC_FINAL_CODE + '2020': [99, 99, 99, 99],
+                              SET_TIER: [3, 3, 3, 3], SET_ENERGY_PER_CELL + '2025': [10000., 10000., 10000., 10000.]})
+        specs = dict(mini_grid_specs, min_mg_connections=100)
+
+        return sp, str(path), specs
+
+    def test_deduplicated(self, setup_settlements, monkeypatch):
+        sp, path, specs = setup_settlements
+        calls = []
+        optimize = SettlementProcessor.optimize_mini_grid
+
+        def counting_optimize(*args, **kwargs):
+            calls.append(args[1:])
+            return optimize(*args, **kwargs)
+
+        monkeypatch.setattr(SettlementProcessor, 'optimize_mini_grid', staticmethod(counting_optimize))
+        lcoe, capacity, investment = sp.pv_hybrids_lcoe(2025, 5, 2030, specs, pv_folder_path=path, seed=1,
+                                                        optimizer='grid')
+
+        assert len(calls) == 2
+        assert lcoe[0] == lcoe[2]
+        assert capacity[0] == capacity[2]
+        assert lcoe[1] < lcoe[0] < 99
+        assert lcoe[3] == 99
+        assert investment[3] == 0
+
+        ghi_curve, temp = read_environmental_data(path)
+        expected = optimize(ghi_curve[:, 0] * 2100. * 1000 / ghi_curve.sum(), temp[:, 0], 10000., 3, 0.5, 2020, 2030,
+                            2025, 5, specs, optimizer='grid')
+        assert lcoe[1] == approx(expected[0])
+        assert sp.df['PVHybridGenLCOE2025'][1] == lcoe[1]
+
+    def test_missing_inputs(self, setup_settlements):
+        """A settlement with a missing GHI or diesel cost does not stop the seeded optimization of the others"""
+        sp, path, specs = setup_settlements
+        sp.df.loc[1, SET_GHI] = np.nan
+        sp.df.loc[2, SET_MG_DIESEL_FUEL + '2025'] = np.nan
+
+        lcoe, capacity, investment = sp.pv_hybrids_lcoe(2025, 5, 2030, specs, pv_folder_path=path, seed=1,
+                                                        optimizer='grid')
+
+        assert lcoe[0] < 99
+        assert lcoe[3] == 99
+
+
+class TestHybridTableCache:
+
+    def test_table_key(self):
+        """The table key changes with the inputs the table depends on, but not with min_mg_connections
+        """
+        curve = np.arange(8760.)
+        specs = {'pv_cost': 1400, 'min_mg_connections': 100}
+        axes = [np.array([1, 2]), np.array([1800., 1900.]), np.array([0.3, 0.4])]
+        config = {'seed': 1}
+
+        key = hybrid_table_key([curve], specs, axes, 2020, 2030, config)
+
+        assert key == hybrid_table_key([curve], dict(specs, min_mg_connections=50), axes, 2020, 2030, config)
+        assert key != hybrid_table_key([curve], dict(specs, pv_cost=1500), axes, 2020, 2030, config)
+        assert key != hybrid_table_key([curve * 2], specs, axes, 2020, 2030, config)
+        assert key != hybrid_table_key([curve], specs, axes, 2025, 2030, config)
+        assert key != hybrid_table_key([curve], specs, axes, 2020, 2030, {'seed': 2})
+
+    def test_save_and_load(self, tmp_path):
+        table = {'tier': np.array([1, 2]), 'lcoe': np.random.rand(2, 3, 4)}
+
+        assert load_hybrid_table(str(tmp_path), 'abc') is None
+
+        save_hybrid_table(str(tmp_path), 'abc', table)
+        loaded = load_hybrid_table(str(tmp_path), 'abc')
+
+        np.testing.assert_array_equal(loaded['tier'], table['tier'])
+        np.testing.assert_array_equal(loaded['lcoe'], table['lcoe'])
+
+    def test_dispatch_store_key(self):
+        """The dispatch store key does not change with the costs or years, but does with the dispatch specs and the
+        optimizer"""
+        curve = np.arange(8760.)
+        specs = {'pv_cost': 1400, 'discount_rate': 0.08, 'n_chg': 0.92, 'n_dis': 0.92, 'dod_max': 0.8,
+                 'inv_eff': 0.93, 'full_life_cycles': 4000}
+        axes = [np.array([1, 2]), np.array([1800., 1900.]), np.array([0.3, 0.4])]
+        optimizer_config = {'optimizer': 'differential_evolution', 'popsize': 15}
+
+        key = dispatch_store_key([curve], specs, axes, optimizer_config)
+
+        assert key == dispatch_store_key([curve], dict(specs, pv_cost=1000, discount_rate=0.1), axes, optimizer_config)
+        assert key != dispatch_store_key([curve], dict(specs, dod_max=0.6), axes, optimizer_config)
+        assert key != dispatch_store_key([curve], specs, axes, {'optimizer': 'grid'})
+        assert key != dispatch_store_key([curve], specs, axes, dict(optimizer_config, representative_days=12))
+        assert key != hybrid_table_key([curve], specs, axes, 2020, 2030, optimizer_config)
+
+    def test_recost(self, mini_grid_specs):
+        """Costing the stored dispatch results gives the same values as simulating the configuration again"""
+        hours = np.arange(8760)
+        ghi = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 800
+        temp = 20 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+        configuration = np.array([5., 10., 1.])
+        load_curve = calc_load_curve(3, 10000)
+
+        dispatch = pv_table_dispatch(configuration, ghi, temp, ghi.sum() / 1000, 3, mini_grid_specs)
+        recosted = pv_table_recost(configuration, dispatch, 3, 0.5, mini_grid_specs, 2020, 2030)
+        simulated = find_least_cost_option_metrics(configuration, temp, ghi, np.arange(8760.), load_curve, 0.93,
+                                                   0.92, 0.92, 0.8, 0.5, 2030, 2020, 1400, 0, 0, 0.93, 0.015, 500,
+                                                   0.1, 10, 150, 10, 25, 300, 0.08, 0.02, 0.5, 4000)
+
+        assert recosted == approx((simulated[0], simulated[3], simulated[8] + simulated[9], simulated[4]))
+
+    def test_recost_representative_days(self, tmp_path, mini_grid_specs):
+        """With representative days, the stored dispatch is that of the representative hours, so re-costing the
+        stored configurations gives the LCOEs they were optimized for"""
+        hours = np.arange(8760)
+        season = 1 + 0.3 * np.cos(hours / 8760 * 2 * np.pi)
+        ghi = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 900 * season
+        temp = 20 + 5 * season + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+
+        def build():
+            return SettlementProcessor.build_pv_hybrid_table(
+                ghi, temp, np.array([3]), np.array([1850.]), np.array([0.45]), np.array([1, 2, 3, 4, 5]),
+                np.array([1800., 1900.]), np.array([0.4, 0.5]), 2025, 5, 2030, mini_grid_specs,
+                cache_dir=str(tmp_path), seed=1, lazy=True, optimizer='grid', recost=True, representative_days=4)
+
+        optimized = build()
+        # Keeps the dispatch store only, so the second build re-costs the stored configurations
+        for path in tmp_path.glob('hybrid_table_*.npz'):
+            with np.load(str(path)) as table:
+                if 'dispatch' not in table.files:
+                    path.unlink()
+        recosted = build()
+
+        solved = ~np.isnan(optimized['lcoe'])
+        assert solved.any()
+        np.testing.assert_array_equal(np.isnan(recosted['lcoe']), ~solved)
+        assert recosted['lcoe'][solved] == approx(optimized['lcoe'][solved])
+
+    def test_unseeded_not_cached(self, tmp_path, mini_grid_specs):
+        """Differential evolution tables are only cached with a seed, as they are not reproducible without"""
+        hours = np.arange(8760)
+        ghi = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 800
+        temp = 20 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+
+        def build(seed):
+            return SettlementProcessor.build_pv_hybrid_table(
+                ghi, temp, np.array([3]), np.array([1800.]), np.array([0.4]), np.array([1, 2, 3, 4, 5]),
+                np.array([1800., 1900.]), np.array([0.4, 0.5]), 2025, 5, 2030, mini_grid_specs,
+                cache_dir=str(tmp_path), seed=seed, lazy=True, optimizer='numba_de')
+
+        build(None)
+        assert list(tmp_path.glob('hybrid_table_*.npz')) == []
+
+        build(1)
+        assert len(list(tmp_path.glob('hybrid_table_*.npz'))) == 1
+
+        sp = SettlementProcessor.__new__(SettlementProcessor)
+        with raises(ValueError):
+            sp.pv_hybrids_lcoe_lookuptable(2025, 5, 2030, mini_grid_specs, cache_dir=str(tmp_path), recost=True)
+
+
+class TestHybridTableInterpolation:
+
+    @fixture
+    def setup_table(self):
+        """A table that is linear in GHI and diesel cost, with one infeasible point"""
+        tiers = np.array([1, 2])
+        ghi = np.array([1800., 2000., 2200.])
+        diesel = np.array([0.4, 0.6])
+        t, g, d = np.meshgrid(tiers, ghi, diesel, indexing='ij')
+        lcoe = 0.1 * t + g / 10000 + d
+        lcoe[1, 2, 1] = 99
+        table = {'tier': tiers, 'ghi': ghi, 'diesel': diesel, 'lcoe': lcoe, 'investment': 1000 * lcoe,
+                 'capacity': lcoe, 'fuel_cost': lcoe}
+
+        return table
+
+    def test_table_axis(self):
+        np.testing.assert_allclose(hybrid_table_axis([1960, 2140], 100), [1900, 2000, 2100, 2200])
+        np.testing.assert_allclose(hybrid_table_axis([0.36, 0.54], 0.1), [0.3, 0.4, 0.5, 0.6])
+        np.testing.assert_allclose(hybrid_table_axis([0.4, 0.4], 0.1), [0.4])
+
+    def test_interpolation(self, setup_table):
+        """Points between, on and outside the grid are interpolated linearly, with values outside clipped
+        """
+        result = interpolate_hybrid_table(setup_table, 'ghi', [1, 1, 2, 1], [1900, 2000, 1850, 2500],
+                                          [0.5, 0.4, 0.45, 0.2])
+
+        assert result['lcoe'] == approx([0.1 + 0.19 + 0.5, 0.1 + 0.2 + 0.4, 0.2 + 0.185 + 0.45, 0.1 + 0.22 + 0.4])
+        assert result['investment'] == approx(1000 * result['lcoe'])
+
+    def test_interpolation_float32(self, setup_table):
+        """In float32 the interpolated values are float32 and close to the float64 ones"""
+        points = [1, 1, 2, 1], [1900, 2000, 1850, 2500], [0.5, 0.4, 0.45, 0.2]
+        result = interpolate_hybrid_table(setup_table, 'ghi', *points, dtype='float32')
+        expected = interpolate_hybrid_table(setup_table, 'ghi', *points)
+
+        assert result['lcoe'].dtype == np.float32
+        assert result['lcoe'] == approx(expected['lcoe'], rel=1e-6)
+
+    def test_infeasible_corners(self, setup_table):
+        """Infeasible corners are left out of the interpolation, and a point with only infeasible corners stays
+        infeasible
+        """
+        result = interpolate_hybrid_table(setup_table, 'ghi', [2, 2], [2100, 2200], [0.6, 0.6])
+
+        assert result['lcoe'][0] == approx(0.2 + 0.2 + 0.6)
+        assert result['lcoe'][1] == 99
+        assert result['investment'][1] == 0
+
+    def test_needed_cells(self, setup_table):
+        """Only the corners with an interpolation weight are needed, and the interpolation does not touch the others
+        """
+        tier, ghi, diesel = [1, 2, 2], [1900, 2000, 2000], [0.4, 0.4, 0.4]
+        cells = hybrid_table_cells(setup_table, 'ghi', tier, ghi, diesel)
+
+        assert cells == [(0, 0, 0), (0, 1, 0), (1, 1, 0)]
+
+        lazy_table = dict(setup_table, lcoe=np.full(setup_table['lcoe'].shape, np.nan))
+        for cell in cells:
+            lazy_table['lcoe'][cell] = setup_table['lcoe'][cell]
+
+        assert interpolate_hybrid_table(lazy_table, 'ghi', tier, ghi, diesel)['lcoe'] == \
+            approx(interpolate_hybrid_table(setup_table, 'ghi', tier, ghi, diesel)['lcoe'])
+
+
+class TestHybridTableCells:
+
+    @fixture
+    def setup_wind_cells(self, mini_grid_specs):
+        hours = np.arange(8760)
+        wind = (5 + 2 * np.sin(hours / 24 * 2 * np.pi)).reshape(-1, 1)  # Shaped as read by read_wind_environmental_data
+        specs = dict(mini_grid_specs, wind_cost=1400, wind_life=25, wind_om=0.015, diesel_limit=0.7)
+        cells = [(0, 0, 0), (0, 1, 1), (1, 1, 0)]
+        args = (np.array([3, 5]), np.array([4.5, 6.]), np.array([0.4, 0.6]), 2025, 5, 2030, specs)
+
+        return cells, {'wind': wind}, args
+
+    def test_table_cell_seed(self):
+        assert table_cell_seed(None, (0, 1, 2)) is None
+        assert table_cell_seed(1, (0, 1, 2)) == table_cell_seed(1, (0, 1, 2))
+        assert table_cell_seed(1, (0, 1, 2)) != table_cell_seed(1, (0, 2, 1))
+        assert table_cell_seed(1, (0, 1, 2)) != table_cell_seed(2, (0, 1, 2))
+
+    def test_serial_and_pool_match(self, setup_wind_cells):
+        """Solving the cells in worker processes gives the same results, in the same order, as solving them serially
+        """
+        cells, profiles, args = setup_wind_cells
+
+        serial = solve_table_cells(SettlementProcessor.solve_wind_table_cell, cells, profiles, args)
+        pooled = solve_table_cells(SettlementProcessor.solve_wind_table_cell, cells, profiles, args, workers=2)
+
+        assert len(serial) == len(cells)
+        assert np.array(pooled) == approx(np.array(serial))
+
+    def test_pooled_simulation_hours(self, mini_grid_specs):
+        """The simulated and saved hours of each cell are returned from the worker processes as well"""
+        hours = np.arange(8760)
+        profiles = {'ghi': np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 800,
+                    'temp': 20 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)}
+        cells = [(0, 0, 0), (0, 1, 0)]
+        args = (np.array([3]), np.array([1800., 2200.]), np.array([0.5]), 2025, 5, 2030, mini_grid_specs, 1, 'grid')
+
+        serial = solve_table_cells(SettlementProcessor.solve_pv_table_cell, cells, profiles, args, full_output=True)
+        pooled = solve_table_cells(SettlementProcessor.solve_pv_table_cell, cells, profiles, args, workers=2,
+                                   full_output=True)
+
+        assert pooled[1] == serial[1]
+        assert all(simulated > 0 and saved > 0 for simulated, saved in pooled[1])
+
+
+class TestWarmStart:
+
+    def test_sweep_chains(self):
+        """One chain per tier, going back and forth over the diesel axis"""
+        cells = [(ti, gi, di) for ti in [1, 0] for gi in range(3) for di in range(2)]
+
+        chains = sweep_chains(cells)
+
+        assert chains[0] == [(0, 0, 0), (0, 0, 1), (0, 1, 1), (0, 1, 0), (0, 2, 0), (0, 2, 1)]
+        assert chains[1] == [(1, 0, 0), (1, 0, 1), (1, 1, 1), (1, 1, 0), (1, 2, 0), (1, 2, 1)]
+
+    def test_warm_start_population(self):
+        min_bounds = np.array([0., 0., 0.])
+        max_bounds = np.array([10., 20., 0.])
+
+        population = warm_start_population([4., 25., 1.], min_bounds, max_bounds, 45, seed=1)
+
+        assert population.shape == (45, 3)
+        assert population[0] == approx([4., 20., 0.])
+        assert (population >= min_bounds).all() and (population <= max_bounds).all()
+        np.testing.assert_array_equal(population, warm_start_population([4., 25., 1.], min_bounds, max_bounds, 45,
+                                                                         seed=1))
+
+
+class TestOptimizers:
+
+    @fixture
+    def setup_cell(self, mini_grid_specs):
+        hours = np.arange(8760)
+        ghi = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * 800
+        temp = 20 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+
+        return ghi, temp, 10000, 3, 0.5, 2020, 2030, 2025, 5, mini_grid_specs
+
+    def test_grid_quadratic(self):
+        """Finds the minimum of a quadratic within the budget, keeping variables with equal bounds fixed"""
+        target = np.array([0.3, 0.7, 0.])
+
+        def func(x):
+            return ((x - target) ** 2).sum()
+
+        def func_batch(X):
+            return ((X - target[:, None]) ** 2).sum(axis=0)
+
+        x, fun, nfev = grid_refine_minimize(func, func_batch, [0, 0, 0], [1, 1, 0], points=4, max_evaluations=100)
+
+        assert x == approx(target, abs=1e-2)
+        assert nfev <= 100
+
+    def test_grid_gap_to_differential_evolution(self, setup_cell):
+        """The grid optimizer uses far fewer evaluations than the differential evolution, for a few % higher LCOE
+        """
+        args = setup_cell
+
+        de = SettlementProcessor.optimize_mini_grid(*args, seed=1, full_output=True)
+        grid = SettlementProcessor.optimize_mini_grid(*args, optimizer='grid', full_output=True)
+
+        assert grid[5] <= 300
+        assert de[5] > 5 * grid[5]
+        assert grid[0] == approx(de[0], rel=0.1)
+
+    def test_warm_start_evaluations(self, setup_cell):
+        """Warm-started from the optimum of a neighbouring diesel cost, the differential evolution evaluates fewer
+        configurations than from a cold start, for about the same LCOE
+        """
+        args = setup_cell
+        neighbour = SettlementProcessor.optimize_mini_grid(*args[:4], 0.6, *args[5:], seed=1, full_output=True)
+
+        cold = SettlementProcessor.optimize_mini_grid(*args, seed=1, full_output=True)
+        warm = SettlementProcessor.optimize_mini_grid(*args, seed=1, warm_start=neighbour[4], full_output=True)
+
+        assert warm[5] < cold[5] / 1.5
+        assert warm[0] == approx(cold[0], rel=0.02)
+
+    def test_numba_de(self, setup_cell):
+        """The compiled differential evolution is reproducible with a seed and close to the scipy one"""
+        args = setup_cell
+
+        de = SettlementProcessor.optimize_mini_grid(*args, seed=1)
+        numba_de = SettlementProcessor.optimize_mini_grid(*args, seed=1, optimizer='numba_de')
+
+        assert numba_de == SettlementProcessor.optimize_mini_grid(*args, seed=1, optimizer='numba_de')
+        assert numba_de[0] == approx(de[0], rel=0.02)
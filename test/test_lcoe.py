@@ -0,0 +1,267 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from onsset.onsset import Technology, set_num_threads
+
+from pytest import fixture, approx, mark
+
+
+class TestTechnologyLcoe:
+
+    @fixture
+    def setup_settlements(self):
+        Technology.set_default_values(base_year=2020, start_year=2021, end_year=2030)
+        rng = np.random.default_rng(0)
+        n = 50
+        return dict(energy_per_cell=pd.Series(rng.uniform(0, 1e6, n)), people=pd.Series(rng.uniform(0, 5000, n)),
+                    num_people_per_hh=4.5, start_year=2021, end_year=2030,
+                    new_connections=pd.Series(rng.uniform(0, 3000, n)),
+                    total_energy_per_cell=pd.Series(rng.uniform(1, 2e6, n)),
+                    prev_code=pd.Series(rng.integers(1, 8, n)), grid_cell_area=pd.Series(rng.uniform(0.1, 10, n)),
+                    base_to_peak_load_ratio=0.8, additional_mv_line_length=pd.Series(rng.uniform(0, 60, n)),
+                    fuel_cost=pd.Series(rng.uniform(0.05, 0.4, n)), unmet_demand=pd.Series(rng.uniform(0, 1e4, n)))
+
+    def test_capital_cost_tiers(self):
+        technology = Technology(capital_cost={float('inf'): 6950, 1: 4470, 0.1: 6950, 0.2: 0, 0.3: 3000})
+        capacity = np.array([0., 0.05, 0.1, 0.15, 0.25, 0.3, 0.99, 1., 5., np.inf, np.nan])
+
+        expected = np.zeros(len(capacity))
+        for key in sorted(technology.capital_cost):
+            expected[(capacity < key) & (expected == 0)] = technology.capital_cost[key]
+
+        assert list(technology.capital_cost_per_kw(capacity)) == list(expected)
+        assert technology.capital_cost_per_kw(0.15) == 3000
+
+        technology.capital_cost = {float('inf'): 1000}
+        assert technology.capital_cost_per_kw(0.15) == 1000
+
+    @staticmethod
+    def yearly_lcoe(technology, settlements, cnse=0):
+        """The LCOE and investment from the costs and generation of each year of the project"""
+        generation, peak_load, td_investment = technology.td_network_cost(
+            settlements['people'], settlements['new_connections'], settlements['prev_code'],
+            settlements['total_energy_per_cell'], settlements['energy_per_cell'], settlements['num_people_per_hh'],
+            settlements['grid_cell_area'], settlements['base_to_peak_load_ratio'],
+            settlements['additional_mv_line_length'])[:3]
+        generation, peak_load, td_investment = np.asarray(generation), np.asarray(peak_load), np.asarray(td_investment)
+        capacity = peak_load / 0.5
+        cap_cost = technology.capital_cost[float('inf')]
+        investment = td_investment + capacity * cap_cost
+        om = td_investment * technology.om_of_td_lines + cap_cost * technology.om_costs * capacity
+
+        project_life = settlements['end_year'] - settlements['start_year'] + 1
+        costs = np.zeros(len(generation))
+        discounted_generation = np.zeros(len(generation))
+        total_investment = np.zeros(len(generation))
+        for year in range(project_life):
+            discount_factor = (1 + technology.discount_rate) ** year
+            if year == 0 or year == technology.tech_life:
+                costs += investment / discount_factor
+                total_investment += investment
+            if year == project_life - 1:
+                used_life = project_life - technology.tech_life if technology.tech_life < project_life \
+                    else project_life - 1
+                costs -= investment * (1 - used_life / technology.tech_life) / discount_factor
+            costs += (om + generation * settlements['fuel_cost'].values + settlements['unmet_demand'].values * cnse) \
+                / discount_factor
+            discounted_generation += generation / discount_factor
+
+        return costs / discounted_generation, total_investment
+
+    def test_lcoe_with_reinvestment(self, setup_settlements):
+        technology = Technology(om_of_td_lines=0.02, distribution_losses=0.05, connection_cost_per_hh=92,
+                                capacity_factor=0.5, tech_life=7, om_costs=0.015,
+                                capital_cost={float('inf'): 2000}, mini_grid=True)
+        lcoe, investment, capacity = technology.get_lcoe(capacity_factor=0.5, **setup_settlements)
+
+        expected_lcoe, expected_investment = self.yearly_lcoe(technology, setup_settlements)
+        assert lcoe[0].values == approx(expected_lcoe, rel=1e-12)
+        assert investment[0].values == approx(expected_investment, rel=1e-12)
+
+    def test_lcoe_with_salvage_and_cnse(self, setup_settlements):
+        technology = Technology(om_of_td_lines=0.02, distribution_losses=0.05, connection_cost_per_hh=92,
+                                capacity_factor=0.5, tech_life=20, om_costs=0.015,
+                                capital_cost={float('inf'): 2000}, mini_grid=True, cnse=0.3)
+        lcoe, investment, capacity = technology.get_lcoe(capacity_factor=0.5, grid_reliability_option='CNSE',
+                                                         **setup_settlements)
+
+        expected_lcoe, expected_investment = self.yearly_lcoe(technology, setup_settlements, cnse=0.3)
+        assert lcoe[0].values == approx(expected_lcoe, rel=1e-12)
+        assert investment[0].values == approx(expected_investment, rel=1e-12)
+
+    def test_numba_backend(self, setup_settlements):
+        """The fused T&D network kernel gives the same network and LCOE as the numpy version"""
+        settlements = dict(setup_settlements)
+        settlements['prev_code'] = pd.Series(np.resize([1, 2, 3, 5, 99], len(settlements['people'])))
+        settlements['people'][:3] = 0
+        for technology in [Technology(om_of_td_lines=0.02, distribution_losses=0.08, connection_cost_per_hh=125,
+                                      capacity_factor=1, tech_life=30, grid_price=0.1),
+                           Technology(om_of_td_lines=0.02, distribution_losses=0.05, connection_cost_per_hh=92,
+                                      capacity_factor=0.5, tech_life=20, om_costs=0.015, mini_grid=True,
+                                      capital_cost={50: 3000, float('inf'): 2000}),
+                           Technology(capacity_factor=0.2, tech_life=15, om_costs=0.075, standalone=True,
+                                      capital_cost={float('inf'): 6950, 0.1: 4470})]:
+            for additional_transformer in [0, 1]:
+                network = technology.td_network_cost(
+                    settlements['people'], settlements['new_connections'], settlements['prev_code'],
+                    settlements['total_energy_per_cell'], settlements['energy_per_cell'],
+                    settlements['num_people_per_hh'], settlements['grid_cell_area'],
+                    settlements['base_to_peak_load_ratio'], settlements['additional_mv_line_length'],
+                    additional_transformer)
+                network_nb = technology.td_network_cost(
+                    settlements['people'], settlements['new_connections'], settlements['prev_code'],
+                    settlements['total_energy_per_cell'], settlements['energy_per_cell'],
+                    settlements['num_people_per_hh'], settlements['grid_cell_area'],
+                    settlements['base_to_peak_load_ratio'], settlements['additional_mv_line_length'],
+                    additional_transformer, backend='numba')
+                for values, values_nb in zip(network, network_nb):
+                    assert values_nb == approx(np.broadcast_to(values, values_nb.shape), rel=1e-12, nan_ok=True)
+
+            lcoe, investment, capacity = technology.get_lcoe(**settlements)
+            lcoe_nb, investment_nb, capacity_nb = technology.get_lcoe(backend='numba', **settlements)
+            assert lcoe_nb[0].values == approx(lcoe[0].values, rel=1e-12, nan_ok=True)
+            assert investment_nb[0].values == approx(investment[0].values, rel=1e-12, nan_ok=True)
+            assert capacity_nb[0].values == approx(capacity[0].values, rel=1e-12, nan_ok=True)
+
+    def test_extension_slope(self, setup_settlements):
+        """The LCOE and investment increase linearly with the extension distance, by the returned slopes"""
+        settlements = dict(setup_settlements)
+        settlements['prev_code'] = pd.Series(np.resize([1, 2, 3, 5, 99], len(settlements['people'])))
+        settlements['total_energy_per_cell'] = settlements['total_energy_per_cell'] * 50
+        del settlements['additional_mv_line_length']
+        technology = Technology(om_of_td_lines=0.02, distribution_losses=0.08, connection_cost_per_hh=125,
+                                capacity_factor=1, tech_life=7, grid_price=0.1, grid_capacity_investment=2000)
+
+        lcoe, investment, capacity, peak_load, lcoe_per_km, investment_per_km = technology.get_lcoe(
+            additional_mv_line_length=0, get_max_dist=True, extension_slope=True, penalty=1.5, **settlements)
+        for distance in [1, 30]:
+            lcoe_far, investment_far = technology.get_lcoe(additional_mv_line_length=distance, get_max_dist=True,
+                                                           penalty=1.5, **settlements)[:2]
+            assert (lcoe_far[0] - lcoe[0]).values == approx(distance * lcoe_per_km[0].values, rel=1e-9)
+            assert (investment_far[0] - investment[0]).values == \
+                approx(distance * investment_per_km[0].values, rel=1e-9)
+        # Grid connected settlements only need a new line if their existing lines can not carry the additional load
+        assert (lcoe_per_km[0] >= 0).all()
+        assert (lcoe_per_km[0][settlements['prev_code'] > 2] > 0).all()
+
+    def test_lcoe_many(self, setup_settlements, monkeypatch):
+        """The LCOE matrix of several technologies is the same as their separate LCOEs, and technologies with the
+        same network parameters share their distribution networks"""
+        settlements = dict(setup_settlements)
+        n = len(settlements['people'])
+        mini_grid = dict(om_of_td_lines=0.02, distribution_losses=0.05, connection_cost_per_hh=100, mini_grid=True,
+                         lv_line_max_length=1, service_transf_type=75, max_nodes_per_serv_trans=95)
+        technologies = [Technology(tech_life=30, capital_cost={float('inf'): 3000}, om_costs=0.03, **mini_grid),
+                        Technology(tech_life=20, hybrid=True, hybrid_fuel=pd.Series(np.full(n, 0.1)),
+                                   hybrid_investment=pd.Series(np.full(n, 1e4)),
+                                   hybrid_capacity=pd.Series(np.full(n, 5.)), **mini_grid),
+                        Technology(tech_life=5, om_costs=0.02, standalone=True,
+                                   capital_cost={float('inf'): 6950, 1: 4470, 0.1: 6380})]
+        per_technology = [{'additional_mv_line_length': settlements.pop('additional_mv_line_length')},
+                          {'capacity_factor': pd.Series(np.full(n, 0.2))},
+                          {'capacity_factor': 0.2, 'base_to_peak_load_ratio': 0.9}]
+
+        calls = []
+        distribution_networks = Technology.distribution_networks
+
+        def counting_distribution_networks(technology, *args):
+            calls.append(technology)
+            return distribution_networks(technology, *args)
+
+        monkeypatch.setattr(Technology, 'distribution_networks', counting_distribution_networks)
+        lcoe, investment, capacity = Technology.get_lcoe_many(technologies, per_technology, **settlements)
+        assert calls == [technologies[0], technologies[2]]
+
+        assert lcoe.shape == (n, 3)
+        for i, technology in enumerate(technologies):
+            expected = technology.get_lcoe(**dict(settlements, **per_technology[i]))
+            assert lcoe[:, i] == approx(expected[0][0].values, nan_ok=True)
+            assert investment[:, i] == approx(expected[1][0].values, nan_ok=True)
+            assert capacity[:, i] == approx(expected[2][0].values, nan_ok=True)
+
+    def test_numba_reliability(self, setup_settlements):
+        """The numba backend gives the same LCOE with the costs of unreliable grid supply, and the same back-up
+        generator costs"""
+        settlements = dict(setup_settlements, fuel_cost_settlement=setup_settlements['fuel_cost'] * 1.5)
+        settlements['unmet_demand'][:3] = 0
+        grid = Technology(om_of_td_lines=0.02, distribution_losses=0.08, connection_cost_per_hh=125,
+                          capacity_factor=1, tech_life=30, grid_price=0.1, cnse=0.3, grid_capacity_investment=2000)
+        backup = Technology(tech_life=10, efficiency=0.28, om_costs=0.1, capacity_factor=0.5, standalone=True,
+                            capital_cost={float('inf'): 938, 1: 1000, 0.5: 1200})
+        for option in ['None', 'CNSE', 'DieselBackup']:
+            results = grid.get_lcoe(grid_reliability_option=option, sa_diesel_calc=backup, **settlements)
+            results_nb = grid.get_lcoe(grid_reliability_option=option, sa_diesel_calc=backup, backend='numba',
+                                       **settlements)
+            for values, values_nb in zip(results, results_nb):
+                assert values_nb[0].values == approx(values[0].values, rel=1e-12)
+
+        arguments = (10, 0, settlements['new_connections'], settlements['num_people_per_hh'],
+                     settlements['energy_per_cell'], settlements['unmet_demand'], settlements['fuel_cost_settlement'],
+                     settlements['base_to_peak_load_ratio'])
+        for values, values_nb in zip(backup.get_lcoe_backup(*arguments),
+                                     backup.get_lcoe_backup(*arguments, backend='numba')):
+            assert values_nb == approx(np.asarray(values), rel=1e-12)
+
+    @fixture
+    def setup_many_settlements(self):
+        """Returns a function making a grid-like Technology and get_lcoe arguments for n random settlements"""
+        def make(n):
+            Technology.set_default_values(base_year=2020, start_year=2021, end_year=2030)
+            rng = np.random.default_rng(1)
+            settlements = dict(energy_per_cell=pd.Series(rng.uniform(0, 1e6, n)),
+                               people=pd.Series(rng.uniform(0, 5000, n)), num_people_per_hh=4.5, start_year=2021,
+                               end_year=2030, new_connections=pd.Series(rng.uniform(0, 3000, n)),
+                               total_energy_per_cell=pd.Series(rng.uniform(1, 2e6, n)),
+                               prev_code=pd.Series(rng.integers(1, 8, n)),
+                               grid_cell_area=pd.Series(rng.uniform(0.1, 10, n)),
+                               base_to_peak_load_ratio=0.8,
+                               additional_mv_line_length=pd.Series(rng.uniform(0, 60, n)),
+                               capacity_factor=pd.Series(rng.uniform(0.1, 0.3, n)))
+            technology = Technology(om_of_td_lines=0.02, distribution_losses=0.05, connection_cost_per_hh=92,
+                                    tech_life=20, om_costs=0.015, capital_cost={50: 3000, float('inf'): 2000},
+                                    mini_grid=True)
+            return technology, settlements
+
+        return make
+
+    def test_numba_threads(self, setup_many_settlements):
+        """The numba backend of get_lcoe gives the numpy results for many settlements, with all and with one thread"""
+        technology, settlements = setup_many_settlements(20000)
+
+        lcoe = technology.get_lcoe(backend='numpy', **settlements)[0]
+        lcoe_nb = technology.get_lcoe(backend='numba', **settlements)[0]
+        previous = set_num_threads(1)
+        try:
+            lcoe_single_thread = technology.get_lcoe(backend='numba', **settlements)[0]
+        finally:
+            set_num_threads(previous)
+
+        assert lcoe_nb[0].values == approx(lcoe[0].values, rel=1e-12, nan_ok=True)
+        assert lcoe_single_thread[0].values == approx(lcoe[0].values, rel=1e-12, nan_ok=True)
+
+    @mark.benchmark
+    def test_numba_benchmark(self, setup_many_settlements):
+        """Times the numpy and numba backends of get_lcoe for 200k settlements, with all and with one thread. Only
+        run with --benchmark (pytest test/test_lcoe.py --benchmark -s), the times are reported, not compared."""
+        technology, settlements = setup_many_settlements(200000)
+
+        def timed(backend):
+            start = time.perf_counter()
+            lcoe = technology.get_lcoe(backend=backend, **settlements)[0]
+            return time.perf_counter() - start, lcoe
+
+        timed('numba')  # Compile the kernels
+        numpy_time, lcoe = timed('numpy')
+        numba_time, lcoe_nb = timed('numba')
+        previous = set_num_threads(1)
+        try:
+            single_thread_time, lcoe_single_thread = timed('numba')
+        finally:
+            set_num_threads(previous)
+        print('get_lcoe of {} settlements: numpy {:.3f} s, numba {:.3f} s, numba with one thread {:.3f} s'.format(
+            len(settlements['people']), numpy_time, numba_time, single_thread_time))
+
+        assert lcoe_nb[0].values == approx(lcoe[0].values, rel=1e-12, nan_ok=True)
+        assert lcoe_single_thread[0].values == approx(lcoe[0].values, rel=1e-12, nan_ok=True)
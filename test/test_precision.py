@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from onsset.onsset import (SET_GHI, SET_LCOE_MG_HYDRO, SET_LCOE_MG_PV_HYBRID, SET_LCOE_MG_WIND, SET_LCOE_SA_PV,
+                           SET_POP, SET_X_DEG, SET_Y_DEG, SettlementProcessor)
+
+from pytest import fixture, raises
+
+
+class TestPrecision:
+
+    @fixture
+    def setup_settlementprocessor(self, off_grid_settlements) -> SettlementProcessor:
+        return off_grid_settlements(2000)
+
+    def test_load(self, tmp_path):
+        """Float columns are loaded as float32, except the coordinates, and an unknown precision is refused"""
+        path = tmp_path / 'settlements.csv'
+        pd.DataFrame({SET_X_DEG: [10.5, 11.5], SET_Y_DEG: [1.25, 2.25], SET_GHI: [1900.5, 2100.5],
+                      SET_POP: [100.5, 200.5], 'Code': [1, 2]}).to_csv(path, index=False)
+
+        settlementprocessor = SettlementProcessor(path, precision='float32')
+
+        assert settlementprocessor.df[SET_GHI].dtype == np.float32
+        assert settlementprocessor.df[SET_POP].dtype == np.float32
+        assert settlementprocessor.df[SET_X_DEG].dtype == np.float64
+        assert settlementprocessor.df[SET_Y_DEG].dtype == np.float64
+        assert settlementprocessor.df['Code'].dtype == np.int64
+        assert SettlementProcessor(path).df[SET_GHI].dtype == np.float64
+        with raises(ValueError):
+            SettlementProcessor(path, precision='float16')
+
+    def test_off_grid_lcoes(self, setup_settlementprocessor, off_grid_arguments):
+        """The float32 off-grid LCOEs and investments are float32 and within the documented tolerance of the float64
+        ones: a relative difference of about 1e-7, and more than 1e-4 for less than 0.1% of the settlements (those close
+        to a capital cost tier or another threshold)"""
+        n = len(setup_settlementprocessor.df)
+        columns = [SET_LCOE_MG_HYDRO + '2025', SET_LCOE_MG_PV_HYBRID + '2025', SET_LCOE_MG_WIND + '2025',
+                   SET_LCOE_SA_PV + '2025']
+
+        expected = setup_settlementprocessor
+        single = SettlementProcessor.__new__(SettlementProcessor)
+        single.df = expected.df.copy()
+        single.precision = 'float32'
+        single.cast_precision()
+        expected_investments = expected.calculate_off_grid_lcoes(*off_grid_arguments(n), choose_minimum=False)[::2]
+        investments = single.calculate_off_grid_lcoes(*off_grid_arguments(n, dtype='float32'),
+                                                      choose_minimum=False)[::2]
+
+        for values, expected_values in [(single.df[columns], expected.df[columns])] + \
+                list(zip(investments, expected_investments)):
+            assert (values.dtypes == np.float32).all()
+            values, expected_values = values.to_numpy(dtype='float64'), expected_values.to_numpy()
+            assert (np.isnan(values) == np.isnan(expected_values)).all()
+            values, expected_values = values[~np.isnan(values)], expected_values[~np.isnan(expected_values)]
+            relative = np.abs(values - expected_values) / np.where(expected_values == 0, 1, np.abs(expected_values))
+            assert np.median(relative) < 1e-6
+            assert np.mean(relative > 1e-4) < 1e-3